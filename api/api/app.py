@@ -8,6 +8,7 @@ from rq import Queue
 
 from api.flask_secure_cookie import SecureCookie
 from api.tools import get_db, get_redis_connection, files_loader
+from api.puzzle_rules import PuzzlePolicyEngine
 
 
 class API(Flask):
@@ -37,6 +38,14 @@ def set_redis_connection():
 redis_connection = LocalProxy(set_redis_connection)
 
 
+def get_binary_redis_connection():
+    "The connection that was created with the app for values that are binary."
+    return current_app.binary_redis_connection
+
+
+binary_redis_connection = LocalProxy(get_binary_redis_connection)
+
+
 def make_app(config=None, database_writable=False, **kw):
     app = API("api")
     app.config_file = config
@@ -59,6 +68,14 @@ def make_app(config=None, database_writable=False, **kw):
 
     app.queries = files_loader("queries")
 
+    app.puzzle_policies = PuzzlePolicyEngine(app.config)
+
+    # The packed piece positions are binary so can't be decoded. The one
+    # connection (and its pool) is shared by all requests.
+    app.binary_redis_connection = get_redis_connection(
+        app.config, decode_responses=False
+    )
+
     app.cleanupqueue = Queue("puzzle_cleanup", connection=redis_connection)
     app.createqueue = Queue("puzzle_create", connection=redis_connection)
     app.unsplashqueue = Queue("unsplash_image_fetch", connection=redis_connection)
@@ -0,0 +1,93 @@
+"""
+Enforcer puzzle leases
+
+More than one enforcer instance can run and each active puzzle is handled by
+only one of them.  An instance owns a puzzle while it has the lease
+(enforcerlease:{puzzle}) which is set with NX so there is only ever one owner.
+The owner renews the lease on each heartbeat and releases it when the puzzle
+is no longer active.  The lease of an instance that stopped without releasing
+it expires after LEASE_TIMEOUT and any instance can then take over the puzzle.
+
+Each instance adds itself to the enforcerinstances sorted set on each
+heartbeat with the time as the score.  The instances that have not sent a
+heartbeat within INSTANCE_TIMEOUT are removed from it.  The preferred instance
+for a puzzle is picked from the live instances with rendezvous hashing so
+only the puzzles for an instance that joins or leaves are moved.  An instance
+only takes a lease for a puzzle that it is the preferred instance for and it
+releases the puzzles that it is no longer the preferred instance for.
+"""
+import hashlib
+
+from api.puzzle_keys import get_puzzle_key
+from api.redis_scripts import run_script
+
+ENFORCER_INSTANCES_KEY = "enforcerinstances"
+
+HEARTBEAT_INTERVAL = 5
+INSTANCE_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+# The lease needs to be longer than the time it takes to create the index for
+# a puzzle since the owner does not send a heartbeat while doing that.
+LEASE_TIMEOUT = 30
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def get_enforcer_lease_key(puzzle):
+    return get_puzzle_key("enforcerlease", puzzle)
+
+
+def heartbeat_instance(redis_connection, instance, now):
+    "Record the heartbeat of the instance and return the list of live instances."
+    with redis_connection.pipeline(transaction=False) as pipe:
+        pipe.zadd(ENFORCER_INSTANCES_KEY, {instance: now})
+        pipe.zremrangebyscore(ENFORCER_INSTANCES_KEY, "-inf", now - INSTANCE_TIMEOUT)
+        pipe.zrange(ENFORCER_INSTANCES_KEY, 0, -1)
+        (_, _, instances) = pipe.execute()
+    return list(map(_decode, instances))
+
+
+def remove_instance(redis_connection, instance):
+    redis_connection.zrem(ENFORCER_INSTANCES_KEY, instance)
+
+
+def get_preferred_instance(puzzle, instances):
+    "The instance with the highest hash of the instance and puzzle."
+    if not instances:
+        return None
+    return max(
+        instances,
+        key=lambda instance: hashlib.sha1(f"{instance}:{puzzle}".encode()).hexdigest(),
+    )
+
+
+def acquire_lease(redis_connection, puzzle, instance):
+    "Returns True if the instance has the lease on the puzzle."
+    if redis_connection.set(
+        get_enforcer_lease_key(puzzle), instance, nx=True, px=LEASE_TIMEOUT * 1000
+    ):
+        return True
+    return renew_lease(redis_connection, puzzle, instance)
+
+
+def renew_lease(redis_connection, puzzle, instance):
+    "Returns False if the lease has been lost to a different instance."
+    return (
+        run_script(
+            redis_connection,
+            "renew_enforcer_lease",
+            keys=[get_enforcer_lease_key(puzzle)],
+            args=[instance, LEASE_TIMEOUT * 1000],
+        )
+        == 1
+    )
+
+
+def release_lease(redis_connection, puzzle, instance):
+    run_script(
+        redis_connection,
+        "release_enforcer_lease",
+        keys=[get_enforcer_lease_key(puzzle)],
+        args=[instance],
+    )
@@ -32,6 +32,7 @@ class APITestCase(unittest.TestCase):
         self.tmp_purge_list = tempfile.NamedTemporaryFile()
         self.tmp_puzzle_resources = tempfile.mkdtemp()
         self.tmp_puzzle_archive = tempfile.mkdtemp()
+        self.tmp_puzzle_geometry = tempfile.mkdtemp()
         cookie_secret = "oatmeal"
         self.app = make_app(
             HOST="127.0.0.1",
@@ -143,6 +144,7 @@ class APITestCase(unittest.TestCase):
             TESTING=True,  # Ignore wal journal_mode requirement
             PUZZLE_RESOURCES=self.tmp_puzzle_resources,
             PUZZLE_ARCHIVE=self.tmp_puzzle_archive,
+            PUZZLE_GEOMETRY=self.tmp_puzzle_geometry,
             PURGEURLLIST=self.tmp_purge_list.name,
             MINIMUM_PIECE_COUNT=20,
             MAX_POINT_COST_FOR_REBUILDING=1000,
@@ -168,7 +170,11 @@ class APITestCase(unittest.TestCase):
     def tearDown(self):
         """Get rid of the temporary sqlite database and redis test db (1) after each test."""
         self.tmp_db.close()
-        for tmp_dir in (self.tmp_puzzle_resources, self.tmp_puzzle_archive):
+        for tmp_dir in (
+            self.tmp_puzzle_resources,
+            self.tmp_puzzle_archive,
+            self.tmp_puzzle_geometry,
+        ):
             if tmp_dir.startswith("/tmp/"):
                 shutil.rmtree(tmp_dir)
             else:
@@ -20,7 +20,13 @@ from api.tools import loadConfig, get_redis_connection
 from api.constants import RENDERING_FAILED, BUGGY_UNLISTED
 
 # Preload libs
-from api.jobs import convertPiecesToDB, piece_forker, piece_reset, unsplash_image
+from api.jobs import (
+    convertPiecesToDB,
+    piece_forker,
+    piece_reset,
+    puzzle_complete,
+    unsplash_image,
+)
 
 listen = ["puzzle_cleanup", "unsplash_image_fetch"]
 
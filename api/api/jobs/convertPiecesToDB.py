@@ -23,6 +23,9 @@ import requests
 from api.app import redis_connection, db, make_app
 from api.database import rowify, read_query_file
 from api.tools import loadConfig, deletePieceDataFromRedis
+from api.piece_mutate import resolve_piece_group_positions
+from api.piece_status import get_status_pieces
+from api.puzzle_keys import get_puzzle_key, get_pcupdates_key, get_pcupdates
 from api.constants import MAINTENANCE
 
 
@@ -79,13 +82,16 @@ def transfer(puzzle, cleanup=True, skip_status_update=False):
 
     # Save the redis data to the db if it has changed
     changed_pieces = []
-    pcstacked = set(map(int, redis_connection.smembers(f"pcstacked:{puzzle}")))
-    pcfixed = set(map(int, redis_connection.smembers(f"pcfixed:{puzzle}")))
-    for piece in all_pieces:
+    pcstacked = get_status_pieces(redis_connection, get_puzzle_key("pcstacked", puzzle))
+    pcfixed = get_status_pieces(redis_connection, get_puzzle_key("pcfixed", puzzle))
+    piecesFromRedis = [
+        redis_connection.hgetall(get_puzzle_key("pc", puzzle, piece["id"]))
+        for piece in all_pieces
+    ]
+    # Pieces in a piece group may be stored relative to the group origin.
+    resolve_piece_group_positions(redis_connection, puzzle, piecesFromRedis)
+    for (piece, pieceFromRedis) in zip(all_pieces, piecesFromRedis):
         has_changes = False
-        pieceFromRedis = redis_connection.hgetall(
-            "pc:{puzzle}:{id}".format(puzzle=puzzle, id=piece["id"])
-        )
 
         # The redis data may be empty so skip updating the db
         if len(pieceFromRedis) == 0:
@@ -165,12 +171,12 @@ def transferOldest(target_memory):
     newest = int(time.time()) - (30 * 60)
 
     # Get the 10 oldest puzzles
-    puzzles = redis_connection.zrange("pcupdates", 0, 10, withscores=True)
+    puzzles = get_pcupdates(redis_connection, withscores=True)[:11]
     # print('cycle over old puzzles: {0}'.format(puzzles))
     for (puzzle, timestamp) in puzzles:
         # There may be a chance that since this process has started that
         # a puzzle could have been updated.
-        latest_timestamp = redis_connection.zscore("pcupdates", puzzle)
+        latest_timestamp = redis_connection.zscore(get_pcupdates_key(puzzle), puzzle)
 
         if latest_timestamp < newest:
             # print('transfer: {0}'.format(puzzle))
@@ -183,7 +189,7 @@ def transferOldest(target_memory):
 
 def transferAll(cleanup=False):
     # Get all puzzles
-    puzzles = redis_connection.zrange("pcupdates", 0, -1)
+    puzzles = get_pcupdates(redis_connection)
     current_app.logger.info("transferring puzzles: {0}".format(puzzles))
     for puzzle in puzzles:
         current_app.logger.info("transfer puzzle: {0}".format(puzzle))
@@ -15,6 +15,12 @@ from api.database import rowify
 from api.tools import (
     loadConfig,
 )
+from api.piece_positions import get_piece_positions_key, pack_piece_positions
+from api.puzzle_keys import (
+    get_puzzle_key,
+    get_pcupdates_key,
+    register_puzzle_keys,
+)
 
 
 def convert(puzzle):
@@ -25,16 +31,15 @@ def convert(puzzle):
         cur.execute(query, {"puzzle": puzzle}).fetchall(), cur.description
     )
 
-    pzm_puzzle_key = "pzm:{puzzle}".format(puzzle=puzzle)
+    pzm_puzzle_key = get_puzzle_key("pzm", puzzle)
     # Bump the pzm id when preparing to mutate the puzzle.
     puzzle_mutation_id = redis_connection.incr(pzm_puzzle_key)
 
     # Create a pipe for buffering commands to load up piece data
+    piece_group_keys = set()
     with redis_connection.pipeline(transaction=True) as pipe:
         for piece in all_pieces:
-            pc_puzzle_piece_key = "pc:{puzzle}:{piece}".format(
-                puzzle=puzzle, piece=piece["id"]
-            )
+            pc_puzzle_piece_key = get_puzzle_key("pc", puzzle, piece["id"])
             # print('convert piece {id} for puzzle: {puzzle}'.format(**piece))
             offsets = {}
             for (k, v) in [x.split(":") for x in piece.get("adjacent", "").split(" ")]:
@@ -59,11 +64,10 @@ def convert(puzzle):
             pieceParent = piece.get("parent", None)
             if pieceParent != None:
                 pipe.sadd(
-                    "pcg:{puzzle}:{parent}".format(
-                        puzzle=puzzle, parent=piece["parent"]
-                    ),
+                    get_puzzle_key("pcg", puzzle, piece["parent"]),
                     piece["id"],
                 )
+                piece_group_keys.add(get_puzzle_key("pcg", puzzle, piece["parent"]))
                 pipe.hset(pc_puzzle_piece_key, "g", piece["parent"])
 
             pieceStatus = piece.get("status", None)
@@ -76,15 +80,27 @@ def convert(puzzle):
                 )  # in case it's from the actual results of the query
                 if pieceStatus == 1:
                     # Add Piece Fixed (immovable)
-                    pipe.sadd("pcfixed:{puzzle}".format(puzzle=puzzle), piece["id"])
+                    pipe.setbit(get_puzzle_key("pcfixed", puzzle), piece["id"], 1)
                 elif pieceStatus == 2:
                     # Add Piece Stacked
-                    pipe.sadd("pcstacked:{puzzle}".format(puzzle=puzzle), piece["id"])
+                    pipe.setbit(get_puzzle_key("pcstacked", puzzle), piece["id"], 1)
+
+        if piece_group_keys:
+            register_puzzle_keys(pipe, puzzle, *piece_group_keys)
 
-        # Add to the pcupdates sorted set
-        pipe.zadd("pcupdates", {puzzle: int(time.time())})
+        # Add the packed piece positions
+        pipe.set(
+            get_piece_positions_key(puzzle),
+            pack_piece_positions(
+                [dict(piece, g=piece.get("parent")) for piece in all_pieces]
+            ),
+        )
 
         pipe.execute()
+
+    # Add to the pcupdates sorted set. It is not in the same hash slot as the
+    # keys for the puzzle.
+    redis_connection.zadd(get_pcupdates_key(puzzle), {puzzle: int(time.time())})
     cur.close()
 
 
@@ -17,6 +17,7 @@ from flask import current_app
 from api.app import redis_connection, db, make_app
 from api.database import rowify, read_query_file
 from api.tools import loadConfig, deletePieceDataFromRedis
+from api.puzzle_keys import get_puzzle_key, get_pcupdates
 from api.constants import MAINTENANCE
 
 
@@ -29,7 +30,7 @@ def find_puzzles_in_redis(results={}):
     _results = results.copy()
     cur = db.cursor()
 
-    puzzles_in_redis = redis_connection.zrange("pcupdates", 0, -1)
+    puzzles_in_redis = get_pcupdates(redis_connection)
     for puzzle in puzzles_in_redis:
         test_result = _results.get(puzzle, {"puzzle": puzzle, "msg": "", "test": []})
         test_result["test"].append("redis")
@@ -56,12 +57,12 @@ def find_puzzles_in_redis(results={}):
 
         # Compare the counts for the pcfixed and the top left piece group.  They
         # should be the same.
-        pcfixed_count = redis_connection.scard("pcfixed:{puzzle}".format(puzzle=puzzle))
+        pcfixed_count = redis_connection.bitcount(get_puzzle_key("pcfixed", puzzle))
         pcg_for_top_left = redis_connection.hget(
-            "pc:{puzzle}:{id}".format(puzzle=puzzle, id=top_left_piece["id"]), "g"
+            get_puzzle_key("pc", puzzle, top_left_piece["id"]), "g"
         )
         immovable_top_left_group_count = redis_connection.scard(
-            "pcg:{puzzle}:{group}".format(puzzle=puzzle, group=pcg_for_top_left)
+            get_puzzle_key("pcg", puzzle, pcg_for_top_left)
         )
         if pcfixed_count == immovable_top_left_group_count:
             # Test passed.
@@ -0,0 +1,102 @@
+import sqlite3
+import sys
+import logging
+
+from api.database import rowify, read_query_file
+from api.tools import loadConfig, get_redis_connection
+from api.piece_status import set_status_pieces
+from api.piece_positions import get_piece_positions_key, pack_piece_positions
+from api.piece_geometry import write_piece_geometry
+from api.puzzle_keys import (
+    PUZZLE_KEY_NAMES,
+    get_puzzle_key,
+    get_pcupdates_key,
+    get_pcupdates,
+    register_puzzle_keys,
+)
+
+# Get the args and connect to the database and redis
+config_file = sys.argv[1]
+config = loadConfig(config_file)
+
+db_file = config["SQLITE_DATABASE_URI"]
+db = sqlite3.connect(db_file)
+
+redis_connection = get_redis_connection(config, decode_responses=True)
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG if config["DEBUG"] else logging.INFO)
+
+if __name__ == "__main__":
+
+    ## Update
+    # The keys for a puzzle now have the puzzle id as the hash tag.  The t keys
+    # for the player marks expire quickly and are not renamed.
+    for name in PUZZLE_KEY_NAMES + ("batchpoints",):
+        for key in redis_connection.scan_iter(match=f"{name}:*"):
+            parts = key.split(":")
+            if "{" in key or (name == "batchpoints" and len(parts) != 3):
+                continue
+            redis_connection.rename(key, get_puzzle_key(name, *parts[1:]))
+        logger.info(f"Renamed the {name} keys")
+
+    # The pcupdates sorted set is now split into shards.
+    for puzzle, timestamp in redis_connection.zrange(
+        "pcupdates", 0, -1, withscores=True
+    ):
+        redis_connection.zadd(get_pcupdates_key(puzzle), {puzzle: timestamp})
+    redis_connection.delete("pcupdates")
+
+    # The pcfixed and pcstacked sets are now stored as bitmaps.
+    for pattern in ("pcfixed:*", "pcstacked:*"):
+        for key in redis_connection.scan_iter(match=pattern):
+            if redis_connection.type(key) != "set":
+                continue
+            pieces = redis_connection.smembers(key)
+            with redis_connection.pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                set_status_pieces(pipe, key, pieces)
+                pipe.execute()
+            logger.info(f"Converted {key} to a bitmap of {len(pieces)} pieces")
+
+    # Add the packed piece positions for the puzzles that are in redis.
+    for puzzle in get_pcupdates(redis_connection):
+        pieces = []
+        for key in redis_connection.scan_iter(match=get_puzzle_key("pc", puzzle, "*")):
+            piece = redis_connection.hgetall(key)
+            piece["id"] = key.split(":")[2]
+            pieces.append(piece)
+        redis_connection.set(
+            get_piece_positions_key(puzzle), pack_piece_positions(pieces)
+        )
+        logger.info(f"Added packed piece positions for {len(pieces)} pieces")
+
+    # Add the piece group keys for the puzzles that are in redis to the
+    # registry of keys for the puzzle.
+    for puzzle in get_pcupdates(redis_connection):
+        keys = []
+        for name in ("pcg", "pcgo", "pcgm"):
+            keys.extend(
+                redis_connection.scan_iter(match=get_puzzle_key(name, puzzle, "*"))
+            )
+        if keys:
+            register_puzzle_keys(redis_connection, puzzle, *keys)
+        logger.info(f"Registered {len(keys)} piece group keys for puzzle {puzzle}")
+
+    # Write the piece geometry files for all puzzles with pieces.
+    cur = db.cursor()
+    puzzles = [
+        row[0] for row in cur.execute("select distinct puzzle from Piece;").fetchall()
+    ]
+    for puzzle in puzzles:
+        (piece_properties, _) = rowify(
+            cur.execute(
+                read_query_file("select_immutable_piece_props_for_puzzle.sql"),
+                {"puzzle": puzzle},
+            ).fetchall(),
+            cur.description,
+        )
+        write_piece_geometry(config, puzzle, piece_properties)
+    logger.info(f"Wrote piece geometry files for {len(puzzles)} puzzles")
+    cur.close()
@@ -2,20 +2,28 @@ from __future__ import division
 from builtins import map
 import time
 import sys
-from datetime import timedelta
 
 from flask import current_app
 from flask_sse import sse
-import requests
 from redis.exceptions import WatchError
 
 from api.app import redis_connection
-from api.tools import (
-    purge_route_from_nginx_cache,
+from api.constants import COMPLETED, PRIVATE
+from api.piece_mutate import (
+    PieceMutateProcess,
+    PieceMutateScript,
+    PieceMutateError,
+    CONCURRENCY_PUZZLE,
+    ENGINE_SCRIPT,
+    GROUP_POSITIONS_ABSOLUTE,
+    GROUP_POSITIONS_RELATIVE,
 )
-from api.constants import COMPLETED, QUEUE_END_OF_LINE, PRIVATE
-from api.piece_mutate import PieceMutateProcess, PieceMutateError
 from api.user import ANONYMOUS_USER_ID
+from api.ledger import get_score_ledger
+from api.jobs.puzzle_complete import enqueue_puzzle_complete
+from api.puzzle_keys import get_puzzle_key, get_pcupdates_key
+from api.player_session import get_player_session_key, get_expires_field
+from api.presence import record_presence
 
 KARMA_POINTS_EXPIRE = 3600  # hour in seconds
 PIECE_GROUP_MOVE_MAX_BEFORE_PENALTY = 5
@@ -61,12 +69,10 @@ def attempt_piece_movement(ip, user, puzzleData, piece, x, y, r, karma_change, k
 
     finally:
         current_app.logger.debug("bump pzq_current")
-        pzq_current_key = "pzq_current:{puzzle}".format(puzzle=puzzleData["puzzle"])
-        pzq_next_key = "pzq_next:{puzzle}".format(puzzle=puzzleData["puzzle"])
+        pzq_current_key = get_puzzle_key("pzq_current", puzzleData["puzzle"])
         piece_move_timeout = current_app.config["PIECE_MOVE_TIMEOUT"]
         redis_connection.incr(pzq_current_key, amount=1)
         redis_connection.expire(pzq_current_key, piece_move_timeout + 2)
-        redis_connection.expire(pzq_next_key, piece_move_timeout + 2)
     return (msg, karma_change)
 
 
@@ -77,72 +83,76 @@ def translate(ip, user, puzzleData, piece, x, y, r, karma_change, karma):
     def publishMessage(msg, karma_change, karma, points=0, complete=False):
         # print(topic)
         # print(msg)
-        if current_app.config.get("PUZZLE_PIECES_CACHE_TTL"):
-            stamp = redis_connection.get(f"pzstamp:{puzzle}")
-            if stamp:
-                pcu_key = f"pcu:{stamp}"
-                redis_connection.rpushx(pcu_key, msg)
+        score_ledger = get_score_ledger(current_app.config)
+        points_key = "points:{user}".format(user=user)
+        with redis_connection.pipeline(transaction=False) as pipe:
+            pipe.get(get_puzzle_key("pzstamp", puzzle))
+            pipe.get(points_key)
+            (stamp, recent_points) = pipe.execute()
+        recent_points = int(recent_points or 0)
+
+        if current_app.config.get("PUZZLE_PIECES_CACHE_TTL") and stamp:
+            pcu_key = f"pcu:{stamp}"
+            redis_connection.rpushx(pcu_key, msg)
         sse.publish(
             msg,
             type="move",
             channel="puzzle:{puzzle_id}".format(puzzle_id=puzzleData["puzzle_id"]),
         )
 
-        if user != ANONYMOUS_USER_ID:
-            points_key = "points:{user}".format(user=user)
-            recent_points = int(redis_connection.get(points_key) or 0)
-            if karma_change < 0 and karma <= 0 and recent_points > 0:
-                redis_connection.decr(points_key)
-
-        redis_connection.zadd("pcupdates", {puzzle: now})
+        score_ledger.zadd(get_pcupdates_key(puzzle), puzzle, now)
 
         if user != ANONYMOUS_USER_ID:
             # bump the m_date for this player on the puzzle and timeline
-            redis_connection.zadd(
-                "timeline:{puzzle}".format(puzzle=puzzle), {user: now}
-            )
-            redis_connection.zadd("timeline", {user: now})
-
-        # Update player points
-        if points != 0 and user is not None and user != ANONYMOUS_USER_ID:
-            redis_connection.zincrby(
-                "score:{puzzle}".format(puzzle=puzzle), amount=1, value=user
-            )
-            redis_connection.sadd("batchuser", user)
-            redis_connection.sadd("batchpuzzle", puzzle)
-            redis_connection.incr("batchscore:{user}".format(user=user), amount=1)
-            redis_connection.incr(
-                "batchpoints:{puzzle}:{user}".format(puzzle=puzzle, user=user),
-                amount=points,
-            )
-            redis_connection.zincrby("rank", amount=1, value=user)
-            pieces = int(puzzleData["pieces"])
-            # Skip increasing dots if puzzle is private
-            earns = get_earned_points(pieces, permission=puzzleData.get("permission"))
-
-            # karma = int(redis_connection.get(karma_key))
-            ## Max out recent points
-            if (
-                earns != 0
-                and karma >= current_app.config["MAX_KARMA"]
-                and recent_points < current_app.config["MAX_RECENT_POINTS"]
-            ):
-                recent_points = redis_connection.incr(points_key)
-            # Doing small puzzles doesn't increase recent points, just extends points expiration.
-            redis_connection.expire(
-                points_key, current_app.config["RECENT_POINTS_EXPIRE"]
-            )
-
-            # Extend the karma points expiration since it has increased
-            redis_connection.expire(
-                karma_key, current_app.config["KARMA_POINTS_EXPIRE"]
-            )
-            # Max out karma
-            if karma < current_app.config["MAX_KARMA"]:
-                karma = redis_connection.incr(karma_key)
-            karma_change += 1
+            score_ledger.zadd(get_puzzle_key("timeline", puzzle), user, now)
+            score_ledger.zadd("timeline", user, now)
+            record_presence(score_ledger, user, now, puzzle)
+
+        with redis_connection.pipeline(transaction=False) as pipe:
+            if user != ANONYMOUS_USER_ID:
+                if karma_change < 0 and karma <= 0 and recent_points > 0:
+                    pipe.decr(points_key)
+
+            # Update player points
+            if points != 0 and user is not None and user != ANONYMOUS_USER_ID:
+                pipe.zincrby(get_puzzle_key("score", puzzle), amount=1, value=user)
+                pipe.sadd("batchuser", user)
+                pipe.sadd("batchpuzzle", puzzle)
+                pipe.incrby("batchscore:{user}".format(user=user), amount=1)
+                pipe.incrby(
+                    get_puzzle_key("batchpoints", puzzle, user),
+                    amount=points,
+                )
+                pipe.zincrby("rank", amount=1, value=user)
+                pieces = int(puzzleData["pieces"])
+                # Skip increasing dots if puzzle is private
+                earns = get_earned_points(pieces, permission=puzzleData.get("permission"))
+
+                ## Max out recent points
+                if (
+                    earns != 0
+                    and karma >= current_app.config["MAX_KARMA"]
+                    and recent_points < current_app.config["MAX_RECENT_POINTS"]
+                ):
+                    recent_points += 1
+                    pipe.incr(points_key)
+                # Doing small puzzles doesn't increase recent points, just extends points expiration.
+                pipe.expire(points_key, current_app.config["RECENT_POINTS_EXPIRE"])
+
+                # Extend the karma points expiration since it has increased
+                pipe.hset(
+                    session_key,
+                    get_expires_field("karma"),
+                    now + current_app.config["KARMA_POINTS_EXPIRE"],
+                )
+                # Max out karma
+                if karma < current_app.config["MAX_KARMA"]:
+                    karma += 1
+                    pipe.hincrby(session_key, "karma", 1)
+                karma_change += 1
 
-            redis_connection.incr("batchpoints:{user}".format(user=user), amount=earns)
+                pipe.incrby("batchpoints:{user}".format(user=user), amount=earns)
+            pipe.execute()
 
         if complete:
             current_app.logger.info(
@@ -156,44 +166,12 @@ def translate(ip, user, puzzleData, piece, x, y, r, karma_change, karma):
                 channel="puzzle:{puzzle_id}".format(puzzle_id=puzzleData["puzzle_id"]),
             )
 
-            r = requests.patch(
-                "http://{HOSTAPI}:{PORTAPI}/internal/puzzle/{puzzle_id}/details/".format(
-                    HOSTAPI=current_app.config["HOSTAPI"],
-                    PORTAPI=current_app.config["PORTAPI"],
-                    puzzle_id=puzzleData["puzzle_id"],
-                ),
-                json={
-                    "status": COMPLETED,
-                    "m_date": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
-                    "queue": QUEUE_END_OF_LINE,
-                },
-            )
-            if r.status_code != 200:
-                raise Exception(
-                    "Puzzle details api error when updating puzzle to be complete"
-                )
-            # Delaying helps avoid issues for players that are moving the last
-            # piece of the puzzle as someone else completes it.
-            delay = (
-                current_app.config["MAX_PAUSE_PIECES_TIMEOUT"]
-                + current_app.config["PIECE_MOVE_TIMEOUT"]
-                + 2
-            )
-            current_app.logger.info(
-                f"Delaying puzzle transfer on completed puzzle ({puzzleData['puzzle_id']}) for {delay} seconds"
-            )
-            job = current_app.cleanupqueue.enqueue_in(
-                timedelta(seconds=delay),
-                "api.jobs.convertPiecesToDB.transfer",
+            # The rest of the puzzle complete work is done by the janitor so
+            # this piece move doesn't need to wait for it.
+            enqueue_puzzle_complete(
+                puzzleData["puzzle_id"],
                 puzzle,
-                result_ttl=0,
-            )
-
-            purge_route_from_nginx_cache(
-                "/chill/site/front/{puzzle_id}/".format(
-                    puzzle_id=puzzleData["puzzle_id"]
-                ),
-                current_app.config.get("PURGEURLLIST"),
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
             )
 
         if karma_change and user != ANONYMOUS_USER_ID:
@@ -216,9 +194,9 @@ def translate(ip, user, puzzleData, piece, x, y, r, karma_change, karma):
 
     puzzle = puzzleData["puzzle"]
 
-    karma_key = "karma:{puzzle}:{ip}".format(puzzle=puzzle, ip=ip)
+    session_key = get_player_session_key(puzzle, ip)
 
-    pc_puzzle_piece_key = "pc:{puzzle}:{piece}".format(puzzle=puzzle, piece=piece)
+    pc_puzzle_piece_key = get_puzzle_key("pc", puzzle, piece)
 
     # check if piece can be moved
     has_y = redis_connection.hget(
@@ -229,7 +207,7 @@ def translate(ip, user, puzzleData, piece, x, y, r, karma_change, karma):
         err_msg = {"msg": "piece not available", "type": "missing"}
         return (err_msg, 0)
 
-    if redis_connection.sismember(f"pcfixed:{puzzle}", piece) == 1:
+    if redis_connection.getbit(get_puzzle_key("pcfixed", puzzle), piece) == 1:
         # immovable
         err_msg = {
             "msg": "piece can't be moved",
@@ -249,7 +227,17 @@ def translate(ip, user, puzzleData, piece, x, y, r, karma_change, karma):
     if y > puzzleData["table_height"]:
         y = puzzleData["table_height"]
 
-    piece_mutate_process = PieceMutateProcess(
+    group_positions = current_app.config.get(
+        "PIECE_GROUP_POSITIONS", GROUP_POSITIONS_ABSOLUTE
+    )
+    if (
+        current_app.config.get("PIECE_MUTATE_ENGINE") == ENGINE_SCRIPT
+        and group_positions != GROUP_POSITIONS_RELATIVE
+    ):
+        piece_mutate_class = PieceMutateScript
+    else:
+        piece_mutate_class = PieceMutateProcess
+    piece_mutate_process = piece_mutate_class(
         redis_connection,
         user,
         puzzle,
@@ -261,8 +249,16 @@ def translate(ip, user, puzzleData, piece, x, y, r, karma_change, karma):
         puzzle_rules=current_app.config["PUZZLE_RULES"],
         piece_move_timeout=current_app.config["PIECE_MOVE_TIMEOUT"],
         piece_join_tolerance=current_app.config["PIECE_JOIN_TOLERANCE"],
+        concurrency=current_app.config.get(
+            "PIECE_MUTATE_CONCURRENCY", CONCURRENCY_PUZZLE
+        ),
+        group_positions=group_positions,
     )
+    piece_mutate_start = time.perf_counter()
     (msg, status) = piece_mutate_process.start()
+    current_app.logger.debug(
+        f"{piece_mutate_class.__name__} {status} piece {piece} on puzzle {puzzle} in {time.perf_counter() - piece_mutate_start:.4f} seconds"
+    )
 
     # TODO: The enforcer handles updating stacked status. Should karma be
     # decreased here still?
@@ -283,20 +279,15 @@ def translate(ip, user, puzzleData, piece, x, y, r, karma_change, karma):
     #     return publishMessage(msg, karma_change, karma)
     if status == "moved":
         # Decrease karma since moving large group of pieces
-        if (
-            len(
-                {"all", "karma_piece_group_move_max"}.intersection(
-                    current_app.config["PUZZLE_RULES"]
-                )
-            )
-            > 0
+        if current_app.puzzle_policies.get_for_puzzle(puzzleData).is_enabled(
+            "karma_piece_group_move_max"
         ):
             if (
-                len(piece_mutate_process.all_other_pieces_in_piece_group)
+                piece_mutate_process.count_of_other_pieces_in_piece_group
                 > PIECE_GROUP_MOVE_MAX_BEFORE_PENALTY
             ):
                 if karma > 0:
-                    karma = redis_connection.decr(karma_key)
+                    karma = redis_connection.hincrby(session_key, "karma", -1)
                 karma_change -= 1
         return publishMessage(msg, karma_change, karma)
     elif status == "joined":
@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from flask import current_app
+import requests
+from rq import Retry
+
+from api.tools import purge_route_from_nginx_cache
+from api.constants import COMPLETED, QUEUE_END_OF_LINE
+
+# Seconds to wait between each retry of a failed puzzle complete job.
+COMPLETE_RETRY_INTERVALS = [10, 30, 60, 120, 300]
+
+
+def enqueue_puzzle_complete(puzzle_id, puzzle, m_date):
+    """
+    Enqueue the puzzle complete job on the cleanup queue so the piece move that
+    completed the puzzle doesn't need to wait for it.  The job is retried if it
+    fails.
+    """
+    return current_app.cleanupqueue.enqueue(
+        "api.jobs.puzzle_complete.complete",
+        puzzle_id,
+        puzzle,
+        m_date,
+        result_ttl=0,
+        retry=Retry(
+            max=len(COMPLETE_RETRY_INTERVALS), interval=COMPLETE_RETRY_INTERVALS
+        ),
+    )
+
+
+def complete(puzzle_id, puzzle, m_date):
+    """
+    Update the puzzle status to be complete, purge the puzzle page from the
+    cache, and schedule the transfer of the puzzle pieces to the database.
+    Each step can be done again if the job is retried.
+    """
+    r = requests.patch(
+        "http://{HOSTAPI}:{PORTAPI}/internal/puzzle/{puzzle_id}/details/".format(
+            HOSTAPI=current_app.config["HOSTAPI"],
+            PORTAPI=current_app.config["PORTAPI"],
+            puzzle_id=puzzle_id,
+        ),
+        json={
+            "status": COMPLETED,
+            "m_date": m_date,
+            "queue": QUEUE_END_OF_LINE,
+        },
+    )
+    if r.status_code != 200:
+        raise Exception("Puzzle details api error when updating puzzle to be complete")
+
+    purge_route_from_nginx_cache(
+        "/chill/site/front/{puzzle_id}/".format(puzzle_id=puzzle_id),
+        current_app.config.get("PURGEURLLIST"),
+    )
+
+    # Delaying helps avoid issues for players that are moving the last
+    # piece of the puzzle as someone else completes it.
+    delay = (
+        current_app.config["MAX_PAUSE_PIECES_TIMEOUT"]
+        + current_app.config["PIECE_MOVE_TIMEOUT"]
+        + 2
+    )
+    current_app.logger.info(
+        f"Delaying puzzle transfer on completed puzzle ({puzzle_id}) for {delay} seconds"
+    )
+    current_app.cleanupqueue.enqueue_in(
+        timedelta(seconds=delay),
+        "api.jobs.convertPiecesToDB.transfer",
+        puzzle,
+        result_ttl=0,
+    )
@@ -8,6 +8,7 @@ import sqlite3
 from api.database import rowify
 from api.jobs.convertPiecesToRedis import convert
 from api.jobs.pieceTranslate import translate
+from api.puzzle_keys import get_puzzle_key
 
 redisConnection = redis.from_url("redis://localhost:6379/0/", decode_responses=True)
 
@@ -57,23 +58,23 @@ class JobTestCase(unittest.TestCase):
         for puzzle in self.puzzles:
             print("Clean up for puzzle: {0}".format(puzzle))
             # Piece Properties
-            keys = redisConnection.keys(pattern="pc:{puzzle}:*".format(puzzle=puzzle))
+            keys = redisConnection.keys(pattern=get_puzzle_key("pc", puzzle, "*"))
             if len(keys) > 0:
                 deleted = redisConnection.delete(*keys)
                 print("Deleted {deleted} piece properties".format(**locals()))
 
             # Piece Group
-            keys = redisConnection.keys(pattern="pcg:{puzzle}:*".format(puzzle=puzzle))
+            keys = redisConnection.keys(pattern=get_puzzle_key("pcg", puzzle, "*"))
             if len(keys) > 0:
                 deleted = redisConnection.delete(*keys)
                 print("Deleted {deleted} piece group".format(**locals()))
 
             # Piece Fixed
-            deleted = redisConnection.delete("pcfixed:{puzzle}".format(puzzle=puzzle))
+            deleted = redisConnection.delete(get_puzzle_key("pcfixed", puzzle))
             print("Deleted {deleted} piece fixed".format(**locals()))
 
             # Piece Stacked
-            deleted = redisConnection.delete("pcstacked:{puzzle}".format(puzzle=puzzle))
+            deleted = redisConnection.delete(get_puzzle_key("pcstacked", puzzle))
             print("Deleted {deleted} piece stacked".format(**locals()))
 
     def test_simple(self):
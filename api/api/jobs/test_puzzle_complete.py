@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+import responses
+
+from api.helper_tests import APITestCase
+from api.jobs import puzzle_complete
+
+DETAILS_URL = "http://127.0.0.1:6310/internal/puzzle/abc/details/"
+
+
+class TestPuzzleComplete(APITestCase):
+    ""
+
+    def test_complete(self):
+        "Puzzle status is updated, page is purged, and transfer is scheduled"
+        with self.app.app_context(), mock.patch.object(
+            self.app, "cleanupqueue"
+        ) as cleanupqueue, responses.RequestsMock() as rsps:
+            rsps.add(responses.PATCH, DETAILS_URL, json={}, status=200)
+            puzzle_complete.complete("abc", 1, "2021-01-01 00:00:00")
+            self.assertEqual(1, len(rsps.calls))
+            with open(self.app.config["PURGEURLLIST"]) as f:
+                self.assertEqual("/chill/site/front/abc/\n", f.read())
+            cleanupqueue.enqueue_in.assert_called_once()
+            self.assertEqual(
+                "api.jobs.convertPiecesToDB.transfer",
+                cleanupqueue.enqueue_in.call_args[0][1],
+            )
+
+    def test_complete_api_error(self):
+        "Job fails so it can be retried when the puzzle details api has an error"
+        with self.app.app_context(), mock.patch.object(
+            self.app, "cleanupqueue"
+        ) as cleanupqueue, responses.RequestsMock() as rsps:
+            rsps.add(responses.PATCH, DETAILS_URL, json={}, status=500)
+            with self.assertRaises(Exception):
+                puzzle_complete.complete("abc", 1, "2021-01-01 00:00:00")
+            with open(self.app.config["PURGEURLLIST"]) as f:
+                self.assertEqual("", f.read())
+            cleanupqueue.enqueue_in.assert_not_called()
+
+    def test_enqueue_puzzle_complete(self):
+        "Job is enqueued with retries"
+        with self.app.app_context(), mock.patch.object(
+            self.app, "cleanupqueue"
+        ) as cleanupqueue:
+            puzzle_complete.enqueue_puzzle_complete("abc", 1, "2021-01-01 00:00:00")
+            (args, kw) = cleanupqueue.enqueue.call_args
+            self.assertEqual(
+                ("api.jobs.puzzle_complete.complete", "abc", 1, "2021-01-01 00:00:00"),
+                args,
+            )
+            self.assertEqual(
+                len(puzzle_complete.COMPLETE_RETRY_INTERVALS), kw["retry"].max
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
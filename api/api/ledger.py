@@ -0,0 +1,124 @@
+"""
+Score ledger
+
+Buffers the updates to the timeline, pcupdates and presence keys that are
+done after each piece move. The buffered updates are flushed to redis in a
+single pipeline after a short interval and when the process exits.
+
+Only updates that can be coalesced and that are not a problem to lose are
+buffered.  Timestamps set with zadd are coalesced to the latest one for each
+member.  Members added to a HyperLogLog with pfadd are collected in a set for
+each key.  Counters like the player points are not buffered since they would
+be lost if the process stopped before they were flushed.
+"""
+import atexit
+import threading
+import logging
+from collections import defaultdict
+
+from api.tools import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before flushing the buffered updates.
+FLUSH_INTERVAL = 1
+
+
+class ScoreLedger:
+    ""
+
+    def __init__(self, redis_connection, flush_interval=FLUSH_INTERVAL):
+        self.redis_connection = redis_connection
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.timer = None
+        self._reset()
+
+    def _reset(self):
+        # key: {member: timestamp}
+        self.zadd_timestamps = defaultdict(dict)
+        # key: set of members
+        self.pfadd_members = defaultdict(set)
+        # key: seconds
+        self.pfadd_expires = {}
+
+    def zadd(self, key, member, timestamp):
+        "Set the timestamp for the member in the sorted set unless a later one is already buffered."
+        with self.lock:
+            timestamps = self.zadd_timestamps[key]
+            timestamps[member] = max(timestamp, timestamps.get(member, timestamp))
+        self._schedule_flush()
+
+    def pfadd(self, key, *members, expire=None):
+        "Add the members to the HyperLogLog and set it to expire in the seconds if set."
+        with self.lock:
+            self.pfadd_members[key].update(members)
+            if expire is not None:
+                self.pfadd_expires[key] = expire
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        with self.lock:
+            if self.timer is not None:
+                return
+            self.timer = threading.Timer(self.flush_interval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        "Write all the buffered updates to redis in one pipeline."
+        with self.lock:
+            self.timer = None
+            zadd_timestamps = self.zadd_timestamps
+            pfadd_members = self.pfadd_members
+            pfadd_expires = self.pfadd_expires
+            self._reset()
+
+        if not (zadd_timestamps or pfadd_members):
+            return
+
+        try:
+            with self.redis_connection.pipeline(transaction=False) as pipe:
+                for (key, timestamps) in zadd_timestamps.items():
+                    pipe.zadd(key, timestamps)
+                for (key, members) in pfadd_members.items():
+                    pipe.pfadd(key, *members)
+                    if key in pfadd_expires:
+                        pipe.expire(key, pfadd_expires[key])
+                pipe.execute()
+        except Exception as err:
+            logger.warning(f"Failed to flush score ledger. Retrying later. {err}")
+            # Put the updates back so they will be retried on the next flush.
+            with self.lock:
+                for (key, timestamps) in zadd_timestamps.items():
+                    for (member, timestamp) in timestamps.items():
+                        current = self.zadd_timestamps[key].get(member, timestamp)
+                        self.zadd_timestamps[key][member] = max(timestamp, current)
+                for (key, members) in pfadd_members.items():
+                    self.pfadd_members[key].update(members)
+                for (key, expire) in pfadd_expires.items():
+                    self.pfadd_expires.setdefault(key, expire)
+            if self.flush_interval > 0:
+                self._schedule_flush()
+
+
+_score_ledger = None
+
+
+def get_score_ledger(config):
+    """
+    Get the score ledger for this process. It uses its own redis connection
+    since it is flushed outside of a request.  The buffered updates are flushed
+    when the process exits like when a publish worker is recycled.
+    """
+    global _score_ledger
+    if _score_ledger is None:
+        _score_ledger = ScoreLedger(
+            get_redis_connection(config, decode_responses=True),
+            flush_interval=config.get("SCORE_LEDGER_FLUSH_INTERVAL", FLUSH_INTERVAL),
+        )
+        atexit.register(_score_ledger.flush)
+    return _score_ledger
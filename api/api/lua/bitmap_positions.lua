@@ -0,0 +1,26 @@
+--[[
+Get the positions of the bits that are set in a bitmap.
+
+KEYS[1] bitmap key
+
+Returns a list of the positions.  Only the set bits are sent back instead of
+the whole bitmap.
+--]]
+
+local bitmap = redis.call("GET", KEYS[1])
+local positions = {}
+if not bitmap then
+  return positions
+end
+for i = 1, #bitmap do
+  local byte = string.byte(bitmap, i)
+  if byte ~= 0 then
+    -- The first bit of each byte is the most significant one.
+    for j = 0, 7 do
+      if math.floor(byte / 2 ^ (7 - j)) % 2 == 1 then
+        table.insert(positions, (i - 1) * 8 + j)
+      end
+    end
+  end
+end
+return positions
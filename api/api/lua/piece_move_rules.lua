@@ -0,0 +1,243 @@
+--[[
+Evaluate the puzzle rules for a player moving pieces on a puzzle.
+
+KEYS[1] pcfixed:{puzzle}
+KEYS[2] session:{puzzle}:{ip}
+KEYS[3] blockedplayers:{puzzle}
+KEYS[4] points:{user}
+KEYS[5] ptrate:{user}:{timestamp}
+KEYS[6] blocked:{ip}
+For each piece move n (starting at 1):
+KEYS[5 + 2n] pc:{puzzle}:{piece}
+KEYS[6 + 2n] hotspot:{puzzle}:{user}:{piece}
+
+ARGV[1] JSON encoded object with:
+  puzzle, user, now,
+  moves: list of objects with piece, origin_x, origin_y, x, y,
+  rules: object of enabled rule names set to true,
+  initial_karma, karma_points_expire, blockedplayer_expire_timeouts,
+  piece_translate_rate_timeout, piece_translate_max_count,
+  puzzle_open_rate_timeout,
+  piece_movement_rate_timeout, piece_movement_rate_limit,
+  hot_piece_movement_rate_timeout, moves_before_penalty,
+  hotspot_limit
+
+Returns a JSON encoded object with the results for each piece move.  The
+status of each result is one of "ok", "bannedusers", "missing", "immovable",
+or "blockedplayer".  The karma, karma_change and recent_points are included
+for "ok" and "blockedplayer".  The expires is included for "blockedplayer".
+The piece moves after the one that blocked the player are not evaluated and
+are also "blockedplayer".
+
+The keys for the puzzle have the puzzle id as the hash tag.  The keys for the
+player (points, ptrate, blocked) are not for the puzzle.  They are passed in
+KEYS so the recent points of the player are checked and changed atomically
+with the rules.  The ptrate key is for the piece translate rate timeout that
+the now is in.
+
+The karma and the recent move counts of the player on the puzzle are fields in
+the player session hash (session:{puzzle}:{ip}).  Each field has the time it
+expires in the "{field}:e" field.  The expired fields are removed when the
+session is read.  See api/player_session.py.
+--]]
+
+local a = cjson.decode(ARGV[1])
+local puzzle = tostring(a.puzzle)
+local user = tostring(a.user)
+local rules = a.rules
+local pcfixed_key = KEYS[1]
+local session_key = KEYS[2]
+local blockedplayers_key = KEYS[3]
+local points_key = KEYS[4]
+local piece_translate_rate_key = KEYS[5]
+local blocked_count_ip_key = KEYS[6]
+local recent_points = tonumber(redis.call("GET", points_key) or "0")
+
+-- Read the player session and remove the fields that have expired.
+local session = {}
+local flat_session = redis.call("HGETALL", session_key)
+for i = 1, #flat_session, 2 do
+  session[flat_session[i]] = flat_session[i + 1]
+end
+local expired_fields = {}
+for field, value in pairs(session) do
+  if string.sub(field, -2) == ":e" and tonumber(value) <= a.now then
+    table.insert(expired_fields, string.sub(field, 1, -3))
+    table.insert(expired_fields, field)
+  end
+end
+if #expired_fields > 0 then
+  redis.call("HDEL", session_key, unpack(expired_fields))
+  for _, field in ipairs(expired_fields) do
+    session[field] = nil
+  end
+end
+
+-- Increment the count in the session field and set when it expires.
+local function session_incr(field, timeout)
+  local count = redis.call("HINCRBY", session_key, field, 1)
+  redis.call("HSET", session_key, field .. ":e", a.now + timeout)
+  return count
+end
+
+local karma
+if session.karma == nil then
+  karma = a.initial_karma
+  redis.call(
+    "HSET", session_key,
+    "karma", karma,
+    "karma:e", a.now + a.karma_points_expire
+  )
+else
+  karma = tonumber(session.karma)
+end
+local karma_change
+
+local function decrease_karma()
+  if karma > 0 then
+    karma = redis.call("HINCRBY", session_key, "karma", -1)
+  end
+  karma_change = karma_change - 1
+end
+
+local function decrease_recent_points()
+  if recent_points > 0 then
+    recent_points = redis.call("DECR", points_key)
+  end
+end
+
+-- Add the player to the blocked players for the puzzle.  The timeout is longer
+-- each time a player with the same ip is blocked.  Returns the time the block
+-- expires.
+local function add_blocked_player()
+  local timeouts = a.blockedplayer_expire_timeouts
+  local expire_index = math.max(0, redis.call("INCR", blocked_count_ip_key) - 1)
+  redis.call("EXPIRE", blocked_count_ip_key, timeouts[#timeouts])
+  local expires = a.now + timeouts[math.min(expire_index, #timeouts - 1) + 1]
+  -- Add the player to the blocked players list for the puzzle and extend the
+  -- expiration of the key.
+  redis.call("ZADD", blockedplayers_key, expires, user)
+  redis.call("EXPIRE", blockedplayers_key, timeouts[#timeouts])
+  return expires
+end
+
+-- Increment the count of piece moves by the player in this piece translate
+-- rate timeout.  Returns true if it is over the max count.
+local function is_piece_translate_rate_exceeded()
+  redis.call(
+    "SET", piece_translate_rate_key, 1,
+    "EX", a.piece_translate_rate_timeout, "NX"
+  )
+  local count = redis.call("INCR", piece_translate_rate_key)
+  return count > a.piece_translate_max_count
+end
+
+local function evaluate_move(move, piece, hotspot_key)
+  redis.call(
+    "PUBLISH",
+    "enforcer_piece_translate:" .. puzzle,
+    user .. ":" .. piece .. ":" .. move.origin_x .. ":" .. move.origin_y .. ":" .. move.x .. ":" .. move.y
+  )
+  karma_change = 0
+
+  if rules.puzzle_open_rate then
+    -- Decrease recent points if this is a new puzzle that user hasn't moved
+    -- pieces on yet in the last hour
+    local pzrate_field = "pzrate:" .. user
+    if session[pzrate_field] == nil then
+      redis.call(
+        "HSET", session_key,
+        pzrate_field, 1,
+        pzrate_field .. ":e", a.now + a.puzzle_open_rate_timeout
+      )
+      session[pzrate_field] = "1"
+      decrease_recent_points()
+    end
+  end
+
+  if rules.piece_move_rate then
+    -- Decrease karma if piece movement rate has passed threshold
+    local moves = session_incr("pcrate:" .. user, a.piece_movement_rate_timeout)
+    if moves > a.piece_movement_rate_limit then
+      decrease_karma()
+    end
+  end
+
+  if rules.hot_piece then
+    -- Decrease karma when moving the same piece multiple times within a minute.
+    local recent_move_count = session_incr(
+      "hotpc:" .. user .. ":" .. piece, a.hot_piece_movement_rate_timeout
+    )
+    if recent_move_count > a.moves_before_penalty then
+      decrease_karma()
+    end
+  end
+
+  if rules.hot_spot then
+    -- Decrease the karma for the player if the piece is in a hotspot.
+    local hotspot_count = tonumber(redis.call("GET", hotspot_key) or "0")
+    if hotspot_count > a.hotspot_limit then
+      decrease_karma()
+    end
+  end
+
+  local result = {
+    status = "ok",
+    karma = karma,
+    karma_change = karma_change,
+  }
+  if karma_change < 0 then
+    -- Decrease recent points for a piece move that decreased karma
+    decrease_recent_points()
+    if karma + recent_points <= 0 then
+      result.status = "blockedplayer"
+    end
+  end
+  result.recent_points = recent_points
+  return result
+end
+
+local results = {}
+local expires = nil
+for n, move in ipairs(a.moves) do
+  local piece = tostring(move.piece)
+  local result
+  -- Ban the player if the piece movement rate continues to max out.
+  local banned = rules.piece_translate_rate and is_piece_translate_rate_exceeded()
+  if expires ~= nil then
+    result = {
+      status = "blockedplayer",
+      karma = karma,
+      karma_change = 0,
+      recent_points = recent_points,
+      expires = expires,
+    }
+  elseif banned then
+    result = {status = "bannedusers"}
+  elseif redis.call("HEXISTS", KEYS[5 + 2 * n], "y") == 0 then
+    -- Check again if piece can be moved and hasn't changed since getting token
+    result = {status = "missing"}
+  elseif redis.call("GETBIT", pcfixed_key, piece) == 1 then
+    result = {status = "immovable"}
+  else
+    result = evaluate_move(move, piece, KEYS[6 + 2 * n])
+    if result.status == "blockedplayer" then
+      expires = add_blocked_player()
+      result.expires = expires
+    end
+  end
+  table.insert(results, result)
+end
+
+-- The session expires after the longest timeout of the fields.
+redis.call(
+  "EXPIRE", session_key,
+  math.max(
+    a.karma_points_expire,
+    a.puzzle_open_rate_timeout,
+    a.piece_movement_rate_timeout,
+    a.hot_piece_movement_rate_timeout
+  )
+)
+
+return cjson.encode({results = results})
@@ -0,0 +1,354 @@
+--[[
+Move a piece and the other pieces in its group. Join it to an adjacent piece if
+it is within the join tolerance. This is the same as what the
+PieceMutateProcess does, but is done atomically within redis.
+
+KEYS[1] pzm:{puzzle}
+
+ARGV[1] user
+ARGV[2] puzzle
+ARGV[3] piece
+ARGV[4] target x
+ARGV[5] target y
+ARGV[6] piece join tolerance
+ARGV[7] piece count
+ARGV[8] piece move timeout
+
+Returns {msg, status, grouped pieces}
+The status is one of "moved", "joined", "completed", or "missing" if the piece
+doesn't exist.
+--]]
+
+local user = ARGV[1]
+local puzzle = ARGV[2]
+local piece = ARGV[3]
+local target_x = tonumber(ARGV[4])
+local target_y = tonumber(ARGV[5])
+local tolerance = math.floor(tonumber(ARGV[6]) / 2)
+local piece_count = tonumber(ARGV[7])
+local piece_move_timeout = tonumber(ARGV[8])
+
+-- The keys for the puzzle have the puzzle id as the hash tag. Same as in
+-- api/puzzle_keys.py.
+local function puzzle_key(name)
+  return name .. ":{" .. puzzle .. "}"
+end
+
+-- Bitmaps with a bit for each piece
+local pcfixed_key = puzzle_key("pcfixed")
+local pcstacked_key = puzzle_key("pcstacked")
+
+local function pc_key(p)
+  return puzzle_key("pc") .. ":" .. p
+end
+
+local function pcg_key(g)
+  return puzzle_key("pcg") .. ":" .. g
+end
+
+-- Packed piece positions with a 160 bit record for each piece. Same layout as
+-- in api/piece_positions.py.
+local pcpos_key = puzzle_key("pcpos")
+
+local function set_piece_position(p, x, y, g)
+  local offset = tonumber(p) * 160
+  local args = {}
+  if x ~= nil then
+    table.insert(args, "SET")
+    table.insert(args, "i32")
+    table.insert(args, offset)
+    table.insert(args, x)
+    table.insert(args, "SET")
+    table.insert(args, "i32")
+    table.insert(args, offset + 32)
+    table.insert(args, y)
+  end
+  if g ~= nil then
+    table.insert(args, "SET")
+    table.insert(args, "u32")
+    table.insert(args, offset + 64)
+    table.insert(args, tonumber(g) + 1)
+  end
+  redis.call("BITFIELD", pcpos_key, unpack(args))
+end
+
+local function int_string(n)
+  return string.format("%d", n)
+end
+
+-- Same as formatPieceMovementString
+local function format_piece_movement(p, x, y, r, g, s)
+  return ":" .. p .. ":" .. (x or "") .. ":" .. (y or "") .. ":" .. (r or "") .. ":" .. (g or "") .. ":" .. (s or "")
+end
+
+local function split(s, sep)
+  local parts = {}
+  for part in string.gmatch(s, "([^" .. sep .. "]+)") do
+    table.insert(parts, part)
+  end
+  return parts
+end
+
+-- Keep the puzzle mutation id in sync for any PieceMutateProcess that is
+-- watching it.
+redis.call("INCR", KEYS[1])
+redis.call("EXPIRE", KEYS[1], piece_move_timeout + 2)
+
+local piece_properties = {}
+local adjacent_pieces = {}
+local flat_piece_properties = redis.call("HGETALL", pc_key(piece))
+for i = 1, #flat_piece_properties, 2 do
+  local field = flat_piece_properties[i]
+  piece_properties[field] = flat_piece_properties[i + 1]
+  if tonumber(field) ~= nil then
+    table.insert(adjacent_pieces, field)
+  end
+end
+if piece_properties["y"] == nil then
+  return {"", "missing", {}}
+end
+
+local piece_group = piece_properties["g"]
+local offset_x = target_x - tonumber(piece_properties["x"])
+local offset_y = target_y - tonumber(piece_properties["y"])
+
+-- All other pieces in the piece group sorted by piece id
+local grouped_pieces = redis.call("SMEMBERS", pcg_key(piece_group or piece))
+local other_grouped_pieces = {}
+for _, grouped_piece in ipairs(grouped_pieces) do
+  if grouped_piece ~= piece then
+    table.insert(other_grouped_pieces, grouped_piece)
+  end
+end
+table.sort(other_grouped_pieces, function(a, b) return tonumber(a) < tonumber(b) end)
+
+local publish_message = {}
+local lines = {}
+local status = "moved"
+
+-- Determine if the piece can be joined to any of the adjacent pieces
+local can_join_adjacent_piece = nil
+local adjacent_piece_group = nil
+for _, adjacent_piece in ipairs(adjacent_pieces) do
+  local a_props = redis.call("HMGET", pc_key(adjacent_piece), "x", "y", "g")
+  local a_x = tonumber(a_props[1])
+  local a_y = tonumber(a_props[2])
+  local a_g = a_props[3] or nil
+  if a_x == nil or a_y == nil then
+    -- skip if adjacent piece is missing
+  elseif redis.call("GETBIT", pcstacked_key, adjacent_piece) == 1 then
+    -- skip if adjacent piece is currently marked as stacked
+  elseif piece_group ~= nil and a_g == piece_group then
+    -- skip if adjacent piece in same group
+  else
+    local offset_from_piece = split(piece_properties[adjacent_piece], ",")
+    local offset_from_piece_x = tonumber(offset_from_piece[1])
+    local offset_from_piece_y = tonumber(offset_from_piece[2])
+    local join_x = offset_from_piece_x + target_x
+    local join_y = offset_from_piece_y + target_y
+    if a_x > (join_x - tolerance) and a_x < (join_x + tolerance)
+      and a_y > (join_y - tolerance) and a_y < (join_y + tolerance) then
+      can_join_adjacent_piece = adjacent_piece
+      adjacent_piece_group = a_g
+      target_x = a_x - offset_from_piece_x
+      target_y = a_y - offset_from_piece_y
+      offset_x = target_x - tonumber(piece_properties["x"])
+      offset_y = target_y - tonumber(piece_properties["y"])
+      table.insert(
+        publish_message,
+        user .. ":" .. piece .. ":" .. int_string(target_x) .. ":" .. int_string(target_y)
+      )
+      break
+    end
+  end
+end
+
+-- The other adjacent pieces in other piece groups that are also within the
+-- tolerance of the piece or the other pieces in its piece group after it has
+-- been joined.
+local other_adjacent_pieces = {}
+if can_join_adjacent_piece ~= nil then
+  local joined_piece_groups = {}
+  joined_piece_groups[adjacent_piece_group or ("piece" .. can_join_adjacent_piece)] = true
+  if piece_group ~= nil then
+    joined_piece_groups[piece_group] = true
+  end
+
+  -- Join the adjacent piece if it is within the tolerance of the offset from
+  -- the piece next to it at x, y.
+  local function set_can_join_other_adjacent_piece(adjacent_piece, offset, x, y)
+    local a_props = redis.call("HMGET", pc_key(adjacent_piece), "x", "y", "g")
+    local a_x = tonumber(a_props[1])
+    local a_y = tonumber(a_props[2])
+    local a_g = a_props[3] or nil
+    local a_joined_piece_group = a_g or ("piece" .. adjacent_piece)
+    if a_x == nil or a_y == nil then
+      -- skip if adjacent piece is missing
+    elseif redis.call("GETBIT", pcstacked_key, adjacent_piece) == 1 then
+      -- skip if adjacent piece is currently marked as stacked
+    elseif joined_piece_groups[a_joined_piece_group] then
+      -- skip if adjacent piece is in a piece group that is already joined
+    else
+      local offset_from_piece = split(offset, ",")
+      local join_x = tonumber(offset_from_piece[1]) + x
+      local join_y = tonumber(offset_from_piece[2]) + y
+      if a_x > (join_x - tolerance) and a_x < (join_x + tolerance)
+        and a_y > (join_y - tolerance) and a_y < (join_y + tolerance) then
+        joined_piece_groups[a_joined_piece_group] = true
+        table.insert(other_adjacent_pieces, {adjacent_piece, a_g})
+      end
+    end
+  end
+
+  for _, adjacent_piece in ipairs(adjacent_pieces) do
+    set_can_join_other_adjacent_piece(
+      adjacent_piece, piece_properties[adjacent_piece], target_x, target_y
+    )
+  end
+
+  -- The adjacent pieces of the other pieces in the piece group that are not
+  -- in the piece group.
+  local in_piece_group = {}
+  in_piece_group[piece] = true
+  for _, grouped_piece in ipairs(other_grouped_pieces) do
+    in_piece_group[grouped_piece] = true
+  end
+  for _, grouped_piece in ipairs(other_grouped_pieces) do
+    local g_props = {}
+    local flat_g_props = redis.call("HGETALL", pc_key(grouped_piece))
+    for i = 1, #flat_g_props, 2 do
+      g_props[flat_g_props[i]] = flat_g_props[i + 1]
+    end
+    local g_x = tonumber(g_props["x"]) + offset_x
+    local g_y = tonumber(g_props["y"]) + offset_y
+    for i = 1, #flat_g_props, 2 do
+      local field = flat_g_props[i]
+      if tonumber(field) ~= nil and not in_piece_group[field] then
+        set_can_join_other_adjacent_piece(field, g_props[field], g_x, g_y)
+      end
+    end
+  end
+end
+
+-- Update all other pieces x,y in group to the offset, if new_group then assign
+-- them to the new_group
+local function update_grouped_pieces_positions(new_group)
+  for _, grouped_piece in ipairs(other_grouped_pieces) do
+    local origin = redis.call("HMGET", pc_key(grouped_piece), "x", "y")
+    local new_x = int_string(tonumber(origin[1]) + offset_x)
+    local new_y = int_string(tonumber(origin[2]) + offset_y)
+    if new_group ~= nil then
+      redis.call("SADD", pcg_key(new_group), grouped_piece)
+      redis.call("SREM", pcg_key(piece_group), grouped_piece)
+      redis.call("HSET", pc_key(grouped_piece), "x", new_x, "y", new_y, "g", new_group)
+    else
+      redis.call("HSET", pc_key(grouped_piece), "x", new_x, "y", new_y)
+    end
+    set_piece_position(grouped_piece, new_x, new_y, new_group)
+    table.insert(lines, format_piece_movement(grouped_piece, new_x, new_y, nil, new_group, nil))
+    table.insert(publish_message, user .. ":" .. grouped_piece .. ":" .. new_x .. ":" .. new_y)
+  end
+  if new_group ~= nil then
+    redis.call("SADD", pcg_key(new_group), piece)
+    if piece_group ~= nil then
+      redis.call("SREM", pcg_key(piece_group), piece)
+    end
+    redis.call("HSET", pc_key(piece), "g", new_group)
+    set_piece_position(piece, nil, nil, new_group)
+    table.insert(lines, format_piece_movement(piece, nil, nil, nil, new_group, nil))
+  end
+end
+
+-- Move the piece
+redis.call("HSET", pc_key(piece), "x", int_string(target_x), "y", int_string(target_y))
+set_piece_position(piece, int_string(target_x), int_string(target_y), nil)
+table.insert(lines, format_piece_movement(piece, int_string(target_x), int_string(target_y)))
+
+if can_join_adjacent_piece == nil then
+  -- Only move the piece and the other pieces in the group to the target position
+  if piece_group ~= nil then
+    update_grouped_pieces_positions(nil)
+  end
+else
+  -- Join the piece and the pieces group to the adjacent piece merging the two
+  -- piece groups together.
+  status = "joined"
+
+  -- Set immovable status if adjacent piece is immovable
+  if redis.call("GETBIT", pcfixed_key, can_join_adjacent_piece) == 1 then
+    redis.call("SETBIT", pcfixed_key, piece, 1)
+    table.insert(lines, format_piece_movement(piece, nil, nil, nil, nil, "1"))
+    for _, grouped_piece in ipairs(other_grouped_pieces) do
+      redis.call("SETBIT", pcfixed_key, grouped_piece, 1)
+      redis.call("SETBIT", pcstacked_key, grouped_piece, 0)
+      table.insert(lines, format_piece_movement(grouped_piece, nil, nil, nil, nil, "1"))
+    end
+  end
+
+  -- Update Piece group to that of the adjacent piece since it may already be
+  -- in a group
+  local new_piece_group = adjacent_piece_group or can_join_adjacent_piece
+  redis.call("SADD", pcg_key(new_piece_group), piece, can_join_adjacent_piece)
+  redis.call("SADD", puzzle_key("pzkeys"), pcg_key(new_piece_group))
+  redis.call("HSET", pc_key(piece), "g", new_piece_group)
+  redis.call("HSET", pc_key(can_join_adjacent_piece), "g", new_piece_group)
+  set_piece_position(piece, nil, nil, new_piece_group)
+  set_piece_position(can_join_adjacent_piece, nil, nil, new_piece_group)
+  table.insert(lines, format_piece_movement(piece, nil, nil, nil, new_piece_group, nil))
+  table.insert(lines, format_piece_movement(can_join_adjacent_piece, nil, nil, nil, new_piece_group, nil))
+  if #other_grouped_pieces ~= 0 then
+    update_grouped_pieces_positions(new_piece_group)
+  end
+
+  -- Join the other adjacent pieces and the pieces in their piece groups. These
+  -- pieces are already in place so only the piece group is changed. All the
+  -- joined pieces are immovable if any of them are.
+  if #other_adjacent_pieces ~= 0 then
+    local is_immovable = redis.call("GETBIT", pcfixed_key, can_join_adjacent_piece) == 1
+    local movable_pieces = {}
+    if not is_immovable then
+      movable_pieces = redis.call("SMEMBERS", pcg_key(new_piece_group))
+    end
+    for _, other in ipairs(other_adjacent_pieces) do
+      local other_adjacent_piece = other[1]
+      local other_piece_group = other[2]
+      local joined_pieces = {other_adjacent_piece}
+      if other_piece_group then
+        joined_pieces = redis.call("SMEMBERS", pcg_key(other_piece_group))
+        redis.call("DEL", pcg_key(other_piece_group))
+      end
+      table.sort(joined_pieces, function(a, b) return tonumber(a) < tonumber(b) end)
+      for _, joined_piece in ipairs(joined_pieces) do
+        redis.call("SADD", pcg_key(new_piece_group), joined_piece)
+        redis.call("HSET", pc_key(joined_piece), "g", new_piece_group)
+        set_piece_position(joined_piece, nil, nil, new_piece_group)
+        table.insert(lines, format_piece_movement(joined_piece, nil, nil, nil, new_piece_group, nil))
+      end
+      if redis.call("GETBIT", pcfixed_key, other_adjacent_piece) == 1 then
+        is_immovable = true
+      else
+        for _, joined_piece in ipairs(joined_pieces) do
+          table.insert(movable_pieces, joined_piece)
+        end
+      end
+    end
+    if is_immovable then
+      table.sort(movable_pieces, function(a, b) return tonumber(a) < tonumber(b) end)
+      for _, movable_piece in ipairs(movable_pieces) do
+        redis.call("SETBIT", pcfixed_key, movable_piece, 1)
+        redis.call("SETBIT", pcstacked_key, movable_piece, 0)
+        table.insert(lines, format_piece_movement(movable_piece, nil, nil, nil, nil, "1"))
+      end
+    end
+  end
+
+  if redis.call("BITCOUNT", pcfixed_key) == piece_count then
+    status = "completed"
+  end
+end
+
+if #publish_message ~= 0 then
+  redis.call("PUBLISH", "enforcer_piece_group_translate:" .. puzzle, table.concat(publish_message, "_"))
+end
+
+return {"\n" .. table.concat(lines, "\n"), status, other_grouped_pieces}
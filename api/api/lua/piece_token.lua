@@ -0,0 +1,268 @@
+--[[
+Request a token for a player to move a piece on a puzzle.
+
+KEYS[1] pc:{puzzle}:{piece}
+
+ARGV[1] puzzle
+ARGV[2] piece
+ARGV[3] user
+ARGV[4] mark
+ARGV[5] now (seconds)
+ARGV[6] token id
+ARGV[7] validate token (1 or 0)
+ARGV[8] TOKEN_LOCK_TIMEOUT
+ARGV[9] TOKEN_EXPIRE_TIMEOUT
+ARGV[10] queue wait budget in seconds (0 to not check)
+ARGV[11] origin x (optional)
+ARGV[12] origin y (optional)
+
+The token is not granted when the estimated wait for the piece moves already
+queued for the puzzle is over the queue wait budget.
+
+When the origin x and y are set the piece is only checked if it can be moved
+right away by the player without a token.  The piece needs to still be at the
+origin and not be locked or waited on by another player.  The piece is then
+locked with the token id for TOKEN_LOCK_TIMEOUT so no other player can move it
+before the piece move is applied.  The lock is released with the
+release_piece_token script.  The caller checks if the player is banned since
+the bannedusers key is not for the puzzle.
+
+Returns a list with the first item being the status:
+{"grant", puzzle, x, y, pzq_current, snapshot}
+{"puzzleimmutable"}
+{"immovable"}
+{"blockedplayer", expires}
+{"concurrent"}
+{"piecequeue", queue rank}
+{"piecelock"}
+{"busy", retry after seconds}
+{"moved"} (only when origin is set)
+
+The snapshot is of the adjacent pieces that could be joined to the piece.  It
+is a string of "{piece}_{x}_{y}_{r}_{offset}" items joined with ":".
+
+The x and y of a piece in a piece group with an origin (pcgo:{puzzle}:{group})
+are relative to it.  The origin of a piece group that was merged into another
+piece group has the parent piece group (p) and is relative to the origin of
+it.  The returned x and y are always the table position.
+
+All the keys are for the puzzle and have the puzzle id as the hash tag.
+--]]
+
+local puzzle = ARGV[1]
+local piece = ARGV[2]
+local user = ARGV[3]
+local mark = ARGV[4]
+local now = tonumber(ARGV[5])
+local token_id = ARGV[6]
+local validate_token = ARGV[7] == "1"
+local token_lock_timeout = tonumber(ARGV[8])
+local token_expire_timeout = tonumber(ARGV[9])
+local queue_wait_budget = tonumber(ARGV[10])
+local origin_x = ARGV[11]
+local origin_y = ARGV[12]
+local check_origin = origin_x ~= nil and origin_x ~= ""
+
+local function split(s, sep)
+  local parts = {}
+  for part in string.gmatch(s, "([^" .. sep .. "]+)") do
+    table.insert(parts, part)
+  end
+  return parts
+end
+
+-- The keys for the puzzle have the puzzle id as the hash tag. Same as in
+-- api/puzzle_keys.py.
+local function puzzle_key(name)
+  return name .. ":{" .. puzzle .. "}"
+end
+
+-- Returns the root piece group and the table position of the origin.
+local function find_piece_group(g)
+  local origin_x = 0
+  local origin_y = 0
+  while g and g ~= "" do
+    local origin = redis.call("HMGET", puzzle_key("pcgo") .. ":" .. g, "x", "y", "p")
+    if not origin[1] then
+      break
+    end
+    origin_x = origin_x + tonumber(origin[1])
+    origin_y = origin_y + tonumber(origin[2])
+    if not origin[3] then
+      break
+    end
+    g = origin[3]
+  end
+  return g, origin_x, origin_y
+end
+
+local function table_position(x, y, g)
+  if x and y and g and g ~= "" then
+    local _, origin_x, origin_y = find_piece_group(g)
+    return tostring(tonumber(x) + origin_x), tostring(tonumber(y) + origin_y)
+  end
+  return x, y
+end
+
+local piece_properties = {}
+local adjacent_pieces = {}
+local flat_piece_properties = redis.call("HGETALL", KEYS[1])
+for i = 1, #flat_piece_properties, 2 do
+  local field = flat_piece_properties[i]
+  piece_properties[field] = flat_piece_properties[i + 1]
+  -- Adjacent pieces are the fields that are piece ids.
+  if tonumber(field) ~= nil then
+    table.insert(adjacent_pieces, field)
+  end
+end
+if piece_properties["y"] == nil then
+  return {"puzzleimmutable"}
+end
+local piece_group = piece_properties["g"]
+if piece_group then
+  piece_group = find_piece_group(piece_group)
+end
+piece_properties["x"], piece_properties["y"] = table_position(
+  piece_properties["x"], piece_properties["y"], piece_properties["g"]
+)
+
+local pcfixed_key = puzzle_key("pcfixed")
+if redis.call("GETBIT", pcfixed_key, piece) == 1 then
+  return {"immovable"}
+end
+
+if check_origin then
+  if piece_properties["x"] ~= origin_x or piece_properties["y"] ~= origin_y then
+    return {"moved"}
+  end
+end
+
+local blockedplayers_expires = redis.call("ZSCORE", puzzle_key("blockedplayers"), user)
+if blockedplayers_expires and tonumber(blockedplayers_expires) > now then
+  return {"blockedplayer", blockedplayers_expires}
+end
+
+-- Estimate how long a piece move would wait in the puzzle queue from the
+-- recent service times.
+if queue_wait_budget > 0 then
+  local queue_depth = redis.call("LLEN", puzzle_key("pzq_moves"))
+  if queue_depth > 0 then
+    local service_times = redis.call("LRANGE", puzzle_key("pzq_service"), 0, -1)
+    if #service_times > 0 then
+      local total = 0
+      for _, service_time in ipairs(service_times) do
+        total = total + tonumber(service_time)
+      end
+      local queue_wait = queue_depth * (total / #service_times)
+      if queue_wait > queue_wait_budget then
+        return {"busy", math.max(1, math.ceil(queue_wait - queue_wait_budget))}
+      end
+    end
+  end
+end
+
+redis.call(
+  "PUBLISH",
+  "enforcer_token_request:" .. puzzle,
+  user .. ":" .. piece .. ":" .. piece_properties["x"] .. ":" .. piece_properties["y"]
+)
+
+local function grant()
+  -- Snapshot of adjacent pieces at time of token request
+  local snapshot = {}
+  for _, adjacent_piece in ipairs(adjacent_pieces) do
+    local a_props = redis.call(
+      "HMGET",
+      puzzle_key("pc") .. ":" .. adjacent_piece,
+      "x", "y", "r", "g", piece
+    )
+    local a_g = a_props[4]
+    local a_offset = a_props[5]
+    if redis.call("GETBIT", pcfixed_key, adjacent_piece) == 1 then
+      -- skip any that are immovable
+    elseif a_g and find_piece_group(a_g) == piece_group then
+      -- skip any that are in the same group
+    elseif not a_offset or a_offset == "" then
+      -- skip any that don't have offsets (adjacent edge piece)
+    else
+      local a_x, a_y = table_position(a_props[1], a_props[2], a_g)
+      table.insert(
+        snapshot,
+        table.concat({adjacent_piece, a_x or "", a_y or "", a_props[3] or "", a_offset}, "_")
+      )
+    end
+  end
+
+  local pzq_current = redis.call("GET", puzzle_key("pzq_current")) or "0"
+  return {
+    "grant",
+    puzzle,
+    piece_properties["x"],
+    piece_properties["y"],
+    pzq_current,
+    table.concat(snapshot, ":")
+  }
+end
+
+if not validate_token then
+  return grant()
+end
+
+-- Check if user already has a token for this puzzle. This would mean that the
+-- user tried moving another piece before the locked piece finished moving.
+local mark_token_key = puzzle_key("t") .. ":" .. mark
+if redis.call("EXISTS", mark_token_key) == 1 then
+  return {"concurrent"}
+end
+
+-- Append this player to a queue for getting the next token. This will prevent
+-- the player with the lock from continually locking the same piece.
+local piece_token_queue_key = puzzle_key("pqtoken") .. ":" .. piece
+if check_origin then
+  -- Don't join the queue; any player waiting on the piece goes first.
+  local queue_count = redis.call("ZCARD", piece_token_queue_key)
+  if queue_count > 0 then
+    return {"piecequeue", queue_count}
+  end
+else
+  local queue_rank = redis.call("ZRANK", piece_token_queue_key, mark)
+  if not queue_rank then
+    redis.call("ZADD", piece_token_queue_key, now, mark)
+    -- Registered so the expired players can be swept from the queue.
+    redis.call("SADD", puzzle_key("pzkeys"), piece_token_queue_key)
+    queue_rank = redis.call("ZRANK", piece_token_queue_key, mark)
+  end
+  redis.call("EXPIRE", piece_token_queue_key, token_lock_timeout + 5)
+  if queue_rank > 0 then
+    return {"piecequeue", queue_rank}
+  end
+end
+
+-- Check if token on piece is still owned by another user
+local puzzle_piece_token_key = puzzle_key("pctoken") .. ":" .. piece
+local existing_token_and_mark = redis.call("GET", puzzle_piece_token_key)
+if existing_token_and_mark then
+  local other_mark = split(existing_token_and_mark, ":")[2]
+  local puzzle_and_piece_and_user = other_mark and redis.call("GET", puzzle_key("t") .. ":" .. other_mark)
+  if puzzle_and_piece_and_user then
+    local other = split(puzzle_and_piece_and_user, ":")
+    if other[1] == puzzle and other[2] == piece then
+      return {"piecelock"}
+    end
+  end
+end
+
+if check_origin then
+  -- The piece is free to be moved now; no token is needed.  Lock it until the
+  -- piece move is applied.
+  redis.call("SET", puzzle_piece_token_key, token_id .. ":" .. mark, "EX", token_lock_timeout)
+  redis.call("SET", mark_token_key, puzzle .. ":" .. piece .. ":" .. user, "EX", token_lock_timeout)
+  return grant()
+end
+
+-- This piece is up for grabs since it has been more then TOKEN_LOCK_TIMEOUT
+-- seconds since another player has grabbed it.
+redis.call("ZREM", piece_token_queue_key, mark)
+redis.call("SET", puzzle_piece_token_key, token_id .. ":" .. mark, "EX", token_expire_timeout)
+redis.call("SET", mark_token_key, puzzle .. ":" .. piece .. ":" .. user, "EX", token_lock_timeout)
+return grant()
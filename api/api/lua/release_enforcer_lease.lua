@@ -0,0 +1,16 @@
+--[[
+Release the lease on a puzzle if it is owned by the enforcer instance.
+
+KEYS[1] enforcerlease:{puzzle}
+
+ARGV[1] enforcer instance
+
+Returns 1 if the lease was released or 0 if it has expired or is owned by a
+different enforcer instance.
+--]]
+
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+  return 0
+end
+redis.call("DEL", KEYS[1])
+return 1
@@ -0,0 +1,23 @@
+--[[
+Release the lock on the piece for the player that has the token.  The token
+can only be used once.
+
+KEYS[1] pctoken:{puzzle}:{piece}
+KEYS[2] t:{puzzle}:{mark}
+
+ARGV[1] token id
+ARGV[2] mark
+
+Returns 1 if the token was released, 0 if it has expired, or -1 if the piece
+is locked with a different token or by a different player.
+--]]
+
+local token_and_mark = redis.call("GET", KEYS[1])
+if not token_and_mark then
+  return 0
+end
+if token_and_mark ~= ARGV[1] .. ":" .. ARGV[2] then
+  return -1
+end
+redis.call("DEL", KEYS[1], KEYS[2])
+return 1
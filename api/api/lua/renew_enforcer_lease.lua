@@ -0,0 +1,17 @@
+--[[
+Renew the lease on a puzzle for the enforcer instance that owns it.
+
+KEYS[1] enforcerlease:{puzzle}
+
+ARGV[1] enforcer instance
+ARGV[2] lease timeout in milliseconds
+
+Returns 1 if the lease was renewed or 0 if it has expired or is owned by a
+different enforcer instance.
+--]]
+
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+  return 0
+end
+redis.call("PEXPIRE", KEYS[1], ARGV[2])
+return 1
@@ -0,0 +1,18 @@
+--[[
+Extend the piece move sequencer worker lease on a puzzle for the worker that
+holds it.
+
+KEYS[1] pzq_worker:{puzzle}
+
+ARGV[1] worker id
+ARGV[2] lease timeout in milliseconds
+
+Returns 1 if the lease was extended or 0 if it has expired or is held by a
+different worker.
+--]]
+
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+  return 0
+end
+redis.call("PEXPIRE", KEYS[1], ARGV[2])
+return 1
@@ -5,6 +5,8 @@ from flask.views import MethodView
 
 from .app import db, redis_connection
 from .database import fetch_query_string, rowify
+from .piece_mutate import resolve_piece_group_positions
+from .puzzle_keys import get_puzzle_key, get_pcupdates_key
 from .user import user_not_banned
 
 encoder = json.JSONEncoder(indent=2, sort_keys=True)
@@ -35,7 +37,7 @@ class PuzzlePieceView(MethodView):
         cur.close()
 
         # Only allow if there is data in redis
-        if not redis_connection.zscore("pcupdates", puzzle):
+        if not redis_connection.zscore(get_pcupdates_key(puzzle), puzzle):
             abort(400)
 
         # Fetch just the piece properties
@@ -43,12 +45,13 @@ class PuzzlePieceView(MethodView):
         # The 'r' field is the mutable rotation of the piece.
         publicPieceProperties = ("x", "y", "r", "g", "w", "h", "b")
         pieceProperties = redis_connection.hmget(
-            "pc:{puzzle}:{piece}".format(puzzle=puzzle, piece=piece),
+            get_puzzle_key("pc", puzzle, piece),
             *publicPieceProperties,
         )
         pieceData = dict(list(zip(publicPieceProperties, pieceProperties)))
+        resolve_piece_group_positions(redis_connection, puzzle, [pieceData])
         piece_status = None
-        if redis_connection.sismember(f"pcfixed:{puzzle}") == 1:
+        if redis_connection.getbit(get_puzzle_key("pcfixed", puzzle), piece) == 1:
             piece_status = "1"
 
         pieceData["s"] = piece_status
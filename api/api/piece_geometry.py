@@ -0,0 +1,178 @@
+"""
+Piece geometry files
+
+The piece properties that never change after the puzzle is rendered (w, h,
+rotate, b, and the adjacent piece offsets) are written to a binary file for
+each puzzle in the PUZZLE_GEOMETRY directory when the pieces are added.  The
+API and the enforcer memory map the file read-only instead of reading these
+from the database.
+
+The file starts with the header (magic, piece record count) followed by a piece
+record for each piece id and then the adjacent piece records.  All integers are
+big endian.
+
+    header      4s  I
+    piece       H (w)  H (h)  H (rotate)  B (b)  B (1 if piece exists)
+                H (adjacent count)  I (index of first adjacent record)
+    adjacent    I (adjacent piece)  i (offset x)  i (offset y)
+"""
+import os
+import mmap
+import struct
+
+PIECE_GEOMETRY_MAGIC = b"PMG1"
+PIECE_GEOMETRY_HEADER = struct.Struct(">4sI")
+PIECE_GEOMETRY_PIECE = struct.Struct(">HHHBBHI")
+PIECE_GEOMETRY_ADJACENT = struct.Struct(">Iii")
+
+# Open piece geometry files by path along with the inode and mtime of the file
+# when it was opened.
+_piece_geometry_cache = {}
+
+
+def get_piece_geometry_path(config, puzzle):
+    "Path to the piece geometry file or None if PUZZLE_GEOMETRY is not set."
+    geometry_directory = config.get("PUZZLE_GEOMETRY")
+    if not geometry_directory:
+        return None
+    return os.path.join(geometry_directory, f"{puzzle}.geometry")
+
+
+def parse_adjacent(adjacent):
+    "Parse the adjacent string '12:-40,3 14:3,40' to a dict of offsets."
+    adjacent_offsets = {}
+    for adjacent_piece_string in (adjacent or "").split(" "):
+        if not adjacent_piece_string:
+            continue
+        (adjacent_piece_id, offset_string) = adjacent_piece_string.split(":")
+        adjacent_offsets[int(adjacent_piece_id)] = list(
+            map(int, offset_string.split(","))
+        )
+    return adjacent_offsets
+
+
+def write_piece_geometry(config, puzzle, piece_properties):
+    """
+    Write the piece geometry file for the list of piece properties. The file
+    is replaced atomically so any process that has the old one open is not
+    affected.
+    """
+    path = get_piece_geometry_path(config, puzzle)
+    if path is None:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    piece_record_count = (
+        max(int(piece["id"]) for piece in piece_properties) + 1
+        if piece_properties
+        else 0
+    )
+    pieces = bytearray(PIECE_GEOMETRY_PIECE.size * piece_record_count)
+    adjacent_records = []
+    for piece in piece_properties:
+        adjacent_offsets = parse_adjacent(piece.get("adjacent"))
+        PIECE_GEOMETRY_PIECE.pack_into(
+            pieces,
+            int(piece["id"]) * PIECE_GEOMETRY_PIECE.size,
+            int(piece.get("w") or 0),
+            int(piece.get("h") or 0),
+            int(piece.get("rotate") or 0),
+            int(piece.get("b") or 0),
+            1,
+            len(adjacent_offsets),
+            len(adjacent_records),
+        )
+        for (adjacent_piece, (offset_x, offset_y)) in adjacent_offsets.items():
+            adjacent_records.append(
+                PIECE_GEOMETRY_ADJACENT.pack(adjacent_piece, offset_x, offset_y)
+            )
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PIECE_GEOMETRY_HEADER.pack(PIECE_GEOMETRY_MAGIC, piece_record_count))
+        f.write(pieces)
+        f.write(b"".join(adjacent_records))
+    os.replace(tmp_path, path)
+
+
+def delete_piece_geometry(config, puzzle):
+    path = get_piece_geometry_path(config, puzzle)
+    if path is None:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class PieceGeometry:
+    "Read-only piece geometry from a memory mapped piece geometry file."
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.piece_record_count) = PIECE_GEOMETRY_HEADER.unpack_from(
+            self.data, 0
+        )
+        if magic != PIECE_GEOMETRY_MAGIC:
+            raise ValueError(f"Not a piece geometry file {path}")
+        self.adjacent_start = (
+            PIECE_GEOMETRY_HEADER.size
+            + PIECE_GEOMETRY_PIECE.size * self.piece_record_count
+        )
+
+    def get(self, piece):
+        "Get the piece properties with the adjacent offsets or None if no piece."
+        piece = int(piece)
+        if piece < 0 or piece >= self.piece_record_count:
+            return None
+        (w, h, rotate, b, exists, adjacent_count, adjacent_index) = (
+            PIECE_GEOMETRY_PIECE.unpack_from(
+                self.data,
+                PIECE_GEOMETRY_HEADER.size + piece * PIECE_GEOMETRY_PIECE.size,
+            )
+        )
+        if not exists:
+            return None
+        adjacent = {}
+        for index in range(adjacent_index, adjacent_index + adjacent_count):
+            (adjacent_piece, offset_x, offset_y) = PIECE_GEOMETRY_ADJACENT.unpack_from(
+                self.data,
+                self.adjacent_start + index * PIECE_GEOMETRY_ADJACENT.size,
+            )
+            adjacent[adjacent_piece] = [offset_x, offset_y]
+        return {
+            "id": piece,
+            "w": w,
+            "h": h,
+            "rotate": rotate,
+            "b": b,
+            "adjacent": adjacent,
+        }
+
+    def items(self):
+        "Iterate over the piece id and properties for each piece."
+        for piece in range(self.piece_record_count):
+            piece_properties = self.get(piece)
+            if piece_properties is not None:
+                yield (piece, piece_properties)
+
+
+def load_piece_geometry(config, puzzle):
+    """
+    Get the PieceGeometry for the puzzle or None if there is no piece geometry
+    file.  The memory mapped file is reused until the file is replaced.
+    """
+    path = get_piece_geometry_path(config, puzzle)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _piece_geometry_cache.pop(path, None)
+        return None
+    version = (stat.st_ino, stat.st_mtime_ns)
+    cached = _piece_geometry_cache.get(path)
+    if cached is None or cached[0] != version:
+        cached = _piece_geometry_cache[path] = (version, PieceGeometry(path))
+    return cached[1]
@@ -1,6 +1,18 @@
 from flask import current_app
 
-from api.tools import formatPieceMovementString
+from api.tools import (
+    formatPieceMovementString,
+    formatPieceGroupMovementString,
+    formatPieceGroupMergeString,
+)
+from api.redis_scripts import run_script
+from api.piece_positions import set_piece_positions
+from api.piece_status import get_pcfixed_key, get_pcstacked_key
+from api.puzzle_keys import (
+    get_puzzle_key,
+    get_puzzle_teardown_key,
+    register_puzzle_keys,
+)
 
 
 class PieceMutateError(Exception):
@@ -16,6 +28,148 @@ class PieceGroupConflictError(PieceMutateError):
     """
 
 
+# Concurrency modes for PieceMutateProcess.
+# With "puzzle" any change to the puzzle (pzm) will conflict with the piece
+# mutation.
+# With "piece" only changes to the pieces and piece groups that are read or
+# written by the piece mutation will conflict.
+CONCURRENCY_PUZZLE = "puzzle"
+CONCURRENCY_PIECE = "piece"
+
+# Engines for mutating pieces that can be set with PIECE_MUTATE_ENGINE.
+# The "process" engine uses PieceMutateProcess and the "script" engine uses
+# PieceMutateScript.
+ENGINE_PROCESS = "process"
+ENGINE_SCRIPT = "script"
+
+# How the positions of pieces in a piece group are stored that can be set with
+# PIECE_GROUP_POSITIONS. With "absolute" the x and y of each piece is the
+# position on the table. With "relative" each piece group has an origin and the
+# x and y of each piece in the piece group is relative to it. Moving a piece
+# group then only updates the origin. Only the "process" engine supports the
+# "relative" piece group positions.
+GROUP_POSITIONS_ABSOLUTE = "absolute"
+GROUP_POSITIONS_RELATIVE = "relative"
+
+# With relative piece group positions the piece groups are merged as a
+# union-find. The origin of the root piece group is the position on the table
+# and it has the count of pieces ("n"). The origin of a piece group that was
+# merged has the parent piece group ("p") and is the offset from the origin of
+# the parent. The pieces keep the piece group ("g") they were added to and the
+# root piece group is found when reading them.
+
+GROUPED_PIECE_PROPERTY_LIST = ["x", "y", "r", "g"]
+
+
+def get_piece_group_origin_key(puzzle, piece_group):
+    return get_puzzle_key("pcgo", puzzle, piece_group)
+
+
+def get_piece_group_merged_key(puzzle, piece_group):
+    return get_puzzle_key("pcgm", puzzle, piece_group)
+
+
+def load_piece_group_origins(redis_connection, puzzle, piece_groups, pipe=None):
+    """
+    Get the origins of the piece groups and all of their parent piece groups.
+    Returns a dict of piece group: origin properties. A piece group without an
+    origin has empty origin properties. The origin keys are watched on the
+    pipe before they are read if it is set.
+    """
+    origins = {}
+    piece_groups = set(map(int, piece_groups))
+    while piece_groups:
+        piece_groups = list(piece_groups)
+        origin_keys = [
+            get_piece_group_origin_key(puzzle, piece_group)
+            for piece_group in piece_groups
+        ]
+        if pipe is not None:
+            pipe.watch(*origin_keys)
+        with redis_connection.pipeline(transaction=False) as read_pipe:
+            for origin_key in origin_keys:
+                read_pipe.hgetall(origin_key)
+            response = read_pipe.execute()
+        for (piece_group, origin) in zip(piece_groups, response):
+            origins[piece_group] = dict([(k, int(v)) for (k, v) in origin.items()])
+        piece_groups = set(
+            [origin["p"] for origin in origins.values() if "p" in origin]
+        ).difference(origins.keys())
+    return origins
+
+
+def find_piece_group_origin(origins, piece_group):
+    """
+    Find the root piece group and the position on the table of the origin of
+    the piece group from the origins that were loaded. Returns (root piece
+    group, x, y) or None if the piece group doesn't have an origin.
+    """
+    origin = origins.get(int(piece_group))
+    if not origin:
+        return None
+    (root, x, y) = (int(piece_group), origin["x"], origin["y"])
+    while "p" in origins[root]:
+        root = origins[root]["p"]
+        x += origins[root]["x"]
+        y += origins[root]["y"]
+    return (root, x, y)
+
+
+def get_piece_group_members(redis_connection, puzzle, piece_group):
+    """
+    Get all the pieces in the piece group including the pieces in the piece
+    groups that were merged into it.
+    """
+    pieces = set()
+    found_piece_groups = set()
+    piece_groups = [int(piece_group)]
+    while piece_groups:
+        with redis_connection.pipeline(transaction=False) as pipe:
+            for piece_group in piece_groups:
+                pipe.smembers(get_puzzle_key("pcg", puzzle, piece_group))
+                pipe.smembers(get_piece_group_merged_key(puzzle, piece_group))
+            response = pipe.execute()
+        found_piece_groups.update(piece_groups)
+        merged_piece_groups = set()
+        for (members, merged) in zip(response[::2], response[1::2]):
+            pieces.update(map(int, members))
+            merged_piece_groups.update(map(int, merged))
+        piece_groups = list(merged_piece_groups.difference(found_piece_groups))
+    return pieces
+
+
+def resolve_piece_group_positions(redis_connection, puzzle, pieces):
+    """
+    Update the x and y of each piece that is in a piece group with an origin
+    to be the position on the table and the g to be the root piece group. Each
+    piece is a dict with the x, y, and g. The values are kept as the same type
+    (str or int).
+    """
+    piece_groups = list(
+        set(
+            [
+                piece.get("g")
+                for piece in pieces
+                if piece.get("g") not in (None, "") and piece.get("x") is not None
+            ]
+        )
+    )
+    if not piece_groups:
+        return pieces
+    origins = load_piece_group_origins(redis_connection, puzzle, piece_groups)
+    for piece in pieces:
+        if piece.get("g") in (None, "") or piece.get("x") is None:
+            continue
+        origin = find_piece_group_origin(origins, piece["g"])
+        if origin is None:
+            continue
+        (root, origin_x, origin_y) = origin
+        piece["x"] = type(piece["x"])(int(piece["x"]) + origin_x)
+        piece["y"] = type(piece["y"])(int(piece["y"]) + origin_y)
+        piece["g"] = type(piece["g"])(root)
+    return pieces
+
+
 class PieceMutateProcess:
     ""
 
@@ -32,6 +186,8 @@ class PieceMutateProcess:
         piece_move_timeout=4,
         piece_join_tolerance=100,
         piece_count=0,
+        concurrency=CONCURRENCY_PUZZLE,
+        group_positions=GROUP_POSITIONS_ABSOLUTE,
     ):
         ""
         self.redis_connection = redis_connection
@@ -45,18 +201,23 @@ class PieceMutateProcess:
         self.piece_move_timeout = piece_move_timeout
         self.piece_join_tolerance = piece_join_tolerance
         self.piece_count = piece_count
+        self.concurrency = concurrency
+        self.group_positions = group_positions
 
         self.watched_keys = set()
+        # The pipe that is watching the keys with the "piece" concurrency
+        self.watch_pipe = None
 
-        self.pzm_puzzle_key = "pzm:{puzzle}".format(puzzle=puzzle)
-        # Bump the pzm id when preparing to mutate the puzzle.
-        self.puzzle_mutation_id = self.redis_connection.incr(self.pzm_puzzle_key)
-        self.redis_connection.expire(self.pzm_puzzle_key, piece_move_timeout + 2)
-        self.watched_keys.add(self.pzm_puzzle_key)
+        self.pzm_puzzle_key = get_puzzle_key("pzm", puzzle)
+        if self.concurrency == CONCURRENCY_PUZZLE:
+            # Bump the pzm id when preparing to mutate the puzzle.
+            self.puzzle_mutation_id = self.redis_connection.incr(self.pzm_puzzle_key)
+            self.redis_connection.expire(self.pzm_puzzle_key, piece_move_timeout + 2)
+            self.watched_keys.add(self.pzm_puzzle_key)
 
-        self.pc_puzzle_piece_key = "pc:{puzzle}:{piece}".format(
-            puzzle=puzzle, piece=piece
-        )
+        self.pc_puzzle_piece_key = get_puzzle_key("pc", puzzle, piece)
+        self.pcfixed_puzzle_key = get_pcfixed_key(puzzle)
+        self.pcstacked_puzzle_key = get_pcstacked_key(puzzle)
 
         self.origin_x = None
         self.origin_y = None
@@ -72,18 +233,35 @@ class PieceMutateProcess:
 
         self.grouped_piece_properties = None
         self.all_other_pieces_in_piece_group = set()
+        # The piece and adjacent pieces that are immovable or stacked
         self.pcfixed_puzzle = set()
         self.pcstacked_puzzle = set()
         self.publish_message = []
+        self.group_publish_message = None
+
+        # piece group: origin properties as stored for the loaded piece groups
+        self.piece_group_origin_properties = {}
+        # piece group: (x, y) of the origin on the table for piece groups that
+        # have one
+        self.piece_group_origins = {}
+        # piece group: root piece group for piece groups that have an origin
+        self.piece_group_roots = {}
+        # root piece group: count of pieces
+        self.piece_group_sizes = {}
 
         self.can_join_adjacent_piece = None
+        # Other adjacent pieces in other piece groups that are also joined
+        self.can_join_other_adjacent_pieces = []
 
     def start(self):
         ""
+        if self.concurrency == CONCURRENCY_PIECE:
+            return self._start_piece_concurrency()
 
         self._load_related_pieces()
 
         self._set_can_join_adjacent_piece()
+        self._load_grouped_piece_properties_for_join()
 
         msg = ""
         status = ""
@@ -105,23 +283,32 @@ class PieceMutateProcess:
                 status = "moved"
             else:
                 msg += self._join_pieces(pipe)
-                if self._puzzle_completed():
-                    status = "completed"
-                else:
-                    status = "joined"
+                status = "joined"
 
             # Bump the pzm id when done mutating the puzzle on the last phase.
             pipe.incr(self.pzm_puzzle_key)
 
+            # Count the immovable pieces to know if the puzzle was completed.
+            pipe.bitcount(self.pcfixed_puzzle_key)
+
             result = pipe.execute()
             if not result:
                 raise PieceMutateError("end conflict")
-            if len(self.publish_message) != 0:
-                self.redis_connection.publish(
-                    f"enforcer_piece_group_translate:{self.puzzle}", "_".join(self.publish_message)
-                )
+            if status == "joined" and result[-1] == self.piece_count:
+                status = "completed"
+            self._publish_to_enforcer()
         return (msg, status)
 
+    def _publish_to_enforcer(self):
+        if len(self.publish_message) != 0:
+            self.redis_connection.publish(
+                f"enforcer_piece_group_translate:{self.puzzle}", "_".join(self.publish_message)
+            )
+        if self.group_publish_message is not None:
+            self.redis_connection.publish(
+                f"enforcer_piece_group_move:{self.puzzle}", self.group_publish_message
+            )
+
     def _load_related_pieces(self):
         """
         get all piece details and associated pieces.
@@ -146,30 +333,25 @@ class PieceMutateProcess:
             # Put back to buffered mode since the watch was called.
             pipe.multi()
 
-            pcg_puzzle_g_key = "pcg:{puzzle}:{piece_group}".format(
-                puzzle=self.puzzle,
-                piece_group=self.piece_properties.get("g", self.piece),
+            pcg_puzzle_g_key = get_puzzle_key(
+                "pcg", self.puzzle, self.piece_properties.get("g", self.piece)
             )
-            self.origin_x = self.piece_properties.get("x")
-            self.origin_y = self.piece_properties.get("y")
-            self.origin_r = self.piece_properties.get("r")
-            self._update_target_position(self.target_x, self.target_y)
 
-            # pcfixed_puzzle
-            pipe.smembers("pcfixed:{puzzle}".format(puzzle=self.puzzle))
-            # pcstacked_puzzle
-            pipe.smembers("pcstacked:{puzzle}".format(puzzle=self.puzzle))
             # pcg_puzzle_g
             pipe.smembers(pcg_puzzle_g_key)
 
             # pc_puzzle_adjacent_piece_properties
             for adjacent_piece in adjacent_pieces_list:
-                pc_puzzle_adjacent_piece_key = "pc:{puzzle}:{adjacent_piece}".format(
-                    puzzle=self.puzzle, adjacent_piece=adjacent_piece
+                pc_puzzle_adjacent_piece_key = get_puzzle_key(
+                    "pc", self.puzzle, adjacent_piece
                 )
                 pipe.hgetall(pc_puzzle_adjacent_piece_key)
                 self.watched_keys.add(pc_puzzle_adjacent_piece_key)
 
+            # pcfixed_puzzle and pcstacked_puzzle
+            status_pieces_list = [self.piece] + adjacent_pieces_list
+            self._queue_piece_status(pipe, status_pieces_list)
+
             # pcg_puzzle_piece_group_count =countOfPiecesInPieceGroup
             # pipe.scard(
             #     "pcg:{puzzle}:{g}".format(
@@ -181,20 +363,17 @@ class PieceMutateProcess:
             if not phase_1_response:
                 raise PieceMutateError("phase 1 conflict")
             (
-                pcfixed_puzzle,
-                pcstacked_puzzle,
                 pcg_puzzle_g,
                 pc_puzzle_adjacent_piece_properties,
+                piece_status,
                 #pcg_puzzle_piece_group_count,
             ) = (
                 phase_1_response[0],
-                phase_1_response[1],
-                phase_1_response[2],
-                phase_1_response[3 : 3 + len(adjacent_pieces_list)],
-                # phase_1_response[3 + len(adjacent_pieces_list)],
+                phase_1_response[1 : 1 + len(adjacent_pieces_list)],
+                phase_1_response[1 + len(adjacent_pieces_list) :],
+                # phase_1_response[1 + len(adjacent_pieces_list)],
             )
-            self.pcfixed_puzzle = set(map(int, pcfixed_puzzle))
-            self.pcstacked_puzzle = set(map(int, pcstacked_puzzle))
+            self._set_piece_status(status_pieces_list, piece_status)
             #current_app.logger.debug(f"piece:{self.piece} stacked {self.pcstacked_puzzle}")
             pcg_puzzle_g = set(map(int, pcg_puzzle_g))
             self.all_other_pieces_in_piece_group = pcg_puzzle_g.copy()
@@ -227,14 +406,14 @@ class PieceMutateProcess:
 
             # updateGroupedPiecesPositions groupedPiecesXY
             # pc_puzzle_grouped_pieces
-            grouped_piece_property_list = ["x", "y", "r", "g"]
-            for grouped_piece in self.all_other_pieces_in_piece_group:
-                pc_puzzle_grouped_piece_key = "pc:{puzzle}:{grouped_piece}".format(
-                    puzzle=self.puzzle, grouped_piece=grouped_piece
+            grouped_piece_list = self._get_grouped_piece_list()
+            for grouped_piece in grouped_piece_list:
+                pc_puzzle_grouped_piece_key = get_puzzle_key(
+                    "pc", self.puzzle, grouped_piece
                 )
                 pipe.hmget(
                     pc_puzzle_grouped_piece_key,
-                    grouped_piece_property_list,
+                    GROUPED_PIECE_PROPERTY_LIST,
                 )
                 self.watched_keys.add(pc_puzzle_grouped_piece_key)
 
@@ -242,44 +421,335 @@ class PieceMutateProcess:
             # for adjacent_piece_group
             adjacent_group_list = list(set(self.adjacent_piece_group_ids.values()))
             for adjacent_group in adjacent_group_list:
-                pcg_puzzle_adjacent_group_count_key = "pcg:{puzzle}:{g}".format(
-                    puzzle=self.puzzle, g=adjacent_group
+                pcg_puzzle_adjacent_group_count_key = get_puzzle_key(
+                    "pcg", self.puzzle, adjacent_group
                 )
                 pipe.scard(pcg_puzzle_adjacent_group_count_key)
 
             phase_2_response = pipe.execute()
             if (
-                len(self.all_other_pieces_in_piece_group) or len(adjacent_group_list)
+                len(grouped_piece_list) or len(adjacent_group_list)
             ) and not phase_2_response:
                 raise PieceMutateError("phase 2 conflict")
-            (pc_puzzle_grouped_pieces, pcg_puzzle_piece_adjacent_group_counts) = (
-                phase_2_response[: len(self.all_other_pieces_in_piece_group)],
-                phase_2_response[
-                    len(self.all_other_pieces_in_piece_group) : len(
-                        self.all_other_pieces_in_piece_group
+            self._set_grouped_piece_properties(
+                grouped_piece_list, phase_2_response[: len(grouped_piece_list)]
+            )
+            self.adjacent_piece_group_counts = dict(
+                list(
+                    zip(
+                        adjacent_group_list,
+                        phase_2_response[len(grouped_piece_list) :],
                     )
-                    + len(adjacent_group_list)
-                ],
+                )
+            )
+
+        # piece group origins
+        self._load_piece_group_origins()
+
+    def _start_piece_concurrency(self):
+        """
+        Mutate the piece while only watching the keys for the pieces and piece
+        groups that are involved. Each key is watched before it is read so any
+        change made to it by another piece mutation will fail the transaction.
+        Piece mutations that don't share any of these keys can be done at the
+        same time on the puzzle.
+        """
+        msg = ""
+        status = ""
+        with self.redis_connection.pipeline(transaction=True) as pipe:
+            self._load_related_pieces_watched(pipe)
+
+            self.watch_pipe = pipe
+            self._set_can_join_adjacent_piece()
+            self._load_grouped_piece_properties_for_join()
+
+            # Put back to buffered mode since the watch was called.
+            pipe.multi()
+
+            if self.can_join_adjacent_piece is None:
+                msg += self._move_pieces(pipe)
+                status = "moved"
+            else:
+                msg += self._join_pieces(pipe)
+                status = "joined"
+
+            # The pcfixed bitmap is shared by all pieces on the puzzle and is
+            # not watched. Get the count of it within the transaction to know
+            # if this piece mutation completed the puzzle.
+            pipe.bitcount(self.pcfixed_puzzle_key)
+
+            result = pipe.execute()
+            if not result:
+                raise PieceMutateError("end conflict")
+            if status == "joined" and result[-1] == self.piece_count:
+                status = "completed"
+            self._publish_to_enforcer()
+        return (msg, status)
+
+    def _load_related_pieces_watched(self, pipe):
+        """
+        Same as _load_related_pieces, but the keys are watched on the pipe
+        before they are read. The reads are done in a separate pipeline so they
+        can still be batched while the pipe is watching. The teardown key is
+        watched first so the piece data being removed is a conflict.
+        """
+        teardown_key = get_puzzle_teardown_key(self.puzzle)
+        pipe.watch(teardown_key, self.pc_puzzle_piece_key)
+        self.watched_keys.update([teardown_key, self.pc_puzzle_piece_key])
+        if pipe.exists(teardown_key):
+            raise PieceMutateError("teardown")
+        self.piece_properties = self._int_piece_properties(
+            pipe.hgetall(self.pc_puzzle_piece_key)
+        )
+        if not self.piece_properties:
+            raise PieceMutateError("piece is missing")
+        adjacent_pieces_list = self._get_adjacent_pieces_list(self.piece_properties)
+
+        ## phase 1
+        pcg_puzzle_g_key = get_puzzle_key(
+            "pcg", self.puzzle, self.piece_properties.get("g", self.piece)
+        )
+        pc_puzzle_adjacent_piece_keys = list(
+            map(
+                lambda adjacent_piece: get_puzzle_key(
+                    "pc", self.puzzle, adjacent_piece
+                ),
+                adjacent_pieces_list,
+            )
+        )
+        phase_1_keys = [pcg_puzzle_g_key] + pc_puzzle_adjacent_piece_keys
+        pipe.watch(*phase_1_keys)
+        self.watched_keys.update(phase_1_keys)
+        status_pieces_list = [self.piece] + adjacent_pieces_list
+        with self.redis_connection.pipeline(transaction=False) as read_pipe:
+            read_pipe.smembers(pcg_puzzle_g_key)
+            for pc_puzzle_adjacent_piece_key in pc_puzzle_adjacent_piece_keys:
+                read_pipe.hgetall(pc_puzzle_adjacent_piece_key)
+            self._queue_piece_status(read_pipe, status_pieces_list)
+            phase_1_response = read_pipe.execute()
+        (pcg_puzzle_g, pc_puzzle_adjacent_piece_properties, piece_status,) = (
+            phase_1_response[0],
+            phase_1_response[1 : 1 + len(adjacent_pieces_list)],
+            phase_1_response[1 + len(adjacent_pieces_list) :],
+        )
+        self._set_piece_status(status_pieces_list, piece_status)
+        self.all_other_pieces_in_piece_group = set(map(int, pcg_puzzle_g))
+        self.all_other_pieces_in_piece_group.discard(self.piece)
+        pc_puzzle_adjacent_piece_properties = list(
+            map(self._int_piece_properties, pc_puzzle_adjacent_piece_properties)
+        )
+        self.adjacent_piece_properties = dict(
+            list(zip(adjacent_pieces_list, pc_puzzle_adjacent_piece_properties))
+        )
+        self.adjacent_piece_group_ids = self._get_adjacent_piece_group_ids(
+            self.adjacent_piece_properties
+        )
+
+        ## phase 2
+        grouped_piece_list = self._get_grouped_piece_list()
+        pc_puzzle_grouped_piece_keys = list(
+            map(
+                lambda grouped_piece: get_puzzle_key("pc", self.puzzle, grouped_piece),
+                grouped_piece_list,
             )
-            pc_puzzle_grouped_pieces = list(
-                map(
-                    self._int_piece_properties,
+        )
+        adjacent_group_list = list(set(self.adjacent_piece_group_ids.values()))
+        pcg_puzzle_adjacent_group_keys = list(
+            map(
+                lambda adjacent_group: get_puzzle_key(
+                    "pcg", self.puzzle, adjacent_group
+                ),
+                adjacent_group_list,
+            )
+        )
+        phase_2_keys = pc_puzzle_grouped_piece_keys + pcg_puzzle_adjacent_group_keys
+        if phase_2_keys:
+            pipe.watch(*phase_2_keys)
+            self.watched_keys.update(phase_2_keys)
+        with self.redis_connection.pipeline(transaction=False) as read_pipe:
+            for pc_puzzle_grouped_piece_key in pc_puzzle_grouped_piece_keys:
+                read_pipe.hmget(pc_puzzle_grouped_piece_key, GROUPED_PIECE_PROPERTY_LIST)
+            for pcg_puzzle_adjacent_group_key in pcg_puzzle_adjacent_group_keys:
+                read_pipe.scard(pcg_puzzle_adjacent_group_key)
+            phase_2_response = read_pipe.execute()
+        self._set_grouped_piece_properties(
+            grouped_piece_list, phase_2_response[: len(grouped_piece_list)]
+        )
+        self.adjacent_piece_group_counts = dict(
+            list(zip(adjacent_group_list, phase_2_response[len(grouped_piece_list) :]))
+        )
+
+        # piece group origins
+        self._load_piece_group_origins(pipe=pipe)
+
+    def _queue_piece_status(self, pipe, pieces):
+        "Get the immovable and then the stacked status bits of the pieces."
+        for piece in pieces:
+            pipe.getbit(self.pcfixed_puzzle_key, piece)
+        for piece in pieces:
+            pipe.getbit(self.pcstacked_puzzle_key, piece)
+
+    def _set_piece_status(self, pieces, response):
+        self.pcfixed_puzzle.update(
+            [piece for (piece, bit) in zip(pieces, response[: len(pieces)]) if bit]
+        )
+        self.pcstacked_puzzle.update(
+            [piece for (piece, bit) in zip(pieces, response[len(pieces) :]) if bit]
+        )
+
+    def _get_grouped_piece_list(self):
+        """
+        The other pieces in the piece group to load with the related pieces.
+        With relative piece group positions these are only needed when joining
+        so they are loaded later.
+        """
+        if self.group_positions == GROUP_POSITIONS_RELATIVE:
+            return []
+        return list(self.all_other_pieces_in_piece_group)
+
+    def _get_piece_group_list(self):
+        "The piece group of the piece and the adjacent piece groups."
+        piece_groups = set(self.adjacent_piece_group_ids.values())
+        if self.piece_properties.get("g") is not None:
+            piece_groups.add(self.piece_properties["g"])
+        return list(piece_groups)
+
+    def _set_grouped_piece_properties(self, grouped_piece_list, response):
+        self.grouped_piece_properties = dict(
+            list(
+                zip(
+                    grouped_piece_list,
                     map(
-                        lambda x: dict(list(zip(grouped_piece_property_list, x))),
-                        pc_puzzle_grouped_pieces,
+                        self._int_piece_properties,
+                        map(
+                            lambda x: dict(list(zip(GROUPED_PIECE_PROPERTY_LIST, x))),
+                            response,
+                        ),
                     ),
                 )
             )
-            self.adjacent_piece_group_counts = dict(
-                list(zip(adjacent_group_list, pcg_puzzle_piece_adjacent_group_counts))
-            )
+        )
 
-            # groupedPiecesXY plus g
-            self.grouped_piece_properties = dict(
-                list(
-                    zip(self.all_other_pieces_in_piece_group, pc_puzzle_grouped_pieces)
+    def _load_piece_group_origins(self, pipe=None):
+        """
+        Load the origins of the piece group of the piece and the adjacent piece
+        groups and update the positions of the loaded pieces to be the position
+        on the table. The keys are watched on the pipe if it is set.
+        """
+        self._add_piece_group_origins(self._get_piece_group_list(), pipe=pipe)
+
+        self._resolve_position(self.piece_properties)
+        for adjacent_piece_props in self.adjacent_piece_properties.values():
+            self._resolve_position(adjacent_piece_props)
+        for grouped_piece_props in self.grouped_piece_properties.values():
+            self._resolve_position(grouped_piece_props)
+
+        self.origin_x = self.piece_properties.get("x")
+        self.origin_y = self.piece_properties.get("y")
+        self.origin_r = self.piece_properties.get("r")
+        self._update_target_position(self.target_x, self.target_y)
+
+    def _add_piece_group_origins(self, piece_group_list, pipe=None):
+        """
+        Load the origins of the piece groups and with relative piece group
+        positions the count of pieces in their root piece groups. The keys are
+        watched on the pipe if it is set.
+        """
+        origins = load_piece_group_origins(
+            self.redis_connection, self.puzzle, piece_group_list, pipe=pipe
+        )
+        if pipe is not None:
+            self.watched_keys.update(
+                [
+                    get_piece_group_origin_key(self.puzzle, piece_group)
+                    for piece_group in origins.keys()
+                ]
+            )
+        self.piece_group_origin_properties.update(origins)
+        for piece_group in origins.keys():
+            origin = find_piece_group_origin(origins, piece_group)
+            if origin is not None:
+                (root, x, y) = origin
+                self.piece_group_roots[piece_group] = root
+                self.piece_group_origins[piece_group] = (x, y)
+
+        if self.group_positions == GROUP_POSITIONS_RELATIVE:
+            # Root piece groups without a count of pieces have not been merged.
+            root_piece_group_list = list(
+                set(map(self._get_piece_group_root, piece_group_list))
+            )
+            for root in root_piece_group_list:
+                if "n" in origins.get(root, {}):
+                    self.piece_group_sizes[root] = origins[root]["n"]
+            count_piece_group_list = list(
+                set(root_piece_group_list).difference(self.piece_group_sizes.keys())
+            )
+            pcg_puzzle_root_keys = [
+                get_puzzle_key("pcg", self.puzzle, root)
+                for root in count_piece_group_list
+            ]
+            if pipe is not None and pcg_puzzle_root_keys:
+                pipe.watch(*pcg_puzzle_root_keys)
+                self.watched_keys.update(pcg_puzzle_root_keys)
+            with self.redis_connection.pipeline(transaction=False) as read_pipe:
+                for pcg_puzzle_root_key in pcg_puzzle_root_keys:
+                    read_pipe.scard(pcg_puzzle_root_key)
+                self.piece_group_sizes.update(
+                    dict(zip(count_piece_group_list, read_pipe.execute()))
                 )
+
+    def _get_piece_group_root(self, piece_group):
+        return self.piece_group_roots.get(piece_group, piece_group)
+
+    @property
+    def count_of_other_pieces_in_piece_group(self):
+        piece_group = self.piece_properties.get("g")
+        if piece_group is not None and self.group_positions == GROUP_POSITIONS_RELATIVE:
+            return self.piece_group_sizes[self._get_piece_group_root(piece_group)] - 1
+        return len(self.all_other_pieces_in_piece_group)
+
+    def _resolve_position(self, piece_properties):
+        origin = self.piece_group_origins.get(piece_properties.get("g"))
+        if origin is not None and piece_properties.get("x") is not None:
+            piece_properties["x"] += origin[0]
+            piece_properties["y"] += origin[1]
+
+    def _get_stored_position(self, x, y, piece_group):
+        "The x and y to store for a piece that is in the piece group."
+        origin = self.piece_group_origins.get(piece_group)
+        if origin is None:
+            return (x, y)
+        return (x - origin[0], y - origin[1])
+
+    def _load_grouped_piece_properties_for_join(self):
+        """
+        Load the other pieces in the piece group if the piece will be joined
+        and they were not loaded with the related pieces. These keys are not
+        watched since the pieces in a piece group with an origin are only
+        changed when the piece group (which is watched) is also changed.
+        """
+        if (
+            self.can_join_adjacent_piece is None
+            or self.group_positions == GROUP_POSITIONS_RELATIVE
+        ):
+            return
+        grouped_piece_list = list(
+            self.all_other_pieces_in_piece_group.difference(
+                self.grouped_piece_properties.keys()
             )
+        )
+        if not grouped_piece_list:
+            return
+        with self.redis_connection.pipeline(transaction=False) as read_pipe:
+            for grouped_piece in grouped_piece_list:
+                read_pipe.hmget(
+                    get_puzzle_key("pc", self.puzzle, grouped_piece),
+                    GROUPED_PIECE_PROPERTY_LIST,
+                )
+            response = read_pipe.execute()
+        self._set_grouped_piece_properties(grouped_piece_list, response)
+        for grouped_piece_props in self.grouped_piece_properties.values():
+            self._resolve_position(grouped_piece_props)
 
     def _update_target_position(self, x, y):
         self.target_x = x
@@ -301,10 +771,9 @@ class PieceMutateProcess:
             if int(adjacent_piece) in self.pcstacked_puzzle:
                 continue
             # Skip if adjacent piece in same group
-            if (
-                piece_group is not None
-                and self.adjacent_piece_group_ids.get(adjacent_piece) == piece_group
-            ):
+            if piece_group is not None and self._get_piece_group_root(
+                self.adjacent_piece_group_ids.get(adjacent_piece)
+            ) == self._get_piece_group_root(piece_group):
                 continue
 
             (offset_from_piece_x, offset_from_piece_y) = list(
@@ -334,73 +803,368 @@ class PieceMutateProcess:
                 f"{self.user}:{self.piece}:{new_target_x}:{new_target_y}"
             )
             self._update_target_position(new_target_x, new_target_y)
+            self._set_can_join_other_adjacent_pieces()
             break
 
+    def _get_joined_piece_group(self, adjacent_piece):
+        "The root piece group of the adjacent piece or the piece if not in one."
+        adjacent_piece_group = self.adjacent_piece_group_ids.get(adjacent_piece)
+        if adjacent_piece_group is None:
+            return adjacent_piece
+        return self._get_piece_group_root(adjacent_piece_group)
+
+    def _set_can_join_other_adjacent_pieces(self):
+        """
+        Find the other adjacent pieces that are within the tolerance of the
+        piece or the other pieces in its piece group after it has been joined
+        to the adjacent piece. Each of these is in a different piece group and
+        is joined in the same move.
+        """
+        tolerance = int(self.piece_join_tolerance / 2)
+        joined_piece_groups = set(
+            [self._get_joined_piece_group(self.can_join_adjacent_piece)]
+        )
+        piece_group = self.piece_properties.get("g")
+        if piece_group is not None:
+            joined_piece_groups.add(self._get_piece_group_root(piece_group))
+        if (
+            self.group_positions != GROUP_POSITIONS_RELATIVE
+            and self.adjacent_piece_group_ids.get(self.can_join_adjacent_piece)
+            in self.piece_group_origins
+        ):
+            # The other pieces would need to be stored relative to the origin.
+            return
+        # (adjacent piece, offset from the piece next to it, x and y of the
+        # piece next to it after the move)
+        adjacent_piece_offsets = [
+            (
+                adjacent_piece,
+                self.piece_properties.get(str(adjacent_piece)),
+                self.target_x,
+                self.target_y,
+            )
+            for adjacent_piece in self.adjacent_piece_properties.keys()
+        ]
+        adjacent_piece_offsets.extend(
+            self._load_group_adjacent_pieces(pipe=self.watch_pipe)
+        )
+        for (adjacent_piece, offset, x, y) in adjacent_piece_offsets:
+            adjacent_piece_props = self.adjacent_piece_properties[adjacent_piece]
+            if adjacent_piece in self.pcstacked_puzzle:
+                continue
+            adjacent_piece_group = self._get_joined_piece_group(adjacent_piece)
+            if adjacent_piece_group in joined_piece_groups:
+                continue
+            if (
+                self.group_positions != GROUP_POSITIONS_RELATIVE
+                and self.adjacent_piece_group_ids.get(adjacent_piece)
+                in self.piece_group_origins
+            ):
+                continue
+
+            (offset_from_piece_x, offset_from_piece_y) = list(
+                map(int, offset.split(","))
+            )
+            if not (
+                abs(adjacent_piece_props["x"] - (offset_from_piece_x + x)) < tolerance
+                and abs(adjacent_piece_props["y"] - (offset_from_piece_y + y))
+                < tolerance
+            ):
+                continue
+            joined_piece_groups.add(adjacent_piece_group)
+            self.can_join_other_adjacent_pieces.append(adjacent_piece)
+
+    def _load_group_adjacent_pieces(self, pipe=None):
+        """
+        Load the adjacent pieces of the other pieces in the piece group that
+        are not in the piece group. They are added to the adjacent pieces so
+        they can be joined. Returns a list of (adjacent piece, offset from the
+        grouped piece, x and y of the grouped piece after the move). The
+        adjacent pieces are watched on the pipe if it is set. The grouped
+        pieces are not since they are only changed when the piece group (which
+        is watched) is also changed.
+        """
+        piece_group = self.piece_properties.get("g")
+        if piece_group is None:
+            return []
+        if self.group_positions == GROUP_POSITIONS_RELATIVE:
+            group_pieces = get_piece_group_members(
+                self.redis_connection,
+                self.puzzle,
+                self._get_piece_group_root(piece_group),
+            )
+        else:
+            group_pieces = self.all_other_pieces_in_piece_group
+        group_pieces = set(group_pieces)
+        group_pieces.add(self.piece)
+        grouped_piece_list = sorted(group_pieces.difference([self.piece]))
+        if not grouped_piece_list:
+            return []
+        with self.redis_connection.pipeline(transaction=False) as read_pipe:
+            for grouped_piece in grouped_piece_list:
+                read_pipe.hgetall(get_puzzle_key("pc", self.puzzle, grouped_piece))
+            grouped_pieces_properties = list(
+                map(self._int_piece_properties, read_pipe.execute())
+            )
+
+        group_adjacent_pieces = []
+        adjacent_pieces_list = []
+        for (grouped_piece, grouped_piece_props) in zip(
+            grouped_piece_list, grouped_pieces_properties
+        ):
+            for adjacent_piece in self._get_adjacent_pieces_list(grouped_piece_props):
+                if adjacent_piece in group_pieces:
+                    continue
+                group_adjacent_pieces.append((grouped_piece_props, adjacent_piece))
+                if (
+                    adjacent_piece not in self.adjacent_piece_properties
+                    and adjacent_piece not in adjacent_pieces_list
+                ):
+                    adjacent_pieces_list.append(adjacent_piece)
+
+        pc_puzzle_adjacent_piece_keys = [
+            get_puzzle_key("pc", self.puzzle, adjacent_piece)
+            for adjacent_piece in adjacent_pieces_list
+        ]
+        if pipe is not None and pc_puzzle_adjacent_piece_keys:
+            pipe.watch(*pc_puzzle_adjacent_piece_keys)
+            self.watched_keys.update(pc_puzzle_adjacent_piece_keys)
+        with self.redis_connection.pipeline(transaction=False) as read_pipe:
+            for pc_puzzle_adjacent_piece_key in pc_puzzle_adjacent_piece_keys:
+                read_pipe.hgetall(pc_puzzle_adjacent_piece_key)
+            self._queue_piece_status(read_pipe, adjacent_pieces_list)
+            response = read_pipe.execute()
+        self._set_piece_status(
+            adjacent_pieces_list, response[len(adjacent_pieces_list) :]
+        )
+        adjacent_piece_properties = dict(
+            [
+                (adjacent_piece, self._int_piece_properties(adjacent_piece_props))
+                for (adjacent_piece, adjacent_piece_props) in zip(
+                    adjacent_pieces_list, response[: len(adjacent_pieces_list)]
+                )
+                # Skip if adjacent piece is missing
+                if adjacent_piece_props.get("x") is not None
+            ]
+        )
+        adjacent_piece_group_ids = self._get_adjacent_piece_group_ids(
+            adjacent_piece_properties
+        )
+
+        # The piece groups of the adjacent pieces are joined
+        pcg_puzzle_adjacent_group_keys = [
+            get_puzzle_key("pcg", self.puzzle, adjacent_group)
+            for adjacent_group in set(adjacent_piece_group_ids.values())
+        ]
+        if pipe is not None and pcg_puzzle_adjacent_group_keys:
+            pipe.watch(*pcg_puzzle_adjacent_group_keys)
+            self.watched_keys.update(pcg_puzzle_adjacent_group_keys)
+        piece_group_list = set(adjacent_piece_group_ids.values())
+        piece_group_list.update(
+            [
+                grouped_piece_props["g"]
+                for grouped_piece_props in grouped_pieces_properties
+                if grouped_piece_props.get("g") is not None
+            ]
+        )
+        self._add_piece_group_origins(
+            list(piece_group_list.difference(self.piece_group_origin_properties)),
+            pipe=pipe,
+        )
+
+        for adjacent_piece_props in adjacent_piece_properties.values():
+            self._resolve_position(adjacent_piece_props)
+        for grouped_piece_props in grouped_pieces_properties:
+            self._resolve_position(grouped_piece_props)
+        self.adjacent_piece_properties.update(adjacent_piece_properties)
+        self.adjacent_piece_group_ids.update(adjacent_piece_group_ids)
+
+        return [
+            (
+                adjacent_piece,
+                grouped_piece_props[str(adjacent_piece)],
+                grouped_piece_props["x"] + self.offset_x,
+                grouped_piece_props["y"] + self.offset_y,
+            )
+            for (grouped_piece_props, adjacent_piece) in group_adjacent_pieces
+            if adjacent_piece in self.adjacent_piece_properties
+        ]
+
+    def _get_other_joined_immovable_pieces(self):
+        """
+        The pieces that become immovable when any of the other adjacent pieces
+        that are joined is immovable. The pieces joined to an immovable
+        adjacent piece (can_join_adjacent_piece) are already handled.
+        """
+        joined_pieces = [self.can_join_adjacent_piece]
+        joined_pieces.extend(self.can_join_other_adjacent_pieces)
+        if not self.pcfixed_puzzle.intersection(joined_pieces):
+            return set()
+        components = [
+            (adjacent_piece, self.adjacent_piece_group_ids.get(adjacent_piece))
+            for adjacent_piece in joined_pieces
+            if adjacent_piece not in self.pcfixed_puzzle
+        ]
+        if self.can_join_adjacent_piece not in self.pcfixed_puzzle:
+            components.append((self.piece, self.piece_properties.get("g")))
+        immovable_pieces = set()
+        for (piece, piece_group) in components:
+            immovable_pieces.add(piece)
+            if piece_group is not None:
+                immovable_pieces.update(
+                    get_piece_group_members(
+                        self.redis_connection,
+                        self.puzzle,
+                        self._get_piece_group_root(piece_group),
+                    )
+                )
+        return immovable_pieces
+
+    def _set_other_joined_pieces_immovable(self, pipe):
+        lines = []
+        for immovable_piece in sorted(self._get_other_joined_immovable_pieces()):
+            pipe.setbit(self.pcfixed_puzzle_key, immovable_piece, 1)
+            self.pcfixed_puzzle.add(immovable_piece)
+            pipe.setbit(self.pcstacked_puzzle_key, immovable_piece, 0)
+            self.pcstacked_puzzle.discard(immovable_piece)
+            lines.append(formatPieceMovementString(immovable_piece, s="1"))
+        return lines
+
+    def _join_other_adjacent_pieces(self, pipe, new_piece_group):
+        """
+        Join the other adjacent pieces and the pieces in their piece groups to
+        the new piece group. These pieces are already in place so only the
+        piece group is changed.
+        """
+        lines = []
+        for adjacent_piece in self.can_join_other_adjacent_pieces:
+            adjacent_piece_group = self.adjacent_piece_group_ids.get(adjacent_piece)
+            if adjacent_piece_group is None:
+                joined_pieces = set([adjacent_piece])
+            else:
+                joined_pieces = get_piece_group_members(
+                    self.redis_connection, self.puzzle, adjacent_piece_group
+                )
+                pipe.delete(get_puzzle_key("pcg", self.puzzle, adjacent_piece_group))
+            pipe.sadd(
+                get_puzzle_key("pcg", self.puzzle, new_piece_group),
+                *joined_pieces,
+            )
+            for joined_piece in sorted(joined_pieces):
+                self._set_piece_properties(pipe, joined_piece, {"g": new_piece_group})
+                lines.append(formatPieceMovementString(joined_piece, g=new_piece_group))
+        return lines
+
     def _move_pieces(self, pipe):
         "Only move the piece and the other pieces in the group to the target position"
         lines = []
         msg = ""
+        piece_group = self.piece_properties.get("g")
+
+        if (
+            piece_group is not None
+            and self.group_positions == GROUP_POSITIONS_RELATIVE
+        ):
+            # Only move the origin of the piece group. A piece group without
+            # an origin has the positions of the pieces relative to 0, 0.
+            piece_group = self._get_piece_group_root(piece_group)
+            (origin_x, origin_y) = self.piece_group_origins.get(piece_group, (0, 0))
+            self._compress_piece_group_paths(pipe)
+            pipe.hmset(
+                get_piece_group_origin_key(self.puzzle, piece_group),
+                {"x": origin_x + self.offset_x, "y": origin_y + self.offset_y},
+            )
+            register_puzzle_keys(
+                pipe, self.puzzle, get_piece_group_origin_key(self.puzzle, piece_group)
+            )
+            lines.append(
+                formatPieceGroupMovementString(
+                    self.piece,
+                    self.target_x,
+                    self.target_y,
+                    piece_group,
+                    self.offset_x,
+                    self.offset_y,
+                )
+            )
+            self.group_publish_message = (
+                f"{self.user}:{piece_group}:{self.offset_x}:{self.offset_y}"
+            )
+            msg += "\n" + "\n".join(lines)
+            return msg
 
         # Move the piece
-        pipe.hmset(self.pc_puzzle_piece_key, {"x": self.target_x, "y": self.target_y})
+        self._set_piece_properties(
+            pipe, self.piece, {"x": self.target_x, "y": self.target_y}
+        )
 
         lines.append(
             formatPieceMovementString(self.piece, x=self.target_x, y=self.target_y)
         )
 
         # If the piece is grouped move the other pieces in group
-        if self.piece_properties.get("g") is not None:
+        if piece_group is not None:
             lines.extend(self._update_grouped_pieces_positions(pipe))
+            # The pieces in the piece group now have the position on the table
+            # so the origin is no longer used.
+            if piece_group in self.piece_group_origins:
+                pipe.delete(get_piece_group_origin_key(self.puzzle, piece_group))
         msg += "\n" + "\n".join(lines)
         return msg
 
     def _join_pieces(self, pipe):
         "Join the piece and the pieces group to the adjacent piece merging the two piece groups together."
+        if self.group_positions == GROUP_POSITIONS_RELATIVE:
+            return self._merge_pieces(pipe)
         lines = []
         msg = ""
         adjacent_piece_props = self.adjacent_piece_properties.get(
             self.can_join_adjacent_piece
         )
+        new_piece_group = adjacent_piece_props.get("g", self.can_join_adjacent_piece)
+        piece_group = self.piece_properties.get("g")
+
+        # The pieces joining the piece group are stored relative to the origin
+        # of the piece group if it has one.
+        if piece_group in self.piece_group_origins and piece_group != new_piece_group:
+            pipe.delete(get_piece_group_origin_key(self.puzzle, piece_group))
 
         # Move the piece
-        pipe.hmset(self.pc_puzzle_piece_key, {"x": self.target_x, "y": self.target_y})
+        (stored_x, stored_y) = self._get_stored_position(
+            self.target_x, self.target_y, new_piece_group
+        )
+        self._set_piece_properties(pipe, self.piece, {"x": stored_x, "y": stored_y})
         lines.append(
             formatPieceMovementString(self.piece, x=self.target_x, y=self.target_y)
         )
 
         # Set immovable status if adjacent piece is immovable
         if self.can_join_adjacent_piece in self.pcfixed_puzzle:
-            pipe.sadd("pcfixed:{puzzle}".format(puzzle=self.puzzle), self.piece)
+            pipe.setbit(self.pcfixed_puzzle_key, self.piece, 1)
             self.pcfixed_puzzle.add(self.piece)
             lines.append(formatPieceMovementString(self.piece, s="1"))
             for grouped_piece in self.all_other_pieces_in_piece_group:
-                pipe.sadd("pcfixed:{puzzle}".format(puzzle=self.puzzle), grouped_piece)
+                pipe.setbit(self.pcfixed_puzzle_key, grouped_piece, 1)
                 self.pcfixed_puzzle.add(grouped_piece)
-                pipe.srem("pcstacked:{puzzle}".format(puzzle=self.puzzle), grouped_piece)
+                pipe.setbit(self.pcstacked_puzzle_key, grouped_piece, 0)
                 try:
                     self.pcstacked_puzzle.remove(grouped_piece)
                 except KeyError:
                     pass
                 lines.append(formatPieceMovementString(grouped_piece, s="1"))
 
-        new_piece_group = adjacent_piece_props.get("g", self.can_join_adjacent_piece)
         # Update Piece group to that of the adjacent piece since it may already be in a group
         pipe.sadd(
-            "pcg:{puzzle}:{g}".format(puzzle=self.puzzle, g=new_piece_group),
+            get_puzzle_key("pcg", self.puzzle, new_piece_group),
             self.piece,
             self.can_join_adjacent_piece,
         )
-        pipe.hset(
-            self.pc_puzzle_piece_key,
-            "g",
-            new_piece_group,
+        register_puzzle_keys(
+            pipe, self.puzzle, get_puzzle_key("pcg", self.puzzle, new_piece_group)
         )
-        pipe.hset(
-            "pc:{puzzle}:{adjacent_piece}".format(
-                puzzle=self.puzzle, adjacent_piece=self.can_join_adjacent_piece
-            ),
-            "g",
-            new_piece_group,
+        self._set_piece_properties(pipe, self.piece, {"g": new_piece_group})
+        self._set_piece_properties(
+            pipe, self.can_join_adjacent_piece, {"g": new_piece_group}
         )
         lines.append(formatPieceMovementString(self.piece, g=new_piece_group))
         lines.append(
@@ -410,10 +1174,235 @@ class PieceMutateProcess:
             lines.extend(
                 self._update_grouped_pieces_positions(pipe, new_group=new_piece_group)
             )
+        if self.can_join_other_adjacent_pieces:
+            lines.extend(self._join_other_adjacent_pieces(pipe, new_piece_group))
+            lines.extend(self._set_other_joined_pieces_immovable(pipe))
+
+        msg += "\n" + "\n".join(lines)
+        return msg
+
+    def _merge_pieces(self, pipe):
+        """
+        Join the piece to the adjacent piece with relative piece group
+        positions. The piece group of the piece is moved by the origin. The
+        smaller piece group is then merged into the larger one by setting the
+        parent on the origin of it. The pieces in the piece groups that are
+        merged are not changed.
+        """
+        lines = []
+        msg = ""
+        adjacent_piece = self.can_join_adjacent_piece
+        adjacent_piece_props = self.adjacent_piece_properties.get(adjacent_piece)
+        piece_group = self.piece_properties.get("g")
+        if piece_group is not None:
+            piece_group = self._get_piece_group_root(piece_group)
+        adjacent_piece_group = adjacent_piece_props.get("g")
+        if adjacent_piece_group is not None:
+            adjacent_piece_group = self._get_piece_group_root(adjacent_piece_group)
+        self._compress_piece_group_paths(pipe)
+
+        if piece_group is not None:
+            (origin_x, origin_y) = self.piece_group_origins.get(piece_group, (0, 0))
+            self.piece_group_origins[piece_group] = (
+                origin_x + self.offset_x,
+                origin_y + self.offset_y,
+            )
+            lines.append(
+                formatPieceGroupMovementString(
+                    self.piece,
+                    self.target_x,
+                    self.target_y,
+                    piece_group,
+                    self.offset_x,
+                    self.offset_y,
+                )
+            )
+            # The enforcer moves all the pieces in the piece group (including
+            # this piece) by the offset.
+            self.publish_message = []
+            self.group_publish_message = (
+                f"{self.user}:{piece_group}:{self.offset_x}:{self.offset_y}"
+            )
+        else:
+            lines.append(
+                formatPieceMovementString(self.piece, x=self.target_x, y=self.target_y)
+            )
+
+        if piece_group is None and adjacent_piece_group is None:
+            new_piece_group = adjacent_piece
+            self.piece_group_origins[new_piece_group] = (0, 0)
+            self.piece_group_sizes[new_piece_group] = 0
+            lines.append(
+                self._add_to_piece_group(
+                    pipe,
+                    adjacent_piece,
+                    adjacent_piece_props["x"],
+                    adjacent_piece_props["y"],
+                    new_piece_group,
+                )
+            )
+            lines.append(
+                self._add_to_piece_group(
+                    pipe, self.piece, self.target_x, self.target_y, new_piece_group
+                )
+            )
+        elif piece_group is None:
+            new_piece_group = adjacent_piece_group
+            lines.append(
+                self._add_to_piece_group(
+                    pipe, self.piece, self.target_x, self.target_y, new_piece_group
+                )
+            )
+        elif adjacent_piece_group is None:
+            new_piece_group = piece_group
+            lines.append(
+                self._add_to_piece_group(
+                    pipe,
+                    adjacent_piece,
+                    adjacent_piece_props["x"],
+                    adjacent_piece_props["y"],
+                    new_piece_group,
+                )
+            )
+        else:
+            new_piece_group = self._union_piece_groups(
+                pipe, piece_group, adjacent_piece_group, lines
+            )
+
+        # Merge the other adjacent pieces and their piece groups
+        for other_adjacent_piece in self.can_join_other_adjacent_pieces:
+            other_piece_group = self.adjacent_piece_group_ids.get(other_adjacent_piece)
+            if other_piece_group is None:
+                other_adjacent_piece_props = self.adjacent_piece_properties[
+                    other_adjacent_piece
+                ]
+                lines.append(
+                    self._add_to_piece_group(
+                        pipe,
+                        other_adjacent_piece,
+                        other_adjacent_piece_props["x"],
+                        other_adjacent_piece_props["y"],
+                        new_piece_group,
+                    )
+                )
+            else:
+                new_piece_group = self._union_piece_groups(
+                    pipe,
+                    new_piece_group,
+                    self._get_piece_group_root(other_piece_group),
+                    lines,
+                )
+
+        (new_x, new_y) = self.piece_group_origins.get(new_piece_group, (0, 0))
+        pipe.hmset(
+            get_piece_group_origin_key(self.puzzle, new_piece_group),
+            {"x": new_x, "y": new_y, "n": self.piece_group_sizes[new_piece_group]},
+        )
+        register_puzzle_keys(
+            pipe,
+            self.puzzle,
+            get_puzzle_key("pcg", self.puzzle, new_piece_group),
+            get_piece_group_origin_key(self.puzzle, new_piece_group),
+        )
+
+        # Set immovable status if adjacent piece is immovable
+        if adjacent_piece in self.pcfixed_puzzle:
+            fixed_pieces = set([self.piece])
+            if piece_group is not None:
+                fixed_pieces.update(
+                    get_piece_group_members(
+                        self.redis_connection, self.puzzle, piece_group
+                    )
+                )
+            for fixed_piece in fixed_pieces:
+                pipe.setbit(self.pcfixed_puzzle_key, fixed_piece, 1)
+                self.pcfixed_puzzle.add(fixed_piece)
+                pipe.setbit(self.pcstacked_puzzle_key, fixed_piece, 0)
+                self.pcstacked_puzzle.discard(fixed_piece)
+                lines.append(formatPieceMovementString(fixed_piece, s="1"))
+        if self.can_join_other_adjacent_pieces:
+            lines.extend(self._set_other_joined_pieces_immovable(pipe))
 
         msg += "\n" + "\n".join(lines)
         return msg
 
+    def _union_piece_groups(self, pipe, piece_group, adjacent_piece_group, lines):
+        """
+        Merge the smaller piece group into the larger one by setting the parent
+        on the origin of it. Returns the piece group that it was merged into.
+        """
+        # Union by size
+        if (
+            self.piece_group_sizes[piece_group]
+            <= self.piece_group_sizes[adjacent_piece_group]
+        ):
+            (merged_piece_group, new_piece_group) = (
+                piece_group,
+                adjacent_piece_group,
+            )
+        else:
+            (merged_piece_group, new_piece_group) = (
+                adjacent_piece_group,
+                piece_group,
+            )
+        (merged_x, merged_y) = self.piece_group_origins.get(merged_piece_group, (0, 0))
+        (new_x, new_y) = self.piece_group_origins.get(new_piece_group, (0, 0))
+        merged_origin_key = get_piece_group_origin_key(self.puzzle, merged_piece_group)
+        pipe.hdel(merged_origin_key, "n")
+        pipe.hmset(
+            merged_origin_key,
+            {
+                "p": new_piece_group,
+                "x": merged_x - new_x,
+                "y": merged_y - new_y,
+            },
+        )
+        pipe.sadd(
+            get_piece_group_merged_key(self.puzzle, new_piece_group),
+            merged_piece_group,
+        )
+        register_puzzle_keys(
+            pipe,
+            self.puzzle,
+            merged_origin_key,
+            get_piece_group_merged_key(self.puzzle, new_piece_group),
+        )
+        self.piece_group_sizes[new_piece_group] += self.piece_group_sizes[
+            merged_piece_group
+        ]
+        lines.append(
+            formatPieceGroupMergeString(self.piece, new_piece_group, merged_piece_group)
+        )
+        return new_piece_group
+
+    def _add_to_piece_group(self, pipe, piece, x, y, piece_group):
+        "Add the piece at the x, y on the table to the piece group."
+        (stored_x, stored_y) = self._get_stored_position(x, y, piece_group)
+        self._set_piece_properties(
+            pipe, piece, {"x": stored_x, "y": stored_y, "g": piece_group}
+        )
+        pipe.sadd(get_puzzle_key("pcg", self.puzzle, piece_group), piece)
+        self.piece_group_sizes[piece_group] += 1
+        return formatPieceMovementString(piece, g=piece_group)
+
+    def _set_piece_properties(self, pipe, piece, properties):
+        "Set the piece properties on the pc hash and the packed piece positions."
+        pipe.hmset(get_puzzle_key("pc", self.puzzle, piece), properties)
+        set_piece_positions(pipe, self.puzzle, piece, properties)
+
+    def _compress_piece_group_paths(self, pipe):
+        "Set the parent of the loaded piece groups to be the root piece group."
+        for (piece_group, origin) in self.piece_group_origin_properties.items():
+            root = self._get_piece_group_root(piece_group)
+            if origin.get("p") in (None, root):
+                continue
+            (x, y) = self.piece_group_origins[piece_group]
+            (root_x, root_y) = self.piece_group_origins[root]
+            pipe.hmset(
+                get_piece_group_origin_key(self.puzzle, piece_group),
+                {"p": root, "x": x - root_x, "y": y - root_y},
+            )
+
     def _get_adjacent_pieces_list(self, piece_properties):
         "Get adjacent pieces list"
         # The "s" property is deprecated, but still need filter it out in case
@@ -462,34 +1451,28 @@ class PieceMutateProcess:
             new_y = origin_y + self.offset_y
             new_pc = {"x": new_x, "y": new_y}
             if new_group is not None:
+                (new_pc["x"], new_pc["y"]) = self._get_stored_position(
+                    new_x, new_y, new_group
+                )
                 # Remove from the old group and place in new_group
                 new_pc["g"] = new_group
                 pipe.sadd(
-                    "pcg:{puzzle}:{g}".format(puzzle=self.puzzle, g=new_group),
+                    get_puzzle_key("pcg", self.puzzle, new_group),
                     grouped_piece,
                 )
                 pipe.srem(
-                    "pcg:{puzzle}:{g}".format(
-                        puzzle=self.puzzle, g=self.piece_properties.get("g")
-                    ),
+                    get_puzzle_key("pcg", self.puzzle, self.piece_properties.get("g")),
                     grouped_piece,
                 )
             if status == "1":
-                pipe.sadd("pcfixed:{puzzle}".format(puzzle=self.puzzle), grouped_piece)
+                pipe.setbit(self.pcfixed_puzzle_key, grouped_piece, 1)
                 self.pcfixed_puzzle.add(grouped_piece)
-                pipe.srem(
-                    "pcstacked:{puzzle}".format(puzzle=self.puzzle), grouped_piece
-                )
+                pipe.setbit(self.pcstacked_puzzle_key, grouped_piece, 0)
                 try:
                     self.pcstacked_puzzle.remove(grouped_piece)
                 except KeyError:
                     pass
-            pipe.hmset(
-                "pc:{puzzle}:{grouped_piece}".format(
-                    puzzle=self.puzzle, grouped_piece=grouped_piece
-                ),
-                new_pc,
-            )
+            self._set_piece_properties(pipe, grouped_piece, new_pc)
             lines.append(
                 formatPieceMovementString(
                     grouped_piece, x=new_x, y=new_y, g=new_group, s=status
@@ -499,31 +1482,85 @@ class PieceMutateProcess:
                 f"{self.user}:{grouped_piece}:{new_x}:{new_y}"
             )
         if status == "1":
-            pipe.sadd("pcfixed:{puzzle}".format(puzzle=self.puzzle), self.piece)
+            pipe.setbit(self.pcfixed_puzzle_key, self.piece, 1)
             self.pcfixed_puzzle.add(self.piece)
-            pipe.srem("pcstacked:{puzzle}".format(puzzle=self.puzzle), self.piece)
+            pipe.setbit(self.pcstacked_puzzle_key, self.piece, 0)
             try:
                 self.pcstacked_puzzle.remove(self.piece)
             except KeyError:
                 pass
         if new_group is not None:
             # For the piece that doesn't need x,y updated remove from the old group and place in new_group
-            pipe.sadd(
-                "pcg:{puzzle}:{g}".format(puzzle=self.puzzle, g=new_group), self.piece
-            )
+            pipe.sadd(get_puzzle_key("pcg", self.puzzle, new_group), self.piece)
             pipe.srem(
-                "pcg:{puzzle}:{g}".format(
-                    puzzle=self.puzzle, g=self.piece_properties.get("g")
-                ),
+                get_puzzle_key("pcg", self.puzzle, self.piece_properties.get("g")),
                 self.piece,
             )
-            pipe.hset(
-                "pc:{puzzle}:{piece}".format(puzzle=self.puzzle, piece=self.piece),
-                "g",
-                new_group,
-            )
+            self._set_piece_properties(pipe, self.piece, {"g": new_group})
             lines.append(formatPieceMovementString(self.piece, g=new_group))
         return lines
 
-    def _puzzle_completed(self):
-        return len(self.pcfixed_puzzle) == self.piece_count
+
+class PieceMutateScript:
+    """
+    Same as the PieceMutateProcess, but the piece mutation is done with the
+    piece_mutate Lua script. The script is atomic so it will not conflict with
+    other piece mutations.
+    """
+
+    def __init__(
+        self,
+        redis_connection,
+        user,
+        puzzle,
+        piece,
+        target_x,
+        target_y,
+        target_r,
+        puzzle_rules={"all"},
+        piece_move_timeout=4,
+        piece_join_tolerance=100,
+        piece_count=0,
+        **kw
+    ):
+        ""
+        self.redis_connection = redis_connection
+        self.user = user
+        self.puzzle = puzzle
+        self.piece = piece
+        self.target_x = target_x
+        self.target_y = target_y
+        self.target_r = target_r
+        self.puzzle_rules = puzzle_rules
+        self.piece_move_timeout = piece_move_timeout
+        self.piece_join_tolerance = piece_join_tolerance
+        self.piece_count = piece_count
+
+        self.pzm_puzzle_key = get_puzzle_key("pzm", puzzle)
+        self.all_other_pieces_in_piece_group = set()
+
+    @property
+    def count_of_other_pieces_in_piece_group(self):
+        return len(self.all_other_pieces_in_piece_group)
+
+    def start(self):
+        ""
+        (msg, status, grouped_pieces) = run_script(
+            self.redis_connection,
+            "piece_mutate",
+            keys=[self.pzm_puzzle_key],
+            args=[
+                self.user,
+                self.puzzle,
+                self.piece,
+                self.target_x,
+                self.target_y,
+                self.piece_join_tolerance,
+                self.piece_count or 0,
+                self.piece_move_timeout,
+            ],
+        )
+        if status == "missing":
+            raise PieceMutateError("piece is missing")
+        self.all_other_pieces_in_piece_group = set(map(int, grouped_pieces))
+        return (msg, status)
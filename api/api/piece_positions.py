@@ -0,0 +1,107 @@
+"""
+Packed piece positions
+
+The mutable piece properties and the ones needed for showing the pieces are
+also stored for each puzzle in a single redis string (pcpos:{puzzle}).  Each
+piece has a fixed width record at the offset of its piece id which is updated
+with BITFIELD when the piece is changed.  The record has these big endian
+integers:
+
+    x   i32
+    y   i32
+    g   u32 (piece group + 1; 0 if the piece is not in a piece group)
+    r   u16
+    w   u16
+    h   u16
+    b   u8
+
+The record is padded to 20 bytes.  The x and y are the same as the ones stored
+in the pc:{puzzle}:{piece} hash so they may be relative to the piece group
+origin.  Loading the positions of all the pieces for a puzzle is a single GET.
+The piece_mutate.lua script uses the same layout.
+"""
+import struct
+
+from api.puzzle_keys import get_puzzle_key
+
+PIECE_POSITION_RECORD = struct.Struct(">iiIHHHBx")
+PIECE_POSITION_RECORD_BITS = PIECE_POSITION_RECORD.size * 8
+# The BITFIELD type and bit offset within the record for each field
+PIECE_POSITION_OFFSETS = {
+    "x": ("i32", 0),
+    "y": ("i32", 32),
+    "g": ("u32", 64),
+    "r": ("u16", 96),
+    "w": ("u16", 112),
+    "h": ("u16", 128),
+    "b": ("u8", 144),
+}
+PIECE_POSITION_FIELDS = tuple(PIECE_POSITION_OFFSETS.keys())
+
+
+def get_piece_positions_key(puzzle):
+    return get_puzzle_key("pcpos", puzzle)
+
+
+def _pack_value(field, value):
+    if field == "g":
+        return 0 if value is None or value == "" else int(value) + 1
+    return int(value or 0)
+
+
+def pack_piece_positions(pieces):
+    "Pack the list of piece properties (with id) to the bytes for pcpos:{puzzle}."
+    if not pieces:
+        return b""
+    data = bytearray(
+        PIECE_POSITION_RECORD.size * (max(int(piece["id"]) for piece in pieces) + 1)
+    )
+    for piece in pieces:
+        PIECE_POSITION_RECORD.pack_into(
+            data,
+            int(piece["id"]) * PIECE_POSITION_RECORD.size,
+            *[_pack_value(field, piece.get(field)) for field in PIECE_POSITION_FIELDS],
+        )
+    return bytes(data)
+
+
+def unpack_piece_positions(data, pieces):
+    """
+    Unpack the piece properties for the list of piece ids from the bytes of
+    pcpos:{puzzle}.  The values are strings like the ones from the pc hash and
+    None when the piece has no record.
+    """
+    piece_positions = []
+    for piece in pieces:
+        offset = int(piece) * PIECE_POSITION_RECORD.size
+        if offset + PIECE_POSITION_RECORD.size > len(data):
+            piece_positions.append(dict.fromkeys(PIECE_POSITION_FIELDS))
+            continue
+        values = dict(
+            zip(
+                PIECE_POSITION_FIELDS,
+                map(str, PIECE_POSITION_RECORD.unpack_from(data, offset)),
+            )
+        )
+        values["g"] = None if values["g"] == "0" else str(int(values["g"]) - 1)
+        piece_positions.append(values)
+    return piece_positions
+
+
+def set_piece_positions(pipe, puzzle, piece, properties):
+    "Update the packed fields of the piece that are in the properties."
+    args = []
+    for (field, value) in properties.items():
+        if field not in PIECE_POSITION_OFFSETS:
+            continue
+        (_type, offset) = PIECE_POSITION_OFFSETS[field]
+        args.extend(
+            [
+                "SET",
+                _type,
+                int(piece) * PIECE_POSITION_RECORD_BITS + offset,
+                _pack_value(field, value),
+            ]
+        )
+    if args:
+        pipe.execute_command("BITFIELD", get_piece_positions_key(puzzle), *args)
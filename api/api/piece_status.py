@@ -0,0 +1,28 @@
+"""
+Piece status bitmaps
+
+The immovable (pcfixed:{puzzle}) and stacked (pcstacked:{puzzle}) pieces of a
+puzzle are stored as bitmaps with a bit for each piece id.  Checking a piece is
+done with GETBIT and the count of immovable pieces is from BITCOUNT.
+"""
+from api.redis_scripts import run_script
+from api.puzzle_keys import get_puzzle_key
+
+
+def get_pcfixed_key(puzzle):
+    return get_puzzle_key("pcfixed", puzzle)
+
+
+def get_pcstacked_key(puzzle):
+    return get_puzzle_key("pcstacked", puzzle)
+
+
+def get_status_pieces(redis_connection, key):
+    "Get the set of pieces that have the bit set in the piece status bitmap."
+    return set(run_script(redis_connection, "bitmap_positions", keys=[key]))
+
+
+def set_status_pieces(pipe, key, pieces, value=1):
+    "Set (or clear if value is 0) the bit for each piece in the piece status bitmap."
+    for piece in pieces:
+        pipe.setbit(key, int(piece), value)
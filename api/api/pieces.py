@@ -7,9 +7,18 @@ from flask import current_app, make_response, request, abort, json
 from flask.views import MethodView
 from flask_sse import sse
 
-from .app import db, redis_connection
+from .app import db, redis_connection, binary_redis_connection
 from .database import fetch_query_string, rowify
 from .jobs.convertPiecesToRedis import convert
+from .piece_mutate import resolve_piece_group_positions
+from .piece_geometry import (
+    delete_piece_geometry,
+    load_piece_geometry,
+    write_piece_geometry,
+)
+from .piece_positions import get_piece_positions_key, unpack_piece_positions
+from .piece_status import get_status_pieces
+from .puzzle_keys import get_puzzle_key, get_pcupdates_key
 
 from .constants import COMPLETED
 
@@ -37,7 +46,7 @@ class PuzzlePiecesView(MethodView):
         status = result[0].get("status")
 
         # Load the piece data from sqlite on demand
-        if not redis_connection.zscore("pcupdates", puzzle):
+        if not redis_connection.zscore(get_pcupdates_key(puzzle), puzzle):
             # Check redis memory usage and create cleanup job if it's past a threshold
             memory = redis_connection.info(section="memory")
             current_app.logger.info("used_memory: {used_memory_human}".format(**memory))
@@ -68,16 +77,30 @@ class PuzzlePiecesView(MethodView):
         publicPieceProperties = ("x", "y", "r", "g", "w", "h", "b")
 
         # start = time.perf_counter()
-        with redis_connection.pipeline(transaction=True) as pipe:
-            for item in all_pieces:
-                piece = item.get("id")
-                pipe.hmget(
-                    "pc:{puzzle}:{piece}".format(puzzle=puzzle, piece=piece),
-                    *publicPieceProperties,
+        # The packed piece positions are binary so can't be decoded.
+        packed_piece_positions = binary_redis_connection.get(
+            get_piece_positions_key(puzzle)
+        )
+        if packed_piece_positions is not None:
+            allPublicPieceProperties = [
+                [properties[x] for x in publicPieceProperties]
+                for properties in unpack_piece_positions(
+                    packed_piece_positions, [item.get("id") for item in all_pieces]
                 )
-            allPublicPieceProperties = pipe.execute()
-        pcfixed = set(redis_connection.smembers(f"pcfixed:{puzzle}"))
-        pcstacked = set(redis_connection.smembers(f"pcstacked:{puzzle}"))
+            ]
+        else:
+            with redis_connection.pipeline(transaction=True) as pipe:
+                for item in all_pieces:
+                    piece = item.get("id")
+                    pipe.hmget(
+                        get_puzzle_key("pc", puzzle, piece),
+                        *publicPieceProperties,
+                    )
+                allPublicPieceProperties = pipe.execute()
+        pcfixed = get_status_pieces(redis_connection, get_puzzle_key("pcfixed", puzzle))
+        pcstacked = get_status_pieces(
+            redis_connection, get_puzzle_key("pcstacked", puzzle)
+        )
         # end = time.perf_counter()
         # current_app.logger.debug("PuzzlePiecesView {}".format(end - start))
 
@@ -86,18 +109,19 @@ class PuzzlePiecesView(MethodView):
             dict(list(zip(publicPieceProperties, properties)))
             for properties in allPublicPieceProperties
         ]
+        resolve_piece_group_positions(redis_connection, puzzle, pieces)
         # TODO: Change piece properties to int type instead of string
         for item in all_pieces:
             piece = item.get("id")
             pieces[piece]["id"] = piece
-            if str(piece) in pcfixed:
+            if piece in pcfixed:
                 pieces[piece]["s"] = "1"
-            elif str(piece) in pcstacked:
+            elif piece in pcstacked:
                 pieces[piece]["s"] = "2"
             else:
                 pieces[piece]["s"] = ""
 
-        stamp = redis_connection.get(f"pzstamp:{puzzle}")
+        stamp = redis_connection.get(get_puzzle_key("pzstamp", puzzle))
         if not stamp:
             stamp = uuid.uuid4().hex[:8]
         pieceData = {
@@ -125,7 +149,9 @@ class PuzzlePiecesView(MethodView):
                 pcu_key = f"pcu:{stamp}"
                 redis_connection.rpush(pcu_key, "")
                 redis_connection.expire(pcu_key, piece_cache_ttl + 10)
-                redis_connection.set(f"pzstamp:{puzzle}", stamp, ex=piece_cache_ttl)
+                redis_connection.set(
+                    get_puzzle_key("pzstamp", puzzle), stamp, ex=piece_cache_ttl
+                )
 
         return make_response(json.jsonify(pieceData), 200)
 
@@ -169,6 +195,20 @@ mutable_attrs = {
 }
 # piece_attrs should match queries/select_all_piece_props_for_puzzle.sql
 piece_attrs = immutable_attrs.union(mutable_attrs)
+# Piece properties that are also in the piece geometry file
+piece_geometry_attrs = {"adjacent", "b", "h", "rotate", "w"}
+
+
+def update_piece_geometry(cur, puzzle):
+    "Write the piece geometry file from the pieces in the database."
+    (result, col_names) = rowify(
+        cur.execute(
+            fetch_query_string("select_immutable_piece_props_for_puzzle.sql"),
+            {"puzzle": puzzle},
+        ).fetchall(),
+        cur.description,
+    )
+    write_piece_geometry(current_app.config, puzzle, result)
 
 
 def update_puzzle_pieces(puzzle_id, piece_properties):
@@ -216,6 +256,13 @@ def update_puzzle_pieces(puzzle_id, piece_properties):
     def is_different(piece):
         return piece != current_piece_properties[piece["id"]]
 
+    # Only need to write the piece geometry file if it would be different
+    has_piece_geometry_changes = any(
+        piece[k] != current_piece_properties[piece["id"]][k]
+        for piece in piece_properties
+        for k in piece_geometry_attrs.intersection(piece.keys())
+    )
+
     # filter out any pieces that are same as current
     # update current piece props
     _piece_properties = list(map(set_attrs, filter(is_different, piece_properties)))
@@ -225,6 +272,8 @@ def update_puzzle_pieces(puzzle_id, piece_properties):
         _piece_properties,
     )
     db.commit()
+    if has_piece_geometry_changes:
+        update_piece_geometry(cur, puzzle)
     cur.close()
 
     msg = {
@@ -258,6 +307,17 @@ def get_immutable_piece_props(puzzle_id):
     puzzle_data = result[0]
     puzzle = puzzle_data["id"]
 
+    piece_geometry = load_piece_geometry(current_app.config, puzzle)
+    if piece_geometry is not None:
+        cur.close()
+        immutable_piece_properties = dict(piece_geometry.items())
+        return {
+            "rowcount": len(immutable_piece_properties),
+            "immutable_piece_properties": immutable_piece_properties,
+            "msg": "Success",
+            "status_code": 200,
+        }
+
     result = cur.execute(
         fetch_query_string("select_immutable_piece_props_for_puzzle.sql"),
         {"puzzle": puzzle},
@@ -323,6 +383,7 @@ def add_puzzle_pieces(puzzle_id, piece_properties):
         piece_properties,
     )
     db.commit()
+    update_piece_geometry(cur, puzzle)
 
     cur.close()
 
@@ -350,6 +411,7 @@ def delete_puzzle_pieces(puzzle_id):
     result = cur.execute("delete from Piece where puzzle = :puzzle", {"puzzle": puzzle})
     db.commit()
     cur.close()
+    delete_piece_geometry(current_app.config, puzzle)
 
     msg = {"rowcount": result.rowcount, "msg": "Deleted", "status_code": 200}
     return msg
@@ -0,0 +1,53 @@
+"""
+Player session on a puzzle
+
+The short lived state of a player on a puzzle is kept in a single hash
+(session:{puzzle}:{ip}) instead of a key for each with its own expire.  The
+session is for the ip of the player like the karma has always been so players
+that share an ip also share the karma.  These are the fields:
+
+    karma                   karma of the player on the puzzle
+    pzrate:{user}           set when the player starts moving pieces on the puzzle
+    pcrate:{user}           count of the recent piece moves by the player
+    hotpc:{user}:{piece}    count of the recent moves of the same piece
+
+Each field has the time it expires in the "{field}:e" field.  An expired field
+is treated as not set and is removed the next time the piece_move_rules.lua
+script reads the session.  The session hash expires after the longest timeout
+of the fields so nothing is left behind when the player leaves.
+"""
+import time
+
+from api.puzzle_keys import get_puzzle_key
+
+SESSION_EXPIRES_SUFFIX = ":e"
+
+
+def get_player_session_key(puzzle, ip):
+    return get_puzzle_key("session", puzzle, ip)
+
+
+def get_expires_field(field):
+    return field + SESSION_EXPIRES_SUFFIX
+
+
+def init_player_session(redis_connection, puzzle, ip, app_config):
+    """
+    Initialize the karma value and expiration in the player session if not set
+    or expired.  Returns the player session key.
+    """
+    now = int(time.time())
+    session_key = get_player_session_key(puzzle, ip)
+    expires = redis_connection.hget(session_key, get_expires_field("karma"))
+    if expires is None or int(expires) <= now:
+        with redis_connection.pipeline(transaction=False) as pipe:
+            pipe.hmset(
+                session_key,
+                {
+                    "karma": app_config["INITIAL_KARMA"],
+                    get_expires_field("karma"): now + app_config["KARMA_POINTS_EXPIRE"],
+                },
+            )
+            pipe.expire(session_key, app_config["KARMA_POINTS_EXPIRE"])
+            pipe.execute()
+    return session_key
@@ -0,0 +1,109 @@
+"""
+Player presence
+
+Approximate counts of the players that have recently moved pieces on a puzzle
+and on the whole site.  A player that moves a piece is added to the
+HyperLogLog for the current window of PRESENCE_WINDOW seconds
+(presence:{puzzle}:{window} and presence:{site}:{window}).  The count of the
+active players is the PFCOUNT of all the windows in the range which counts
+each player once.  A HyperLogLog is at most 12k bytes no matter how many
+players are added and it expires after the longest range that is counted.
+
+The sorted sets that have a timestamp for the score of each member would grow
+without bound.  The scheduler runs sweep_expired_members to remove the members
+that are too old to be used.  The sorted sets for a puzzle are only changed
+while the puzzle has pieces in redis so the puzzles in the pcupdates shards
+are the ones that are swept.  The keys are known instead of found with SCAN
+which would only see the keys on one node of a Redis Cluster.  The pcupdates
+sorted sets are not swept since being in them is how the puzzles with pieces
+in redis are found.  They are removed from it when the pieces are converted
+back to the database.
+"""
+from api.puzzle_keys import (
+    get_puzzle_key,
+    get_puzzle_keys_registry_key,
+    get_pcupdates,
+)
+
+MINUTE = 60
+DAY = 24 * 60 * 60
+
+PRESENCE_WINDOW = MINUTE
+# Players are active if they moved a piece within this many seconds.
+ACTIVE_PLAYER_RANGE = 5 * MINUTE
+# Players in the timeline sorted sets are kept for this many seconds.
+TIMELINE_RANGE = 14 * DAY
+
+
+def get_presence_key(window, puzzle=None):
+    "The presence key for the window on the puzzle or the whole site if no puzzle."
+    if puzzle is None:
+        return "presence:{site}:" + str(window)
+    return get_puzzle_key("presence", puzzle, window)
+
+
+def record_presence(score_ledger, user, now, puzzle):
+    "Add the player to the presence for the puzzle and the whole site."
+    window = int(now) // PRESENCE_WINDOW
+    expire = ACTIVE_PLAYER_RANGE + PRESENCE_WINDOW
+    score_ledger.pfadd(get_presence_key(window, puzzle), user, expire=expire)
+    score_ledger.pfadd(get_presence_key(window), user, expire=expire)
+
+
+def count_active_players(
+    redis_connection, now, puzzle=None, seconds=ACTIVE_PLAYER_RANGE
+):
+    """
+    Approximate count of the players that moved a piece within the seconds on
+    the puzzle or the whole site if no puzzle.
+    """
+    last_window = int(now) // PRESENCE_WINDOW
+    first_window = (int(now) - seconds) // PRESENCE_WINDOW
+    return redis_connection.pfcount(
+        *[
+            get_presence_key(window, puzzle)
+            for window in range(first_window, last_window + 1)
+        ]
+    )
+
+
+def _remove_members_for_keys(redis_connection, keys, max_score):
+    with redis_connection.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.zremrangebyscore(key, "-inf", max_score)
+        return sum(pipe.execute())
+
+
+def sweep_expired_members(redis_connection, now, token_expire_timeout):
+    """
+    Remove the members from the sorted sets with timestamp scores that are no
+    longer used.  Returns the count of the removed members.
+
+    timeline and timeline:{puzzle}  last piece move older than TIMELINE_RANGE
+    blockedplayers:{puzzle}         blocked until a time that has passed
+    bannedusers                     banned until a time that has passed
+    pqtoken:{puzzle}:{piece}        waiting on the piece longer than a token lasts
+
+    The pqtoken keys are found in the pzkeys:{puzzle} registry.
+    """
+    puzzles = get_pcupdates(redis_connection)
+    removed = _remove_members_for_keys(
+        redis_connection,
+        ["timeline"] + [get_puzzle_key("timeline", puzzle) for puzzle in puzzles],
+        now - TIMELINE_RANGE,
+    )
+    removed += _remove_members_for_keys(
+        redis_connection,
+        ["bannedusers"]
+        + [get_puzzle_key("blockedplayers", puzzle) for puzzle in puzzles],
+        now,
+    )
+    for puzzle in puzzles:
+        removed += _remove_members_for_keys(
+            redis_connection,
+            redis_connection.sscan_iter(
+                get_puzzle_keys_registry_key(puzzle), match="pqtoken:*", count=1000
+            ),
+            now - token_expire_timeout,
+        )
+    return removed
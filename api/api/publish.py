@@ -21,16 +21,24 @@ from gevent import monkey
 monkey.patch_all()
 
 import datetime
-import sys
 import time
 import nanoid
 import base64
+import hashlib
+import hmac
 import multiprocessing
 from docopt import docopt
 import os
 
 import gunicorn.app.base
-from flask import current_app, make_response, request, json, Flask
+from flask import (
+    current_app,
+    make_response,
+    request,
+    json,
+    Flask,
+    after_this_request,
+)
 from flask.views import MethodView
 from flask_sse import sse
 from rq import Queue
@@ -39,10 +47,30 @@ import requests
 from api.flask_secure_cookie import SecureCookie
 from api.app import redis_connection
 from api.jobs.pieceTranslate import attempt_piece_movement
+from api.piece_mutate import (
+    CONCURRENCY_PUZZLE,
+    CONCURRENCY_PIECE,
+    resolve_piece_group_positions,
+)
+from api.redis_scripts import run_script
+from api.puzzle_keys import get_puzzle_key, get_puzzle_data_key
+from api.player_session import get_player_session_key
+from api.puzzle_rules import (
+    evaluate_piece_move_rules,
+    evaluate_piece_move_rules_batch,
+    add_blocked_player,
+    PuzzlePolicyEngine,
+    PIECE_TRANSLATE_BAN_TIME_INCR,
+)
+from api.sequencer import (
+    PuzzleMoveSequencer,
+    PuzzleMoveSequencerError,
+    PuzzleMoveSequencerTimeout,
+    MOVE_KIND,
+)
 from api.tools import (
     loadConfig,
     formatBitMovementString,
-    init_karma_key,
     files_loader,
 )
 
@@ -62,25 +90,23 @@ from api.user import (
 HOUR = 3600  # hour in seconds
 MINUTE = 60  # minute in seconds
 
-MOVES_BEFORE_PENALTY = 12
 STACK_PENALTY = 1
-HOTSPOT_LIMIT = 10
-HOT_PIECE_MOVEMENT_RATE_TIMEOUT = 10
-PIECE_MOVEMENT_RATE_TIMEOUT = 100
-PIECE_MOVEMENT_RATE_LIMIT = 100
-
-# How many pieces a user can move within this many seconds before being banned.
-# Allow 30 pieces to be moved within 13 seconds. Exceeding that rate would
-# probably imply that it is being scripted.
-PIECE_TRANSLATE_RATE_TIMEOUT = 13
-PIECE_TRANSLATE_MAX_COUNT = 30
-PIECE_TRANSLATE_BAN_TIME_INCR = 60 * 5
-PIECE_TRANSLATE_EXCEEDED_REASON = "Piece moves exceeded {PIECE_TRANSLATE_MAX_COUNT} in {PIECE_TRANSLATE_RATE_TIMEOUT} seconds".format(
-    **locals()
-)
 
 TOKEN_INVALID_BAN_TIME_INCR = 15
 
+# Maximum number of piece moves that can be in a batch.
+MAX_BATCH_PIECE_MOVES = 50
+
+# How many times a piece move that conflicts with other piece moves is retried
+# before it is applied with the other piece moves in order.
+PIECE_MUTATE_CONFLICT_RETRIES = 3
+
+# Seconds to keep the response of a piece move so a retry of the same move
+# gets it instead of moving the piece again.
+PIECE_MOVE_RESPONSE_EXPIRE = 60
+# Seconds between checks for the response of a piece move that is in progress.
+PIECE_MOVE_RESPONSE_POLL = 0.1
+
 
 class PublishApp(Flask):
     "Publish App"
@@ -108,6 +134,8 @@ def make_app(config=None, database_writable=False, **kw):
 
     app.queries = files_loader("queries")
 
+    app.puzzle_policies = PuzzlePolicyEngine(app.config)
+
     # register the views
 
     app.add_url_rule(
@@ -120,6 +148,16 @@ def make_app(config=None, database_writable=False, **kw):
             "internal-puzzle-pieces-move"
         ),
     )
+    app.add_url_rule(
+        "/puzzle/<puzzle_id>/pieces/move/",
+        view_func=PuzzlePiecesBatchMovePublishView.as_view("puzzle-pieces-batch-move"),
+    )
+    app.add_url_rule(
+        "/internal/puzzle/<puzzle_id>/pieces/move/",
+        view_func=InternalPuzzlePiecesBatchMovePublishView.as_view(
+            "internal-puzzle-pieces-batch-move"
+        ),
+    )
     app.add_url_rule(
         "/puzzle/<puzzle_id>/piece/<int:piece>/token/",
         view_func=PuzzlePieceTokenView.as_view("puzzle-piece-token"),
@@ -128,31 +166,6 @@ def make_app(config=None, database_writable=False, **kw):
     return app
 
 
-def bump_count(user):
-    """
-    Bump the count for pieces moved for the user.
-    The nginx conf may also have rate limits on this route. The goal here
-    is to ban user if the piece movement rate continues to max out at this rate.
-    """
-    timestamp_now = int(time.time())
-    rounded_timestamp = timestamp_now - (timestamp_now % PIECE_TRANSLATE_RATE_TIMEOUT)
-    err_msg = {}
-
-    # TODO: optimize the timestamp used here by truncating to last digits based
-    # on the expiration of the key.
-    piece_translate_rate_key = "ptrate:{user}:{timestamp}".format(
-        user=user, timestamp=rounded_timestamp
-    )
-    if redis_connection.setnx(piece_translate_rate_key, 1):
-        redis_connection.expire(piece_translate_rate_key, PIECE_TRANSLATE_RATE_TIMEOUT)
-    count = redis_connection.incr(piece_translate_rate_key)
-    if count > PIECE_TRANSLATE_MAX_COUNT:
-        err_msg = increase_ban_time(user, PIECE_TRANSLATE_BAN_TIME_INCR)
-        err_msg["reason"] = PIECE_TRANSLATE_EXCEEDED_REASON
-
-    return err_msg
-
-
 def get_blockedplayers_err_msg(expires, timeout):
     err_msg = {
         "msg": "Please wait.",
@@ -164,6 +177,37 @@ def get_blockedplayers_err_msg(expires, timeout):
     return err_msg
 
 
+def block_player(config, puzzle, user, ip, now):
+    "Block the player on the puzzle and return the error message."
+    expires = add_blocked_player(
+        redis_connection,
+        config["BLOCKEDPLAYER_EXPIRE_TIMEOUTS"],
+        puzzle,
+        user,
+        ip,
+        now,
+    )
+    return get_blockedplayers_err_msg(expires, expires - now)
+
+
+def get_queue_wait_budget(config):
+    "Seconds a piece move can be expected to wait in the puzzle queue."
+    return config.get("PIECE_MOVE_QUEUE_WAIT_BUDGET", config["PIECE_MOVE_TIMEOUT"])
+
+
+def get_puzzle_busy_response(retry_after, now):
+    err_msg = {
+        "msg": "Puzzle is too active. Please wait.",
+        "type": "puzzlebusy",
+        "reason": "Too many piece moves are waiting on this puzzle.",
+        "expires": now + retry_after,
+        "timeout": retry_after,
+    }
+    response = make_response(json.jsonify(err_msg), 503)
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
 def get_too_many_pieces_in_proximity_err_msg(piece, piecesInProximity):
     err_msg = {
         "msg": "Piece move denied.",
@@ -176,11 +220,98 @@ def get_too_many_pieces_in_proximity_err_msg(piece, piecesInProximity):
 
 
 def get_puzzle_piece_token_key(puzzle, piece):
-    return "pctoken:{puzzle}:{piece}".format(puzzle=puzzle, piece=piece)
+    return get_puzzle_key("pctoken", puzzle, piece)
 
 
 def get_puzzle_piece_token_queue_key(puzzle, piece):
-    return "pqtoken:{puzzle}:{piece}".format(puzzle=puzzle, piece=piece)
+    return get_puzzle_key("pqtoken", puzzle, piece)
+
+
+def get_piece_move_response_key(puzzle_id, mark, idempotency_key):
+    return "pcmove:{puzzle_id}:{mark}:{key}".format(
+        puzzle_id=puzzle_id,
+        mark=mark,
+        key=hashlib.sha1(idempotency_key.encode()).hexdigest(),
+    )
+
+
+def get_stored_piece_move_response(response_key):
+    """
+    Get the response that was stored for a piece move.  Returns None if there
+    is no response or False if the piece move is still in progress.
+    """
+    stored = redis_connection.get(response_key)
+    if stored is None:
+        return None
+    stored = json.loads(stored)
+    if "pending" in stored:
+        return False
+    return make_response(
+        stored["body"], stored["status"], {"Content-Type": stored["content_type"]}
+    )
+
+
+def reserve_piece_move_response(response_key, timeout):
+    """
+    Reserve the response key before the piece is moved so a retry of the same
+    piece move that is sent at the same time doesn't also move it.  Returns
+    None if it was reserved.  Otherwise returns the response of the piece move
+    that reserved it after waiting up to the timeout for it.  The reservation
+    is removed after the request if the response was not stored.
+    """
+    reservation = json.dumps({"pending": nanoid.generate(size=12)})
+    deadline = time.time() + timeout
+    while True:
+        if redis_connection.set(
+            response_key, reservation, nx=True, px=int(timeout * 1000)
+        ):
+
+            @after_this_request
+            def release_reservation(response):
+                with redis_connection.pipeline(transaction=True) as pipe:
+                    pipe.watch(response_key)
+                    if pipe.get(response_key) == reservation:
+                        pipe.multi()
+                        pipe.delete(response_key)
+                        pipe.execute()
+                    else:
+                        pipe.unwatch()
+                return response
+
+            return None
+
+        stored_response = get_stored_piece_move_response(response_key)
+        if stored_response is None:
+            # The piece move that reserved it did not store a response.
+            continue
+        if stored_response is not False:
+            return stored_response
+        if time.time() >= deadline:
+            err_msg = {
+                "msg": "Piece move is in progress",
+                "type": "error",
+                "reason": "The same piece move is already being done.",
+                "timeout": 3,
+            }
+            return make_response(json.jsonify(err_msg), 409)
+        time.sleep(PIECE_MOVE_RESPONSE_POLL)
+
+
+def store_piece_move_response(response_key, response):
+    "Store the response of a piece move so it can be returned for a retry."
+    if response_key is not None:
+        redis_connection.set(
+            response_key,
+            json.dumps(
+                {
+                    "status": response.status_code,
+                    "body": response.get_data(as_text=True),
+                    "content_type": response.content_type,
+                }
+            ),
+            ex=PIECE_MOVE_RESPONSE_EXPIRE,
+        )
+    return response
 
 
 def _int_piece_properties(piece_properties):
@@ -208,17 +339,122 @@ def _get_adjacent_pieces_list(piece_properties):
     )
 
 
-def pack_token(token, puzzle, user, piece, piece_properties):
+def _token_signature(secret, payload):
+    return base64.urlsafe_b64encode(
+        hmac.new(
+            bytes(secret, encoding="utf8"), payload, digestmod=hashlib.sha256
+        ).digest()
+    )
+
+
+def pack_token(
+    secret, token, puzzle, user, piece, piece_properties, mark, expires, snapshot
+):
+    """
+    Sign the token with the secret so it can be validated when the piece is
+    moved without needing to read anything from redis.  The snapshot of the
+    adjacent pieces is included in the token.
+    """
     x = piece_properties["x"]
     y = piece_properties["y"]
-    p_token = bytes(f"{puzzle}:{user}:{piece}:{x}:{y}:{token}", encoding="utf8")
-    b64_token = base64.b64encode(p_token).decode(encoding="utf8")
+    payload = bytes(
+        f"{puzzle}:{user}:{piece}:{x}:{y}:{token}:{mark}:{expires}:{snapshot}",
+        encoding="utf8",
+    )
+    b64_token = b".".join(
+        [base64.urlsafe_b64encode(payload), _token_signature(secret, payload)]
+    ).decode(encoding="utf8")
     return b64_token
 
 
-def unpack_token(token):
-    "(puzzle, user, piece, x, y, token)"
-    return base64.b64decode(token).decode(encoding="utf8").split(":")
+def unpack_token(secret, token):
+    """
+    Returns a dict of puzzle, user, piece, x, y, token, mark, expires, snapshot
+    or None if the token is not valid.
+    """
+    try:
+        (b64_payload, signature) = bytes(token, encoding="utf8").split(b".")
+        payload = base64.urlsafe_b64decode(b64_payload)
+    except (ValueError, TypeError):
+        return None
+    if not hmac.compare_digest(signature, _token_signature(secret, payload)):
+        return None
+    (puzzle, user, piece, x, y, token_id, mark, expires, snapshot) = (
+        payload.decode(encoding="utf8").split(":", 8)
+    )
+    return {
+        "puzzle": int(puzzle),
+        "user": int(user),
+        "piece": int(piece),
+        "x": int(x),
+        "y": int(y),
+        "token": token_id,
+        "mark": mark,
+        "expires": int(expires),
+        "snapshot": snapshot,
+    }
+
+
+def get_puzzle_data(puzzle_id):
+    """
+    Get the puzzle data from the pzq hash or from the API if it is not set.
+    Returns the puzzle data and None or None and an error response.
+    """
+    pzq_key = get_puzzle_data_key(puzzle_id)
+    pzq_fields = [
+        "puzzle",
+        "table_width",
+        "table_height",
+        "permission",
+        "pieces",
+        "status",
+    ]
+    puzzle_data = dict(zip(pzq_fields, redis_connection.hmget(pzq_key, pzq_fields)))
+    puzzle = puzzle_data.get("puzzle")
+    if puzzle is None:
+        req = requests.get(
+            "http://{HOSTAPI}:{PORTAPI}/internal/puzzle/{puzzle_id}/details/".format(
+                HOSTAPI=current_app.config["HOSTAPI"],
+                PORTAPI=current_app.config["PORTAPI"],
+                puzzle_id=puzzle_id,
+            ),
+        )
+        if req.status_code >= 400:
+            err_msg = {"msg": "puzzle not available", "type": "missing"}
+            return (None, make_response(json.jsonify(err_msg), req.status_code))
+        try:
+            result = req.json()
+        except ValueError as err:
+            err_msg = {"msg": "puzzle not available", "type": "missing"}
+            return (None, make_response(json.jsonify(err_msg), 500))
+        if result.get("status") not in (ACTIVE, BUGGY_UNLISTED):
+            err_msg = {"msg": "puzzle not available", "type": "missing"}
+            return (None, make_response(json.jsonify(err_msg), 404))
+        puzzle_data = result
+        puzzle_data["puzzle"] = result["id"]
+
+        redis_connection.hmset(
+            pzq_key,
+            {
+                "puzzle": puzzle_data["puzzle"],
+                "table_width": puzzle_data["table_width"],
+                "table_height": puzzle_data["table_height"],
+                "permission": puzzle_data["permission"],
+                "pieces": puzzle_data["pieces"],
+                "status": puzzle_data["status"],
+            },
+        )
+        redis_connection.expire(pzq_key, 300)
+    else:
+        puzzle_data["puzzle"] = int(puzzle_data["puzzle"])
+        puzzle_data["table_width"] = int(puzzle_data["table_width"])
+        puzzle_data["table_height"] = int(puzzle_data["table_height"])
+        puzzle_data["permission"] = int(puzzle_data["permission"])
+        puzzle_data["pieces"] = int(puzzle_data["pieces"])
+        if puzzle_data["status"] is not None:
+            puzzle_data["status"] = int(puzzle_data["status"])
+    puzzle_data["puzzle_id"] = puzzle_id
+    return (puzzle_data, None)
 
 
 class PuzzlePieceTokenView(MethodView):
@@ -248,7 +484,7 @@ class PuzzlePieceTokenView(MethodView):
 
         user = int(user)
         mark = request.args.get("mark")
-        if not isinstance(mark, str) or len(mark) != 10:
+        if not isinstance(mark, str) or len(mark) != 10 or ":" in mark:
             return make_response(
                 json.jsonify(
                     {
@@ -260,10 +496,37 @@ class PuzzlePieceTokenView(MethodView):
             )
         now = int(time.time())
 
+        validate_token = current_app.puzzle_policies.default.is_enabled("valid_token")
+        TOKEN_LOCK_TIMEOUT = current_app.config["TOKEN_LOCK_TIMEOUT"]
+        TOKEN_EXPIRE_TIMEOUT = current_app.config["TOKEN_EXPIRE_TIMEOUT"]
+        token_id = nanoid.generate(size=8)
+        pzq_key = get_puzzle_data_key(puzzle_id)
+
+        def request_token(puzzle):
+            "Run the piece_token script which does all the checks and sets the token in one request."
+            return run_script(
+                redis_connection,
+                "piece_token",
+                keys=[get_puzzle_key("pc", puzzle, piece)],
+                args=[
+                    puzzle,
+                    piece,
+                    user,
+                    mark,
+                    now,
+                    token_id,
+                    1 if validate_token else 0,
+                    TOKEN_LOCK_TIMEOUT,
+                    TOKEN_EXPIRE_TIMEOUT,
+                    get_queue_wait_budget(current_app.config),
+                ],
+            )
+
         # start = time.perf_counter()
-        pzq_key = "pzq:{puzzle_id}".format(puzzle_id=puzzle_id)
+        # The pzq hash is not in the same hash slot as the keys for the puzzle
+        # so the puzzle is looked up before running the piece_token script.
         puzzle = redis_connection.hget(pzq_key, "puzzle")
-        if not puzzle:
+        if puzzle is None:
             current_app.logger.debug("no puzzle; fetch puzzle")
             r = requests.get(
                 "http://{HOSTAPI}:{PORTAPI}/internal/puzzle/{puzzle_id}/details/".format(
@@ -280,29 +543,24 @@ class PuzzlePieceTokenView(MethodView):
                 }
                 return make_response(json.jsonify(err_msg), r.status_code)
             try:
-                result = r.json()
+                puzzle_details = r.json()
             except ValueError as err:
                 err_msg = {
                     "msg": "puzzle is not ready at this time. Please reload the page.",
                     "type": "puzzleimmutable",
                 }
                 return make_response(json.jsonify(err_msg), 500)
-            if result.get("status") not in (ACTIVE, BUGGY_UNLISTED):
+            if puzzle_details.get("status") not in (ACTIVE, BUGGY_UNLISTED):
                 err_msg = {
                     "msg": "puzzle is not ready at this time. Please reload the page.",
                     "type": "puzzleimmutable",
                 }
                 return make_response(json.jsonify(err_msg), 400)
-            puzzle = result["id"]
-
-        puzzle = int(puzzle)
-        pc_puzzle_piece_key = "pc:{puzzle}:{piece}".format(puzzle=puzzle, piece=piece)
-        piece_properties = _int_piece_properties(
-            redis_connection.hgetall(pc_puzzle_piece_key)
-        )
-        pcfixed = set(redis_connection.smembers(f"pcfixed:{puzzle}"))
+            puzzle = int(puzzle_details["id"])
+        result = request_token(puzzle)
+        status = result[0]
 
-        if piece_properties.get("y") is None:
+        if status == "puzzleimmutable":
             # 400 if puzzle does not exist or piece is not found
             # Only puzzles in ACTIVE state can be mutated
             err_msg = {
@@ -311,8 +569,7 @@ class PuzzlePieceTokenView(MethodView):
             }
             return make_response(json.jsonify(err_msg), 400)
 
-        if piece in pcfixed:
-            # immovable
+        if status == "immovable":
             err_msg = {
                 "msg": "piece can't be moved",
                 "type": "immovable",
@@ -321,120 +578,18 @@ class PuzzlePieceTokenView(MethodView):
             }
             return make_response(json.jsonify(err_msg), 400)
 
-        # TODO: remove old entries in blockedplayers:{puzzle}
-        blockedplayers_for_puzzle_key = "blockedplayers:{puzzle}".format(puzzle=puzzle)
-        blockedplayers_expires = redis_connection.zscore(
-            blockedplayers_for_puzzle_key, user
-        )
-        if blockedplayers_expires and blockedplayers_expires > now:
+        if status == "blockedplayer":
+            blockedplayers_expires = float(result[1])
             err_msg = get_blockedplayers_err_msg(
                 blockedplayers_expires, blockedplayers_expires - now
             )
             return make_response(json.jsonify(err_msg), 429)
 
-        token = pack_token(
-            nanoid.generate(size=8), puzzle, user, piece, piece_properties
-        )
-        redis_connection.publish(
-            f"enforcer_token_request:{puzzle}",
-            token,
-        )
-
-        def move_bit_icon_to_piece(x, y):
-            # Claim the piece by showing the bit icon next to it.
-            msg = formatBitMovementString(user, x, y)
-            sse.publish(
-                msg,
-                type="move",
-                channel="puzzle:{puzzle_id}".format(puzzle_id=puzzle_id),
-            )
-
-        # Snapshot of adjacent pieces at time of token request
-        snapshot_id = None
-        adjacent_pieces_list = _get_adjacent_pieces_list(piece_properties)
-        adjacent_property_list = ["x", "y", "r", "g", str(piece)]
-        pzq_current_key = "pzq_current:{puzzle}".format(puzzle=puzzle)
-        results = []
-        with redis_connection.pipeline(transaction=False) as pipe:
-            for adjacent_piece in adjacent_pieces_list:
-                pc_puzzle_adjacent_piece_key = "pc:{puzzle}:{adjacent_piece}".format(
-                    puzzle=puzzle, adjacent_piece=adjacent_piece
-                )
-                pipe.hmget(pc_puzzle_adjacent_piece_key, adjacent_property_list)
-            pipe.get(pzq_current_key)
-            results = pipe.execute()
-        pzq_current = "0"
-        if not isinstance(results[-1], list):
-            pzq_current = results.pop() or pzq_current
-        adjacent_properties = dict(
-            zip(
-                adjacent_pieces_list,
-                map(lambda x: dict(zip(adjacent_property_list, x)), results),
-            )
-        )
-        snapshot = []
-        for a_piece, a_props in adjacent_properties.items():
-            # skip any that are immovable
-            if a_piece in pcfixed:
-                continue
-            # skip any that are in the same group
-            if a_props.get("g") is not None and a_props.get(
-                "g"
-            ) == piece_properties.get("g"):
-                continue
-            # skip any that don't have offsets (adjacent edge piece)
-            if not a_props.get(str(piece)):
-                continue
-            if a_props.get("g") is None:
-                a_props["g"] = ""
-            snapshot.append(
-                "_".join(
-                    [
-                        str(a_piece),
-                        a_props.get("x", ""),
-                        a_props.get("y", ""),
-                        a_props.get("r", ""),
-                        a_props.get(str(piece), ""),
-                        # a_props.get("g")
-                    ]
-                )
-            )
-
-        if len(snapshot):
-            snapshot_id = nanoid.generate(size=8)
-            snapshot_key = f"snap:{snapshot_id}"
-            snapshot.insert(0, pzq_current)
-            redis_connection.set(snapshot_key, ":".join(snapshot))
-            redis_connection.expire(
-                snapshot_key,
-                current_app.config["MAX_PAUSE_PIECES_TIMEOUT"]
-                + (current_app.config["PIECE_MOVE_TIMEOUT"] + 2),
-            )
-
-        validate_token = (
-            len({"all", "valid_token"}.intersection(current_app.config["PUZZLE_RULES"]))
-            > 0
-        )
+        if status == "busy":
+            # Too many piece moves are already queued for this puzzle.
+            return get_puzzle_busy_response(result[1], now)
 
-        TOKEN_LOCK_TIMEOUT = current_app.config["TOKEN_LOCK_TIMEOUT"]
-        TOKEN_EXPIRE_TIMEOUT = current_app.config["TOKEN_EXPIRE_TIMEOUT"]
-        if not validate_token:
-
-            move_bit_icon_to_piece(piece_properties.get("x"), piece_properties.get("y"))
-            response = {
-                "token": token,
-                "lock": now + TOKEN_LOCK_TIMEOUT,
-                "expires": now + TOKEN_EXPIRE_TIMEOUT,
-            }
-            if snapshot_id:
-                response["snap"] = snapshot_id
-            return make_response(json.jsonify(response), 200)
-
-        # Check if user already has a token for this puzzle. This would mean
-        # that the user tried moving another piece before the locked piece
-        # finished moving.
-        existing_token = redis_connection.get(f"t:{mark}")
-        if existing_token:
+        if status == "concurrent":
             # Temporary ban the player when clicking a piece and not
             # dropping it before clicking another piece.
             # Ban the user for a few seconds
@@ -444,90 +599,329 @@ class PuzzlePieceTokenView(MethodView):
             ] = "Concurrent piece movements on this puzzle from the same player are not allowed."
             return make_response(json.jsonify(err_msg), 429)
 
-        piece_token_queue_key = get_puzzle_piece_token_queue_key(puzzle, piece)
-        with redis_connection.pipeline(transaction=False) as pipe:
-            pipe.zrank(piece_token_queue_key, mark)
-            pipe.expire(piece_token_queue_key, TOKEN_LOCK_TIMEOUT + 5)
-            (queue_rank, _) = pipe.execute()
-
-        if queue_rank is None:
-            # Append this player to a queue for getting the next token. This
-            # will prevent the player with the lock from continually locking the
-            # same piece.
-            with redis_connection.pipeline(transaction=False) as pipe:
-                pipe.zadd(piece_token_queue_key, {mark: now})
-                pipe.zrank(piece_token_queue_key, mark)
-                (_, queue_rank) = pipe.execute()
-
-        # Check if token on piece is in a queue and if the player requesting it
-        # is the player that is next. Show an error message if not.
-        if queue_rank > 0:
+        if status == "piecequeue":
+            # The token on piece is in a queue and the player requesting it is
+            # not the player that is next.
             err_msg = {
                 "msg": "Another player is waiting to move this piece",
                 "type": "piecequeue",
-                "reason": "Piece queue {}".format(queue_rank),
+                "reason": "Piece queue {}".format(result[1]),
                 "expires": now + TOKEN_LOCK_TIMEOUT,
                 "timeout": TOKEN_LOCK_TIMEOUT,
             }
             return make_response(json.jsonify(err_msg), 409)
 
-        # Check if token on piece is still owned by another user
-        puzzle_piece_token_key = get_puzzle_piece_token_key(puzzle, piece)
-        existing_token_and_mark = redis_connection.get(puzzle_piece_token_key)
-        if existing_token_and_mark:
-            (other_token, other_mark) = existing_token_and_mark.split(":")
-            puzzle_and_piece_and_user = redis_connection.get(f"t:{other_mark}")
-            # Check if there is a lock on this piece by other user
-            if puzzle_and_piece_and_user:
-                (
-                    other_puzzle,
-                    other_piece,
-                    other_user,
-                ) = puzzle_and_piece_and_user.split(":")
-                other_puzzle = int(other_puzzle)
-                other_piece = int(other_piece)
-                other_user = int(other_user)
-                if other_puzzle == puzzle and other_piece == piece:
-                    # Other user has a lock on this piece
-                    err_msg = {
-                        "msg": "Another player is moving this piece",
-                        "type": "piecelock",
-                        "reason": "Piece locked",
-                    }
-                    return make_response(json.jsonify(err_msg), 409)
-
-        # This piece is up for grabs since it has been more then 5 seconds since
-        # another player has grabbed it.
-        with redis_connection.pipeline(transaction=False) as pipe:
-            # Remove player from the piece token queue
-            pipe.zrem(piece_token_queue_key, mark)
+        if status == "piecelock":
+            # Other user has a lock on this piece
+            err_msg = {
+                "msg": "Another player is moving this piece",
+                "type": "piecelock",
+                "reason": "Piece locked",
+            }
+            return make_response(json.jsonify(err_msg), 409)
 
-            pipe.set(
-                puzzle_piece_token_key,
-                f"{token}:{mark}",
-                ex=TOKEN_EXPIRE_TIMEOUT,
-            )
-            pipe.set(
-                f"t:{mark}",
-                f"{puzzle}:{piece}:{user}",
-                ex=TOKEN_LOCK_TIMEOUT,
-            )
-            pipe.execute()
+        (_, puzzle, piece_x, piece_y, pzq_current, adjacent_snapshot) = result
+        snapshot = ":".join(filter(None, [pzq_current, adjacent_snapshot]))
+        token = pack_token(
+            current_app.secure_cookie.cookie_secret,
+            token_id,
+            int(puzzle),
+            user,
+            piece,
+            {"x": piece_x, "y": piece_y},
+            mark,
+            now + TOKEN_EXPIRE_TIMEOUT,
+            snapshot,
+        )
 
-        move_bit_icon_to_piece(piece_properties.get("x"), piece_properties.get("y"))
+        # Claim the piece by showing the bit icon next to it.
+        sse.publish(
+            formatBitMovementString(user, piece_x, piece_y),
+            type="move",
+            channel="puzzle:{puzzle_id}".format(puzzle_id=puzzle_id),
+        )
 
         response = {
             "token": token,
             "lock": now + TOKEN_LOCK_TIMEOUT,
             "expires": now + TOKEN_EXPIRE_TIMEOUT,
         }
-        if snapshot_id:
-            response["snap"] = snapshot_id
         # end = time.perf_counter()
         # current_app.logger.debug("PuzzlePieceTokenView {}".format(end - start))
         return make_response(json.jsonify(response), 200)
 
 
+def apply_piece_move(move):
+    """
+    Apply a piece move that was submitted to the PuzzleMoveSequencer. This is
+    only called by the publish worker that currently holds the sequencer lease
+    for the puzzle. Returns the msg and karma_change.
+    """
+    ip = move["ip"]
+    user = move["user"]
+    puzzle_data = move["puzzle_data"]
+    puzzle = puzzle_data["puzzle"]
+    piece = move["piece"]
+    x = move["x"]
+    y = move["y"]
+    r = move["r"]
+    karma_change = move["karma_change"]
+    karma = move["karma"]
+    snapshot = move["snapshot"]
+
+    snapshot_msg = None
+    snapshot_karma_change = False
+    if snapshot:
+        pzq_current_key = get_puzzle_key("pzq_current", puzzle)
+        pzq_current = int(redis_connection.get(pzq_current_key) or "0")
+        snapshot_list = snapshot.split(":")
+        snapshot_pzq = int(snapshot_list.pop(0))
+        if snapshot_pzq != pzq_current:
+            # Check if any adjacent pieces are within range of x, y, r
+            # Within that list check if any have moved
+            # With the first one that has moved that was within range attempt piece movement on that by using adjusted x, y, r
+            snaps = list(map(lambda x: x.split("_"), snapshot_list))
+            adjacent_piece_ids = list(map(lambda x: int(x[0]), snaps))
+            adjacent_piece_props_snaps = list(map(lambda x: x[1:], snaps))
+            property_list = [
+                "x",
+                "y",
+                "r",
+                "g",
+            ]
+            results = []
+            with redis_connection.pipeline(transaction=True) as pipe:
+                for adjacent_piece_id in adjacent_piece_ids:
+                    pc_puzzle_adjacent_piece_key = get_puzzle_key(
+                        "pc", puzzle, adjacent_piece_id
+                    )
+                    pipe.hmget(
+                        pc_puzzle_adjacent_piece_key,
+                        property_list,
+                    )
+                results = pipe.execute()
+            # The snapshot has the adjacent piece positions on the table.
+            adjacent_pieces = resolve_piece_group_positions(
+                redis_connection,
+                puzzle,
+                [dict(zip(property_list, result)) for result in results],
+            )
+            for (a_id, snapshot_adjacent, adjacent_piece,) in zip(
+                adjacent_piece_ids,
+                adjacent_piece_props_snaps,
+                adjacent_pieces,
+            ):
+                updated_adjacent = list(
+                    map(
+                        lambda x: x if isinstance(x, str) else "",
+                        [adjacent_piece[prop] for prop in ("x", "y", "r")],
+                    )
+                )
+                adjacent_offset = snapshot_adjacent.pop()
+                if (snapshot_adjacent != updated_adjacent) and adjacent_offset:
+                    (a_offset_x, a_offset_y) = map(int, adjacent_offset.split(","))
+                    (a_snap_x, a_snap_y) = map(int, snapshot_adjacent[:2])
+                    # Check if the x,y is within range of the adjacent piece that has moved
+                    piece_join_tolerance = current_app.config[
+                        "PIECE_JOIN_TOLERANCE"
+                    ]
+                    if (
+                        abs((a_snap_x + a_offset_x) - x) <= piece_join_tolerance
+                        and abs((a_snap_y + a_offset_y) - y)
+                        <= piece_join_tolerance
+                    ):
+                        (a_moved_x, a_moved_y) = map(int, updated_adjacent[:2])
+                        (snapshot_msg, snapshot_karma_change,) = attempt_piece_movement(
+                            ip,
+                            user,
+                            puzzle_data,
+                            piece,
+                            a_moved_x + a_offset_x,
+                            a_moved_y + a_offset_y,
+                            r,
+                            karma_change,
+                            karma,
+                        )
+                        break
+
+    (msg, karma_change) = attempt_piece_movement(
+        ip,
+        user,
+        puzzle_data,
+        piece,
+        x,
+        y,
+        r,
+        karma_change or snapshot_karma_change,
+        karma,
+    )
+    if isinstance(snapshot_msg, str) and isinstance(msg, str):
+        msg = snapshot_msg + msg
+    if move.get("claim") and not (
+        isinstance(msg, dict) and msg.get("type") == "piecegrouperror"
+    ):
+        # The piece was claimed without a token and stays locked until the
+        # piece move is done.  A conflicting piece move is tried again.
+        release_claimed_piece(
+            puzzle, piece, move["claim"]["mark"], move["claim"]["token"]
+        )
+    return (msg, karma_change)
+
+
+def apply_piece_move_concurrently(move):
+    """
+    Apply the piece move without waiting for other piece moves on the puzzle.
+    Retries when the piece move conflicts with another one that changed the
+    same pieces or piece groups. Returns None if it still conflicts so the
+    piece move can be submitted to the PuzzleMoveSequencer instead.
+    """
+    for attempt in range(PIECE_MUTATE_CONFLICT_RETRIES):
+        (msg, karma_change) = apply_piece_move(move)
+        if not (isinstance(msg, dict) and msg.get("type") == "piecegrouperror"):
+            return (msg, karma_change)
+    current_app.logger.debug(
+        f"Piece move conflicted {PIECE_MUTATE_CONFLICT_RETRIES} times on puzzle {move['puzzle_data']['puzzle']}"
+    )
+    return None
+
+
+def apply_piece_move_batch(batch):
+    """
+    Apply each piece move in the batch in order.  The batch is submitted to the
+    PuzzleMoveSequencer as one unit so no other piece moves on the puzzle are
+    applied between them.  Returns a list of the msg and karma_change for each
+    piece move.
+    """
+    return list(map(apply_piece_move, batch["moves"]))
+
+
+# Single and batch piece moves are queued on the same puzzle so every
+# sequencer needs to be able to apply both.
+PIECE_MOVE_BATCH = "batch"
+APPLY_PIECE_MOVE_KINDS = {
+    MOVE_KIND: apply_piece_move,
+    PIECE_MOVE_BATCH: apply_piece_move_batch,
+}
+
+
+def get_piece_move_result(piece, msg):
+    "Result for a piece move in a batch that is similar to the response for a single piece move."
+    if isinstance(msg, str):
+        return {"piece": piece, "status": 204}
+    if isinstance(msg, dict):
+        return {"piece": piece, "status": 400, "msg": msg}
+    return {"piece": piece, "status": 500, "msg": {"msg": msg, "type": "error"}}
+
+
+def claim_piece_for_move(puzzle, piece, mark, ip, origin_x, origin_y, now):
+    """
+    Check if the piece can be moved by the player right away without a token.
+    The piece needs to still be at the origin and not be locked or waited on
+    by another player. The piece is locked for the player with the token id
+    until the piece move is applied; see release_claimed_piece. Returns the
+    same dict as unpack_token and None or None and an error response.  The
+    player should request a token for the piece when the error response type
+    is "piececlaim".
+    """
+    user = current_app.secure_cookie.get("user") or user_id_from_ip(
+        ip, validate_shared_user=False
+    )
+    if user is None:
+        err_msg = {
+            "msg": "Please reload the page.",
+            "reason": "The player login was not found.",
+            "type": "puzzlereload",
+            "timeout": 300,
+        }
+        return (None, make_response(json.jsonify(err_msg), 400))
+    user = int(user)
+
+    validate_token = current_app.puzzle_policies.default.is_enabled("valid_token")
+    token_id = nanoid.generate(size=8)
+    with redis_connection.pipeline(transaction=False) as pipe:
+        # The player has not been checked if they are banned since there was no
+        # token request.  The bannedusers key is not for the puzzle so it is
+        # not checked in the piece_token script.
+        pipe.zscore("bannedusers", user)
+        run_script(
+            pipe,
+            "piece_token",
+            keys=[get_puzzle_key("pc", puzzle, piece)],
+            args=[
+                puzzle,
+                piece,
+                user,
+                mark,
+                now,
+                token_id,
+                1 if validate_token else 0,
+                current_app.config["TOKEN_LOCK_TIMEOUT"],
+                current_app.config["TOKEN_EXPIRE_TIMEOUT"],
+                get_queue_wait_budget(current_app.config),
+                origin_x,
+                origin_y,
+            ],
+        )
+        banned_expires, result = pipe.execute()
+    status = result[0]
+    if banned_expires and banned_expires > now:
+        status = "bannedusers"
+    if status == "busy":
+        return (None, get_puzzle_busy_response(result[1], now))
+    if status == "blockedplayer":
+        blockedplayers_expires = float(result[1])
+        err_msg = get_blockedplayers_err_msg(
+            blockedplayers_expires, blockedplayers_expires - now
+        )
+        return (None, make_response(json.jsonify(err_msg), 429))
+    if status == "immovable":
+        err_msg = {
+            "msg": "piece can't be moved",
+            "type": "immovable",
+            "expires": now + 5,
+            "timeout": 5,
+        }
+        return (None, make_response(json.jsonify(err_msg), 400))
+    if status != "grant":
+        # The piece can still be moved by getting a token for it first.
+        err_msg = {
+            "msg": "Piece needs a token to be moved",
+            "type": "piececlaim",
+            "reason": status,
+        }
+        return (None, make_response(json.jsonify(err_msg), 409))
+
+    (_, puzzle, piece_x, piece_y, _, _) = result
+    return (
+        {
+            "puzzle": int(puzzle),
+            "user": user,
+            "piece": piece,
+            "x": int(piece_x),
+            "y": int(piece_y),
+            "token": token_id,
+            "mark": mark,
+            "expires": now,
+            # The adjacent pieces are the same as when the piece is moved.
+            "snapshot": None,
+        },
+        None,
+    )
+
+
+def release_claimed_piece(puzzle, piece, mark, token):
+    "Release the lock on a piece that was set by claim_piece_for_move."
+    run_script(
+        redis_connection,
+        "release_piece_token",
+        keys=[
+            get_puzzle_piece_token_key(puzzle, piece),
+            get_puzzle_key("t", puzzle, mark),
+        ],
+        args=[token, mark],
+    )
+
+
 class PuzzlePiecesMovePublishView(MethodView):
     """
     Publish the puzzle piece movement and push it to the redis queue.
@@ -546,7 +940,7 @@ class PuzzlePiecesMovePublishView(MethodView):
     * Start piece translate logic
     """
 
-    ACCEPTABLE_ARGS = set(["x", "y", "r"])
+    ACCEPTABLE_ARGS = set(["x", "y", "r", "ox", "oy"])
 
     def patch(self, puzzle_id, piece):
         """
@@ -554,24 +948,16 @@ class PuzzlePiecesMovePublishView(MethodView):
         x
         y
         r
+        ox - origin x when moving the piece without a token
+        oy - origin y when moving the piece without a token
         """
 
-        def _blockplayer():
-            timeouts = current_app.config["BLOCKEDPLAYER_EXPIRE_TIMEOUTS"]
-            blocked_count_ip_key = f"blocked:{ip}"
-            expire_index = max(0, redis_connection.incr(blocked_count_ip_key) - 1)
-            redis_connection.expire(blocked_count_ip_key, timeouts[-1])
-            timeout = timeouts[min(expire_index, len(timeouts) - 1)]
-            expires = now + timeout
-            blockedplayers_for_puzzle_key = "blockedplayers:{puzzle}".format(
-                puzzle=puzzle
-            )
-            # Add the player to the blocked players list for the puzzle and
-            # extend the expiration of the key.
-            redis_connection.zadd(blockedplayers_for_puzzle_key, {user: expires})
-            redis_connection.expire(blockedplayers_for_puzzle_key, timeouts[-1])
-
-            err_msg = get_blockedplayers_err_msg(expires, expires - now)
+        def _blockplayer(expires=None):
+            "Block the player unless the expires is set which means the player has already been blocked."
+            if expires is None:
+                err_msg = block_player(current_app.config, puzzle, user, ip, now)
+            else:
+                err_msg = get_blockedplayers_err_msg(expires, expires - now)
             sse.publish(
                 "{user}:{piece}:{karma}:{karma_change}".format(
                     user=user,
@@ -585,10 +971,7 @@ class PuzzlePiecesMovePublishView(MethodView):
             return make_response(json.jsonify(err_msg), 429)
 
         ip = request.headers.get("X-Real-IP")
-        validate_token = (
-            len({"all", "valid_token"}.intersection(current_app.config["PUZZLE_RULES"]))
-            > 0
-        )
+        validate_token = current_app.puzzle_policies.default.is_enabled("valid_token")
         user = None
         now = int(time.time())
 
@@ -635,12 +1018,19 @@ class PuzzlePiecesMovePublishView(MethodView):
         x = args.get("x")
         y = args.get("y")
         r = args.get("r")
-        snapshot_id = request.headers.get("Snap")
 
         # Token is to make sure puzzle is still in sync.
         # validate the token
         token = request.headers.get("Token")
-        if not token:
+        # The piece can be moved without a token if it hasn't moved from the
+        # origin and no other player is moving it.
+        fast_path = (
+            not token
+            and current_app.config.get("PIECE_MOVE_FAST_PATH")
+            and args.get("ox") is not None
+            and args.get("oy") is not None
+        )
+        if not token and not fast_path:
             err_msg = {
                 "msg": "Missing token",
                 "type": "missing",
@@ -659,12 +1049,38 @@ class PuzzlePiecesMovePublishView(MethodView):
             }
             return make_response(json.jsonify(err_msg), 400)
 
+        # A retry of a piece move gets the same response as the first one
+        # instead of moving the piece again.  The token is only used once so
+        # it can be the idempotency key if the client didn't set one.
+        idempotency_key = request.headers.get("Idempotency-Key") or token
+        response_key = None
+        if idempotency_key:
+            response_key = get_piece_move_response_key(
+                puzzle_id, mark, idempotency_key
+            )
+            stored_response = reserve_piece_move_response(
+                response_key, current_app.config["PIECE_MOVE_TIMEOUT"] + 2
+            )
+            if stored_response is not None:
+                return stored_response
+
         # start = time.perf_counter()
-        existing_token = redis_connection.get(f"t:{mark}")
-        if validate_token and existing_token:
-            (m_puzzle, m_piece, m_user) = existing_token.split(":")
-            user = int(m_user)
+        puzzle_data = None
+        if fast_path:
+            puzzle_data, err_response = get_puzzle_data(puzzle_id)
+            if err_response is not None:
+                return err_response
+            piece_token, err_response = claim_piece_for_move(
+                puzzle_data["puzzle"], piece, mark, ip, args["ox"], args["oy"], now
+            )
+            if err_response is not None:
+                return err_response
         else:
+            # The token is signed when it is created so it can be validated
+            # without reading from redis.  It also has the player that it was
+            # created for.
+            piece_token = unpack_token(current_app.secure_cookie.cookie_secret, token)
+        if piece_token is None:
             user = current_app.secure_cookie.get("user") or user_id_from_ip(
                 ip, validate_shared_user=False
             )
@@ -676,79 +1092,50 @@ class PuzzlePiecesMovePublishView(MethodView):
                     "timeout": 300,
                 }
                 return make_response(json.jsonify(err_msg), 400)
-            user = int(user)
-
-        pzq_key = "pzq:{puzzle_id}".format(puzzle_id=puzzle_id)
-        pzq_fields = [
-            "puzzle",
-            "table_width",
-            "table_height",
-            "permission",
-            "pieces",
-        ]
-        puzzle_data = dict(zip(pzq_fields, redis_connection.hmget(pzq_key, pzq_fields)))
-        puzzle = puzzle_data.get("puzzle")
-        if puzzle is None:
-            req = requests.get(
-                "http://{HOSTAPI}:{PORTAPI}/internal/puzzle/{puzzle_id}/details/".format(
-                    HOSTAPI=current_app.config["HOSTAPI"],
-                    PORTAPI=current_app.config["PORTAPI"],
-                    puzzle_id=puzzle_id,
-                ),
-            )
-            if req.status_code >= 400:
-                err_msg = {"msg": "puzzle not available", "type": "missing"}
-                return make_response(json.jsonify(err_msg), req.status_code)
-            try:
-                result = req.json()
-            except ValueError as err:
-                err_msg = {"msg": "puzzle not available", "type": "missing"}
-                return make_response(json.jsonify(err_msg), 500)
-            if result.get("status") not in (ACTIVE, BUGGY_UNLISTED):
-                err_msg = {"msg": "puzzle not available", "type": "missing"}
-                return make_response(json.jsonify(err_msg), 404)
-            puzzle_data = result
-            puzzle_data["puzzle"] = result["id"]
-
-            redis_connection.hmset(
-                pzq_key,
-                {
-                    "puzzle": puzzle_data["puzzle"],
-                    "table_width": puzzle_data["table_width"],
-                    "table_height": puzzle_data["table_height"],
-                    "permission": puzzle_data["permission"],
-                    "pieces": puzzle_data["pieces"],
-                },
-            )
-            redis_connection.expire(pzq_key, 300)
-        else:
-            puzzle_data["puzzle"] = int(puzzle_data["puzzle"])
-            puzzle_data["table_width"] = int(puzzle_data["table_width"])
-            puzzle_data["table_height"] = int(puzzle_data["table_height"])
-            puzzle_data["permission"] = int(puzzle_data["permission"])
-            puzzle_data["pieces"] = int(puzzle_data["pieces"])
+            err_msg = increase_ban_time(int(user), TOKEN_INVALID_BAN_TIME_INCR)
+            err_msg["reason"] = "Token is invalid"
+            return make_response(json.jsonify(err_msg), 409)
+        user = piece_token["user"]
+        if piece_token["piece"] != piece or piece_token["mark"] != mark:
+            err_msg = increase_ban_time(user, TOKEN_INVALID_BAN_TIME_INCR)
+            err_msg["reason"] = "Player is invalid"
+            return make_response(json.jsonify(err_msg), 409)
+        if piece_token["expires"] < now:
+            err_msg = {
+                "msg": "Token has expired",
+                "type": "expiredtoken",
+                "reason": "",
+            }
+            return make_response(json.jsonify(err_msg), 409)
+
+        if puzzle_data is None:
+            puzzle_data, err_response = get_puzzle_data(puzzle_id)
+            if err_response is not None:
+                return err_response
         puzzle = int(puzzle_data["puzzle"])
-        puzzle_data["puzzle_id"] = puzzle_id
 
-        puzzle_piece_token_key = get_puzzle_piece_token_key(puzzle, piece)
-        validate_token = (
-            len({"all", "valid_token"}.intersection(current_app.config["PUZZLE_RULES"]))
-            > 0
-        )
-        if validate_token:
-            token_and_mark = redis_connection.get(puzzle_piece_token_key)
-            if token_and_mark:
-                (valid_token, other_mark) = token_and_mark.split(":")
-                # other_user = int(other_user)
-                if token != valid_token:
-                    err_msg = increase_ban_time(user, TOKEN_INVALID_BAN_TIME_INCR)
-                    err_msg["reason"] = "Token is invalid"
-                    return make_response(json.jsonify(err_msg), 409)
-                if mark != other_mark:
-                    err_msg = increase_ban_time(user, TOKEN_INVALID_BAN_TIME_INCR)
-                    err_msg["reason"] = "Player is invalid"
-                    return make_response(json.jsonify(err_msg), 409)
-            else:
+        if piece_token["puzzle"] != puzzle:
+            err_msg = increase_ban_time(user, TOKEN_INVALID_BAN_TIME_INCR)
+            err_msg["reason"] = "Token is invalid"
+            return make_response(json.jsonify(err_msg), 409)
+
+        if validate_token and not fast_path:
+            # Release the lock on the piece and expire the token since it
+            # shouldn't be used again.
+            released = run_script(
+                redis_connection,
+                "release_piece_token",
+                keys=[
+                    get_puzzle_piece_token_key(puzzle, piece),
+                    get_puzzle_key("t", puzzle, mark),
+                ],
+                args=[piece_token["token"], mark],
+            )
+            if released == -1:
+                err_msg = increase_ban_time(user, TOKEN_INVALID_BAN_TIME_INCR)
+                err_msg["reason"] = "Token is invalid"
+                return make_response(json.jsonify(err_msg), 409)
+            if released == 0:
                 err_msg = {
                     "msg": "Token has expired",
                     "type": "expiredtoken",
@@ -756,33 +1143,12 @@ class PuzzlePiecesMovePublishView(MethodView):
                 }
                 return make_response(json.jsonify(err_msg), 409)
 
-        # Expire the token since it shouldn't be used again
-        if validate_token:
-            redis_connection.delete(puzzle_piece_token_key)
-            redis_connection.delete(f"t:{mark}")
-
-        if (
-            len(
-                {"all", "piece_translate_rate"}.intersection(
-                    current_app.config["PUZZLE_RULES"]
-                )
-            )
-            > 0
-        ):
-            err_msg = bump_count(user)
-            if err_msg.get("type") == "bannedusers":
-                return make_response(json.jsonify(err_msg), 429)
-
         # Check if piece will be moved to within boundaries
-        if x and (x < 0 or x > puzzle_data["table_width"]):
-            err_msg = {
-                "msg": "Piece movement out of bounds",
-                "type": "invalidpiecemove",
-                "expires": now + 5,
-                "timeout": 5,
-            }
-            return make_response(json.jsonify(err_msg), 400)
-        if y and (y < 0 or y > puzzle_data["table_height"]):
+        if (x and (x < 0 or x > puzzle_data["table_width"])) or (
+            y and (y < 0 or y > puzzle_data["table_height"])
+        ):
+            if fast_path:
+                release_claimed_piece(puzzle, piece, mark, piece_token["token"])
             err_msg = {
                 "msg": "Piece movement out of bounds",
                 "type": "invalidpiecemove",
@@ -791,16 +1157,34 @@ class PuzzlePiecesMovePublishView(MethodView):
             }
             return make_response(json.jsonify(err_msg), 400)
 
-        # Check again if piece can be moved and hasn't changed since getting token
-        has_y = redis_connection.hget(
-            "pc:{puzzle}:{piece}".format(puzzle=puzzle, piece=piece), "y"
+        policy = current_app.puzzle_policies.get_for_puzzle(puzzle_data)
+        origin_x = piece_token["x"]
+        origin_y = piece_token["y"]
+        rules_result = evaluate_piece_move_rules(
+            redis_connection,
+            policy,
+            puzzle,
+            user,
+            ip,
+            piece,
+            origin_x,
+            origin_y,
+            x,
+            y,
+            now,
         )
-        if has_y is None:
+        status = rules_result["status"]
+        if fast_path and status != "ok":
+            # The piece isn't moved so it doesn't need to stay locked.
+            release_claimed_piece(puzzle, piece, mark, piece_token["token"])
+        if status == "bannedusers":
+            err_msg = increase_ban_time(user, PIECE_TRANSLATE_BAN_TIME_INCR)
+            err_msg["reason"] = policy.piece_translate_exceeded_reason
+            return make_response(json.jsonify(err_msg), 429)
+        if status == "missing":
             err_msg = {"msg": "piece not available", "type": "missing"}
             return make_response(json.jsonify(err_msg), 404)
-
-        if redis_connection.sismember(f"pcfixed:{puzzle}", piece) == 1:
-            # immovable
+        if status == "immovable":
             err_msg = {
                 "msg": "piece can't be moved",
                 "type": "immovable",
@@ -809,252 +1193,67 @@ class PuzzlePiecesMovePublishView(MethodView):
             }
             return make_response(json.jsonify(err_msg), 400)
 
-        (_, _, _, origin_x, origin_y, _) = unpack_token(token)
-        redis_connection.publish(
-            f"enforcer_piece_translate:{puzzle}",
-            f"{user}:{piece}:{origin_x}:{origin_y}:{x}:{y}",
-        )
-
-        points_key = "points:{user}".format(user=user)
-        recent_points = int(redis_connection.get(points_key) or "0")
-
-        karma_key = init_karma_key(redis_connection, puzzle, ip, current_app.config)
-        karma = int(redis_connection.get(karma_key))
-        karma_change = 0
+        session_key = get_player_session_key(puzzle, ip)
+        karma = rules_result["karma"]
+        karma_change = rules_result["karma_change"]
+        recent_points = rules_result["recent_points"]
         current_app.logger.debug(
             f"user: {user} ip: {ip} karma: {karma} recent_points {recent_points}"
         )
+        if status == "blockedplayer":
+            return _blockplayer(expires=rules_result["expires"])
+
+        piece_move_timeout = current_app.config["PIECE_MOVE_TIMEOUT"]
 
+        move = {
+            "ip": ip,
+            "user": user,
+            "puzzle_data": puzzle_data,
+            "piece": piece,
+            "x": x,
+            "y": y,
+            "r": r,
+            "karma_change": karma_change,
+            "karma": karma,
+            "snapshot": piece_token["snapshot"],
+            # The lock on a claimed piece is released after it is moved.
+            "claim": (
+                {"token": piece_token["token"], "mark": mark} if fast_path else None
+            ),
+        }
+        applied_move = None
         if (
-            len(
-                {"all", "puzzle_open_rate"}.intersection(
-                    current_app.config["PUZZLE_RULES"]
-                )
-            )
-            > 0
+            current_app.config.get("PIECE_MUTATE_CONCURRENCY", CONCURRENCY_PUZZLE)
+            == CONCURRENCY_PIECE
         ):
-            # Decrease recent points if this is a new puzzle that user hasn't moved pieces on yet in the last hour
-            pzrate_key = "pzrate:{user}:{today}".format(
-                user=user, today=datetime.date.today().isoformat()
+            # Piece moves that don't conflict with other piece moves on the
+            # puzzle can be applied right away.
+            applied_move = apply_piece_move_concurrently(move)
+
+        # The sequencer prevents multiple processes from running the
+        # attempt_piece_movement concurrently on the same puzzle.
+        sequencer = PuzzleMoveSequencer(
+            redis_connection,
+            puzzle,
+            APPLY_PIECE_MOVE_KINDS,
+            timeout=piece_move_timeout,
+            logger=current_app.logger,
+        )
+        try:
+            # A newer move of the same piece by the player replaces this one
+            # if it is still waiting in the queue.
+            applied_move = applied_move or sequencer.submit(
+                move, coalesce_key=f"{user}:{piece}"
             )
-            if redis_connection.sadd(pzrate_key, puzzle) == 1:
-                # New puzzle that player hasn't moved a piece on in the last hour.
-                redis_connection.expire(pzrate_key, HOUR)
-                if recent_points > 0:
-                    redis_connection.decr(points_key)
-
-        if (
-            len(
-                {"all", "piece_move_rate"}.intersection(
-                    current_app.config["PUZZLE_RULES"]
-                )
+        except PuzzleMoveSequencerTimeout:
+            current_app.logger.warn(
+                f"Puzzle {puzzle} is too active. Attempt piece move timed out."
             )
-            > 0
-        ):
-            # Decrease karma if piece movement rate has passed threshold
-            pcrate_key = f"pcrate:{puzzle}:{user}"
-            moves = redis_connection.incr(pcrate_key)
-            redis_connection.expire(pcrate_key, PIECE_MOVEMENT_RATE_TIMEOUT)
-            if moves > PIECE_MOVEMENT_RATE_LIMIT:
-                if karma > 0:
-                    karma = redis_connection.decr(karma_key)
-                karma_change -= 1
-
-        if (
-            len({"all", "hot_piece"}.intersection(current_app.config["PUZZLE_RULES"]))
-            > 0
-        ):
-            # Decrease karma when moving the same piece multiple times within
-            # a minute.
-            hotpc_key = f"hotpc:{puzzle}:{user}:{piece}"
-            recent_move_count = redis_connection.incr(hotpc_key)
-            redis_connection.expire(hotpc_key, HOT_PIECE_MOVEMENT_RATE_TIMEOUT)
-
-            if recent_move_count > MOVES_BEFORE_PENALTY:
-                if karma > 0:
-                    karma = redis_connection.decr(karma_key)
-                karma_change -= 1
-
-        if (
-            len({"all", "hot_spot"}.intersection(current_app.config["PUZZLE_RULES"]))
-            > 0
-        ):
-            # Decrease the karma for the player if the piece is in a hotspot.
-            hotspot_piece_key = f"hotspot:{puzzle}:{user}:{piece}"
-            hotspot_count = int(redis_connection.get(hotspot_piece_key) or "0")
-            if hotspot_count > HOTSPOT_LIMIT:
-                if karma > 0:
-                    karma = redis_connection.decr(karma_key)
-                karma_change -= 1
-
-        if karma_change < 0:
-            # Decrease recent points for a piece move that decreased karma
-            if recent_points > 0 and karma_change < 0:
-                recent_points = redis_connection.decr(points_key)
-            if karma + recent_points <= 0:
-                return _blockplayer()
-
-        piece_move_timeout = current_app.config["PIECE_MOVE_TIMEOUT"]
-
-        # Use a custom built and managed queue to prevent multiple processes
-        # from running the attempt_piece_movement concurrently on the same
-        # puzzle.
-        pzq_current_key = "pzq_current:{puzzle}".format(puzzle=puzzle)
-        pzq_next_key = "pzq_next:{puzzle}".format(puzzle=puzzle)
-        # The attempt_piece_movement bumps the pzq_current by 1
-        pzq_next = redis_connection.incr(pzq_next_key, amount=1)
-        # Set the expire in case it fails to reach expire in attempt_piece_movement.
-        redis_connection.expire(pzq_current_key, piece_move_timeout + 2)
-        redis_connection.expire(pzq_next_key, piece_move_timeout + 2)
-
-        attempt_count = 0
-        attempt_timestamp = time.time()
-        timeout = attempt_timestamp + piece_move_timeout
-        while attempt_timestamp < timeout:
-            pzq_current = int(redis_connection.get(pzq_current_key) or "0")
-            if pzq_current == pzq_next - 1:
-                try:
-                    snapshot_msg = None
-                    snapshot_karma_change = False
-                    if snapshot_id:
-                        snapshot_key = f"snap:{snapshot_id}"
-                        snapshot = redis_connection.get(snapshot_key)
-                        if snapshot:
-                            snapshot_list = snapshot.split(":")
-                            snapshot_pzq = int(snapshot_list.pop(0))
-                            if snapshot_pzq != pzq_current:
-                                # Check if any adjacent pieces are within range of x, y, r
-                                # Within that list check if any have moved
-                                # With the first one that has moved that was within range attempt piece movement on that by using adjusted x, y, r
-                                snaps = list(map(lambda x: x.split("_"), snapshot_list))
-                                adjacent_piece_ids = list(
-                                    map(lambda x: int(x[0]), snaps)
-                                )
-                                adjacent_piece_props_snaps = list(
-                                    map(lambda x: x[1:], snaps)
-                                )
-                                property_list = [
-                                    "x",
-                                    "y",
-                                    "r",
-                                    # "g"
-                                ]
-                                results = []
-                                with redis_connection.pipeline(
-                                    transaction=True
-                                ) as pipe:
-                                    for adjacent_piece_id in adjacent_piece_ids:
-                                        pc_puzzle_adjacent_piece_key = (
-                                            f"pc:{puzzle}:{adjacent_piece_id}"
-                                        )
-                                        pipe.hmget(
-                                            pc_puzzle_adjacent_piece_key,
-                                            property_list,
-                                        )
-                                    results = pipe.execute()
-                                for (a_id, snapshot_adjacent, updated_adjacent,) in zip(
-                                    adjacent_piece_ids,
-                                    adjacent_piece_props_snaps,
-                                    results,
-                                ):
-                                    updated_adjacent = list(
-                                        map(
-                                            lambda x: x if isinstance(x, str) else "",
-                                            updated_adjacent,
-                                        )
-                                    )
-                                    adjacent_offset = snapshot_adjacent.pop()
-                                    if (
-                                        snapshot_adjacent != updated_adjacent
-                                    ) and adjacent_offset:
-                                        (a_offset_x, a_offset_y) = map(
-                                            int, adjacent_offset.split(",")
-                                        )
-                                        (a_snap_x, a_snap_y) = map(
-                                            int, snapshot_adjacent[:2]
-                                        )
-                                        # Check if the x,y is within range of the adjacent piece that has moved
-                                        piece_join_tolerance = current_app.config[
-                                            "PIECE_JOIN_TOLERANCE"
-                                        ]
-                                        if (
-                                            abs((a_snap_x + a_offset_x) - x)
-                                            <= piece_join_tolerance
-                                            and abs((a_snap_y + a_offset_y) - y)
-                                            <= piece_join_tolerance
-                                        ):
-                                            (a_moved_x, a_moved_y) = map(
-                                                int, updated_adjacent[:2]
-                                            )
-                                            # Decrease pzq_current since it is moving an extra piece out of turn
-                                            redis_connection.decr(
-                                                pzq_current_key, amount=1
-                                            )
-                                            (
-                                                snapshot_msg,
-                                                snapshot_karma_change,
-                                            ) = attempt_piece_movement(
-                                                ip,
-                                                user,
-                                                puzzle_data,
-                                                piece,
-                                                a_moved_x + a_offset_x,
-                                                a_moved_y + a_offset_y,
-                                                r,
-                                                karma_change,
-                                                karma,
-                                            )
-                                            break
-                except:
-                    pzq_current = int(redis_connection.get(pzq_current_key) or "0")
-                    if pzq_current == pzq_next - 1:
-                        # skip this piece move attempt
-                        redis_connection.incr(pzq_current_key, amount=1)
-                    current_app.logger.warning(
-                        "results123 other error {}".format(sys.exc_info()[0])
-                    )
-                    raise
-
-                (msg, karma_change) = attempt_piece_movement(
-                    ip,
-                    user,
-                    puzzle_data,
-                    piece,
-                    x,
-                    y,
-                    r,
-                    karma_change or snapshot_karma_change,
-                    karma,
-                )
-                if isinstance(snapshot_msg, str) and isinstance(msg, str):
-                    msg = snapshot_msg + msg
-                break
-            current_app.logger.debug(f"pzq_current is {pzq_current}")
-            attempt_timestamp = time.time()
-            attempt_count = attempt_count + 1
-            # TODO: The sleep time should be set based on an average time it
-            # takes to process piece movements.
-            time.sleep(0.02)
-
             # Decrease karma here to potentially block a player that
             # continually tries to move pieces when a puzzle is too active.
-            if (
-                len(
-                    {"all", "too_active"}.intersection(
-                        current_app.config["PUZZLE_RULES"]
-                    )
-                )
-                > 0
-            ) and karma > 0:
-                karma = redis_connection.decr(karma_key)
+            if policy.is_enabled("too_active") and karma > 0:
+                karma = redis_connection.hincrby(session_key, "karma", -1)
                 karma_change -= 1
-        current_app.logger.debug(
-            f"Puzzle ({puzzle}) piece move attempts: {attempt_count}"
-        )
-        if attempt_timestamp >= timeout:
-            current_app.logger.warn(
-                f"Puzzle {puzzle} is too active. Attempt piece move timed out after trying {attempt_count} times."
-            )
             err_msg = {
                 "msg": "Piece movement timed out.",
                 "type": "error",
@@ -1065,11 +1264,25 @@ class PuzzlePiecesMovePublishView(MethodView):
                 json.jsonify(err_msg),
                 503,
             )
+        except PuzzleMoveSequencerError as err:
+            current_app.logger.warning("Unknown error: {}".format(err))
+            return make_response(
+                json.jsonify({"msg": "Unknown error", "type": "error", "timeout": 3}),
+                500,
+            )
+
+        if applied_move is None:
+            # The player has already moved the piece again so there is
+            # nothing to publish for this move.
+            return store_piece_move_response(response_key, make_response("", 204))
+        (msg, karma_change) = applied_move
 
         # Check msg for error or if piece can't be moved
         if not isinstance(msg, str):
             if isinstance(msg, dict):
-                return make_response(json.jsonify(msg), 400)
+                return store_piece_move_response(
+                    response_key, make_response(json.jsonify(msg), 400)
+                )
             else:
                 current_app.logger.warning("Unknown error: {}".format(msg))
                 return make_response(
@@ -1086,11 +1299,330 @@ class PuzzlePiecesMovePublishView(MethodView):
 
         if karma_change < 0:
             if karma + recent_points <= 0:
-                return _blockplayer()
+                return store_piece_move_response(response_key, _blockplayer())
 
         # end = time.perf_counter()
         # current_app.logger.debug("PuzzlePiecesMovePublishView {}".format(end - start))
-        return make_response("", 204)
+        return store_piece_move_response(response_key, make_response("", 204))
+
+
+class PuzzlePiecesBatchMovePublishView(MethodView):
+    """
+    Move multiple pieces for a player in one request.  Each piece move has the
+    token that the player got for that piece.  The piece moves are applied in
+    order as one unit.  /puzzle/<puzzle_id>/pieces/move/
+    """
+
+    decorators = [user_not_banned]
+
+    def patch(self, puzzle_id):
+        """
+        args:
+        moves - list of piece, x, y, r, token
+        """
+        ip = request.headers.get("X-Real-IP")
+        validate_token = current_app.puzzle_policies.default.is_enabled("valid_token")
+        now = int(time.time())
+
+        invalid_args_response = make_response(
+            json.jsonify(
+                {
+                    "msg": "invalid args",
+                    "type": "invalid",
+                    "expires": now + 5,
+                    "timeout": 5,
+                }
+            ),
+            400,
+        )
+        args = request.get_json(silent=True) or {}
+        moves = args.get("moves")
+        if not isinstance(moves, list) or not (
+            0 < len(moves) <= MAX_BATCH_PIECE_MOVES
+        ):
+            return invalid_args_response
+        try:
+            moves = list(
+                map(
+                    lambda move: {
+                        "piece": int(move["piece"]),
+                        "x": int(move["x"]),
+                        "y": int(move["y"]),
+                        "r": int(move["r"]) if move.get("r") is not None else None,
+                        "token": str(move["token"]),
+                    },
+                    moves,
+                )
+            )
+        except (KeyError, TypeError, ValueError):
+            return invalid_args_response
+
+        mark = request.headers.get("Mark")
+        if not mark:
+            err_msg = {
+                "msg": "Missing mark",
+                "type": "missing",
+                "expires": now + 5,
+                "timeout": 5,
+            }
+            return make_response(json.jsonify(err_msg), 400)
+
+        # All the tokens are validated before any piece is moved.
+        cookie_secret = current_app.secure_cookie.cookie_secret
+        piece_tokens = list(
+            map(lambda move: unpack_token(cookie_secret, move["token"]), moves)
+        )
+        if None in piece_tokens:
+            user = current_app.secure_cookie.get("user") or user_id_from_ip(
+                ip, validate_shared_user=False
+            )
+            if user is None:
+                err_msg = {
+                    "msg": "Please reload the page.",
+                    "reason": "The player login was not found.",
+                    "type": "puzzlereload",
+                    "timeout": 300,
+                }
+                return make_response(json.jsonify(err_msg), 400)
+            err_msg = increase_ban_time(int(user), TOKEN_INVALID_BAN_TIME_INCR)
+            err_msg["reason"] = "Token is invalid"
+            return make_response(json.jsonify(err_msg), 409)
+        user = piece_tokens[0]["user"]
+        for (move, piece_token) in zip(moves, piece_tokens):
+            if (
+                piece_token["user"] != user
+                or piece_token["piece"] != move["piece"]
+                or piece_token["mark"] != mark
+            ):
+                err_msg = increase_ban_time(user, TOKEN_INVALID_BAN_TIME_INCR)
+                err_msg["reason"] = "Player is invalid"
+                return make_response(json.jsonify(err_msg), 409)
+
+        (puzzle_data, err_response) = get_puzzle_data(puzzle_id)
+        if err_response is not None:
+            return err_response
+        puzzle = int(puzzle_data["puzzle"])
+        if len(set(map(lambda piece_token: piece_token["puzzle"], piece_tokens)) - {puzzle}):
+            err_msg = increase_ban_time(user, TOKEN_INVALID_BAN_TIME_INCR)
+            err_msg["reason"] = "Token is invalid"
+            return make_response(json.jsonify(err_msg), 409)
+
+        expired_token_err_msg = {
+            "msg": "Token has expired",
+            "type": "expiredtoken",
+            "reason": "",
+        }
+        results = [None] * len(moves)
+        for (index, piece_token) in enumerate(piece_tokens):
+            if piece_token["expires"] < now:
+                results[index] = {
+                    "piece": moves[index]["piece"],
+                    "status": 409,
+                    "msg": expired_token_err_msg,
+                }
+
+        if validate_token:
+            # Release the lock on each piece in one request.
+            pending = [index for index in range(len(moves)) if results[index] is None]
+            with redis_connection.pipeline(transaction=False) as pipe:
+                for index in pending:
+                    run_script(
+                        pipe,
+                        "release_piece_token",
+                        keys=[
+                            get_puzzle_piece_token_key(puzzle, moves[index]["piece"]),
+                            get_puzzle_key("t", puzzle, mark),
+                        ],
+                        args=[piece_tokens[index]["token"], mark],
+                    )
+                released = pipe.execute()
+            if -1 in released:
+                err_msg = increase_ban_time(user, TOKEN_INVALID_BAN_TIME_INCR)
+                err_msg["reason"] = "Token is invalid"
+                return make_response(json.jsonify(err_msg), 409)
+            for (index, is_released) in zip(pending, released):
+                if is_released == 0:
+                    results[index] = {
+                        "piece": moves[index]["piece"],
+                        "status": 409,
+                        "msg": expired_token_err_msg,
+                    }
+
+        for (index, move) in enumerate(moves):
+            if results[index] is not None:
+                continue
+            if (move["x"] < 0 or move["x"] > puzzle_data["table_width"]) or (
+                move["y"] < 0 or move["y"] > puzzle_data["table_height"]
+            ):
+                results[index] = {
+                    "piece": move["piece"],
+                    "status": 400,
+                    "msg": {
+                        "msg": "Piece movement out of bounds",
+                        "type": "invalidpiecemove",
+                        "expires": now + 5,
+                        "timeout": 5,
+                    },
+                }
+
+        pending = [index for index in range(len(moves)) if results[index] is None]
+        policy = current_app.puzzle_policies.get_for_puzzle(puzzle_data)
+        rules_results = evaluate_piece_move_rules_batch(
+            redis_connection,
+            policy,
+            puzzle,
+            user,
+            ip,
+            list(
+                map(
+                    lambda index: {
+                        "piece": moves[index]["piece"],
+                        "origin_x": piece_tokens[index]["x"],
+                        "origin_y": piece_tokens[index]["y"],
+                        "x": moves[index]["x"],
+                        "y": moves[index]["y"],
+                    },
+                    pending,
+                )
+            ),
+            now,
+        )
+        if "bannedusers" in map(lambda result: result["status"], rules_results):
+            err_msg = increase_ban_time(user, PIECE_TRANSLATE_BAN_TIME_INCR)
+            err_msg["reason"] = policy.piece_translate_exceeded_reason
+            return make_response(json.jsonify(err_msg), 429)
+
+        batch_index = []
+        batch = []
+        blocked_err_msg = None
+        # Only the piece moves that were applied are published.
+        last_applied = None
+        for (index, rules_result) in zip(pending, rules_results):
+            piece = moves[index]["piece"]
+            status = rules_result["status"]
+            if blocked_err_msg is not None:
+                results[index] = {"piece": piece, "status": 429, "msg": blocked_err_msg}
+            elif status == "missing":
+                results[index] = {
+                    "piece": piece,
+                    "status": 404,
+                    "msg": {"msg": "piece not available", "type": "missing"},
+                }
+            elif status == "immovable":
+                results[index] = {
+                    "piece": piece,
+                    "status": 400,
+                    "msg": {
+                        "msg": "piece can't be moved",
+                        "type": "immovable",
+                        "expires": now + 5,
+                        "timeout": 5,
+                    },
+                }
+            elif status == "blockedplayer":
+                # The piece moves after this one are also not allowed.
+                expires = rules_result["expires"]
+                blocked_err_msg = get_blockedplayers_err_msg(expires, expires - now)
+                results[index] = {"piece": piece, "status": 429, "msg": blocked_err_msg}
+            else:
+                batch_index.append(index)
+                batch.append(
+                    {
+                        "ip": ip,
+                        "user": user,
+                        "puzzle_data": puzzle_data,
+                        "piece": piece,
+                        "x": moves[index]["x"],
+                        "y": moves[index]["y"],
+                        "r": moves[index]["r"],
+                        "karma_change": rules_result["karma_change"],
+                        "karma": rules_result["karma"],
+                        "recent_points": rules_result["recent_points"],
+                        "snapshot": piece_tokens[index]["snapshot"],
+                    }
+                )
+
+        if batch:
+            piece_move_timeout = current_app.config["PIECE_MOVE_TIMEOUT"]
+            sequencer = PuzzleMoveSequencer(
+                redis_connection,
+                puzzle,
+                APPLY_PIECE_MOVE_KINDS,
+                timeout=piece_move_timeout,
+                logger=current_app.logger,
+            )
+            try:
+                applied = sequencer.submit({"moves": batch}, kind=PIECE_MOVE_BATCH)
+            except PuzzleMoveSequencerTimeout:
+                current_app.logger.warn(
+                    f"Puzzle {puzzle} is too active. Attempt piece moves timed out."
+                )
+                err_msg = {
+                    "msg": "Piece movement timed out.",
+                    "type": "error",
+                    "reason": "Puzzle is too active",
+                    "timeout": piece_move_timeout,
+                }
+                return make_response(json.jsonify(err_msg), 503)
+            except PuzzleMoveSequencerError as err:
+                current_app.logger.warning("Unknown error: {}".format(err))
+                return make_response(
+                    json.jsonify({"msg": "Unknown error", "type": "error", "timeout": 3}),
+                    500,
+                )
+            for (index, move, (msg, karma_change)) in zip(batch_index, batch, applied):
+                results[index] = get_piece_move_result(move["piece"], msg)
+                if isinstance(msg, str):
+                    last_applied = (index, move, karma_change)
+
+        if last_applied is not None:
+            # publish just the bit movement of the last piece moved
+            (last_index, last_move, karma_change) = last_applied
+            sse.publish(
+                formatBitMovementString(user, last_move["x"], last_move["y"]),
+                type="move",
+                channel="puzzle:{puzzle_id}".format(puzzle_id=puzzle_id),
+            )
+
+            if (
+                blocked_err_msg is None
+                and karma_change < 0
+                and last_move["karma"] + last_move["recent_points"] <= 0
+            ):
+                blocked_err_msg = block_player(current_app.config, puzzle, user, ip, now)
+                results[last_index] = {
+                    "piece": last_move["piece"],
+                    "status": 429,
+                    "msg": blocked_err_msg,
+                }
+
+        return make_response(json.jsonify({"moves": results}), 200)
+
+
+def get_internal_puzzle_data(puzzle_id):
+    "Get the puzzle data from the pzq hash. Returns None if it is not set."
+    pzq_key = get_puzzle_data_key(puzzle_id)
+    pzq_fields = [
+        "puzzle",
+        "table_width",
+        "table_height",
+        "permission",
+        "pieces",
+        "status",
+    ]
+    puzzle_data = dict(zip(pzq_fields, redis_connection.hmget(pzq_key, pzq_fields)))
+    if puzzle_data.get("puzzle") is None:
+        return None
+
+    puzzle_data["puzzle"] = int(puzzle_data["puzzle"])
+    puzzle_data["table_width"] = int(puzzle_data["table_width"])
+    puzzle_data["table_height"] = int(puzzle_data["table_height"])
+    puzzle_data["permission"] = int(puzzle_data["permission"])
+    puzzle_data["pieces"] = int(puzzle_data["pieces"])
+    if puzzle_data["status"] is not None:
+        puzzle_data["status"] = int(puzzle_data["status"])
+    puzzle_data["puzzle_id"] = puzzle_id
+    return puzzle_data
 
 
 class InternalPuzzlePiecesMovePublishView(MethodView):
@@ -1121,68 +1653,161 @@ class InternalPuzzlePiecesMovePublishView(MethodView):
         r = args.get("r")
         current_app.logger.debug("Test internal piece move")
 
-        pzq_key = "pzq:{puzzle_id}".format(puzzle_id=puzzle_id)
-        pzq_fields = [
-            "puzzle",
-            "table_width",
-            "table_height",
-            "permission",
-            "pieces",
-        ]
-        puzzle_data = dict(zip(pzq_fields, redis_connection.hmget(pzq_key, pzq_fields)))
-        puzzle = puzzle_data.get("puzzle")
-        if puzzle is None:
+        puzzle_data = get_internal_puzzle_data(puzzle_id)
+        if puzzle_data is None:
             err_msg = {
                 "msg": "No puzzle",
             }
             return make_response(json.jsonify(err_msg), 400)
-
-        puzzle_data["puzzle"] = int(puzzle_data["puzzle"])
-        puzzle_data["table_width"] = int(puzzle_data["table_width"])
-        puzzle_data["table_height"] = int(puzzle_data["table_height"])
-        puzzle_data["permission"] = int(puzzle_data["permission"])
-        puzzle_data["pieces"] = int(puzzle_data["pieces"])
-        puzzle_data["puzzle_id"] = puzzle_id
         puzzle = puzzle_data["puzzle"]
-        puzzle = int(puzzle_data["puzzle"])
 
-        if redis_connection.sismember(f"pcfixed:{puzzle}", piece) == 1:
+        if redis_connection.getbit(get_puzzle_key("pcfixed", puzzle), piece) == 1:
             # immovable
             err_msg = {
                 "msg": "piece can't be moved",
             }
             return make_response(json.jsonify(err_msg), 400)
 
-        pzq_current_key = "pzq_current:{puzzle}".format(puzzle=puzzle)
-        pzq_next_key = "pzq_next:{puzzle}".format(puzzle=puzzle)
-        # The attempt_piece_movement bumps the pzq_current by 1
-        pzq_next = redis_connection.incr(pzq_next_key, amount=1)
-        # Set the expire in case it fails to reach expire in attempt_piece_movement.
-        redis_connection.expire(pzq_current_key, piece_move_timeout + 2)
-        redis_connection.expire(pzq_next_key, piece_move_timeout + 2)
-
-        karma = 1
-        karma_change = 0
-        attempt_timestamp = time.time()
-        timeout = attempt_timestamp + piece_move_timeout
-        while attempt_timestamp < timeout:
-            pzq_current = int(redis_connection.get(pzq_current_key) or "0")
-            if pzq_current == pzq_next - 1:
-                (_, _) = attempt_piece_movement(
-                    ip,
-                    user,
-                    puzzle_data,
-                    piece,
-                    x,
-                    y,
-                    r,
-                    karma_change,
-                    karma,
-                )
-                break
+        move = {
+            "ip": ip,
+            "user": user,
+            "puzzle_data": puzzle_data,
+            "piece": piece,
+            "x": x,
+            "y": y,
+            "r": r,
+            "karma_change": 0,
+            "karma": 1,
+            "snapshot": None,
+        }
+        if (
+            current_app.config.get("PIECE_MUTATE_CONCURRENCY", CONCURRENCY_PUZZLE)
+            == CONCURRENCY_PIECE
+        ) and apply_piece_move_concurrently(move):
+            return make_response("", 204)
+
+        sequencer = PuzzleMoveSequencer(
+            redis_connection,
+            puzzle,
+            APPLY_PIECE_MOVE_KINDS,
+            timeout=piece_move_timeout,
+            logger=current_app.logger,
+        )
+        try:
+            sequencer.submit(move)
+        except PuzzleMoveSequencerError as err:
+            current_app.logger.warning(
+                f"Internal piece move on puzzle {puzzle} failed. {err}"
+            )
+            err_msg = {
+                "msg": "Piece movement failed.",
+            }
+            return make_response(json.jsonify(err_msg), 503)
         return make_response("", 204)
 
 
+class InternalPuzzlePiecesBatchMovePublishView(MethodView):
+    """
+    Move multiple pieces in one request.  Used by the enforcer to reject piece
+    moves.  /internal/puzzle/<puzzle_id>/pieces/move/
+    """
+
+    def patch(self, puzzle_id):
+        """
+        args:
+        moves - list of piece, x, y, r
+        """
+        ip = "0"  # No ip is used here for karma
+        # Ignore publish of user data when anonymous user
+        user = ANONYMOUS_USER_ID
+        piece_move_timeout = current_app.config["PIECE_MOVE_TIMEOUT"]
+
+        args = request.get_json(silent=True) or {}
+        moves = args.get("moves")
+        if not isinstance(moves, list) or len(moves) == 0:
+            err_msg = {
+                "msg": "invalid args",
+            }
+            return make_response(json.jsonify(err_msg), 400)
+        try:
+            moves = list(
+                map(
+                    lambda move: dict(
+                        map(lambda k: (k, int(move[k])), ("piece", "x", "y", "r"))
+                    ),
+                    moves,
+                )
+            )
+        except (KeyError, TypeError, ValueError):
+            err_msg = {
+                "msg": "invalid args",
+            }
+            return make_response(json.jsonify(err_msg), 400)
+
+        puzzle_data = get_internal_puzzle_data(puzzle_id)
+        if puzzle_data is None:
+            err_msg = {
+                "msg": "No puzzle",
+            }
+            return make_response(json.jsonify(err_msg), 400)
+        puzzle = puzzle_data["puzzle"]
+
+        with redis_connection.pipeline(transaction=False) as pipe:
+            for move in moves:
+                pipe.getbit(get_puzzle_key("pcfixed", puzzle), move["piece"])
+            immovable = pipe.execute()
+
+        results = [None] * len(moves)
+        batch_index = []
+        batch = []
+        for (index, (move, is_immovable)) in enumerate(zip(moves, immovable)):
+            if is_immovable:
+                results[index] = {
+                    "piece": move["piece"],
+                    "status": 400,
+                    "msg": {"msg": "piece can't be moved"},
+                }
+                continue
+            batch_index.append(index)
+            batch.append(
+                {
+                    "ip": ip,
+                    "user": user,
+                    "puzzle_data": puzzle_data,
+                    "piece": move["piece"],
+                    "x": move["x"],
+                    "y": move["y"],
+                    "r": move["r"],
+                    "karma_change": 0,
+                    "karma": 1,
+                    "snapshot": None,
+                }
+            )
+
+        if batch:
+            sequencer = PuzzleMoveSequencer(
+                redis_connection,
+                puzzle,
+                APPLY_PIECE_MOVE_KINDS,
+                timeout=piece_move_timeout,
+                logger=current_app.logger,
+            )
+            try:
+                applied = sequencer.submit({"moves": batch}, kind=PIECE_MOVE_BATCH)
+            except PuzzleMoveSequencerError as err:
+                current_app.logger.warning(
+                    f"Internal piece moves on puzzle {puzzle} failed. {err}"
+                )
+                err_msg = {
+                    "msg": "Piece movement failed.",
+                }
+                return make_response(json.jsonify(err_msg), 503)
+            for (index, move, (msg, _)) in zip(batch_index, batch, applied):
+                results[index] = get_piece_move_result(move["piece"], msg)
+
+        return make_response(json.jsonify({"moves": results}), 200)
+
+
 class StreamGunicornBase(gunicorn.app.base.BaseApplication):
     def __init__(self, app, options=None):
         self.options = options or {}
@@ -0,0 +1,126 @@
+"""
+Redis key layout for a puzzle
+
+The keys for a puzzle have the puzzle id as the hash tag (pc:{12}:3) so all of
+them are in the same hash slot when the Redis tier is a Redis Cluster.  The
+transactions and Lua scripts that change the pieces of a puzzle only use the
+keys of that puzzle so they can run on the node that has the slot.  These keys
+are for a puzzle:
+
+    pc pcg pcgo pcgm pcfixed pcstacked pcpos pcx pcy pzm pzstamp
+    pzq_current pzq_moves pzq_worker pzq_pending pzq_service
+    pctoken pqtoken t blockedplayers session hotspot timeline score
+    presence pzkeys pzteardown batchpoints enforcerlease
+
+The piece group keys (pcg, pcgo, pcgm) are only created for some of the
+pieces.  Each one is added to the pzkeys:{puzzle} set when it is created so
+the keys for the puzzle can be removed without trying every piece group.  The
+pqtoken keys of the pieces that players have waited on are also added.
+The pzteardown:{puzzle} key is set while they are being removed.
+
+The piece_move_rules script also has the keys of the player (points, ptrate,
+blocked) passed in KEYS so the recent points are changed atomically with the
+rules.  These are not for the puzzle.
+
+The pzq:{puzzle_id} hash of the puzzle data is looked up by the puzzle_id
+before the puzzle is known so it has the puzzle_id as the hash tag.
+
+The pcupdates sorted set of recently updated puzzles is split into
+PCUPDATES_SHARDS sorted sets by the puzzle id (pcupdates:{3}) so it is not a
+single large key on one node.  The shards are read with get_pcupdates.
+
+The migrate_from_2_11_0.py script renames the keys from the previous layout.
+"""
+
+PCUPDATES_SHARDS = 16
+
+PUZZLE_KEY_NAMES = (
+    "pc",
+    "pcg",
+    "pcgo",
+    "pcgm",
+    "pcfixed",
+    "pcstacked",
+    "pcpos",
+    "pcx",
+    "pcy",
+    "pzm",
+    "pzstamp",
+    "pzq_current",
+    "pzq_moves",
+    "pzq_worker",
+    "pzq_pending",
+    "pzq_service",
+    "pctoken",
+    "pqtoken",
+    "blockedplayers",
+    "session",
+    "hotspot",
+    "timeline",
+    "score",
+    "presence",
+    "pzkeys",
+)
+
+
+def get_puzzle_hash_tag(puzzle):
+    return "{" + str(puzzle) + "}"
+
+
+def get_puzzle_key(name, puzzle, *parts):
+    "Key for the puzzle with the puzzle id as the hash tag. ('pc', 12, 3) -> pc:{12}:3"
+    return ":".join([name, get_puzzle_hash_tag(puzzle)] + list(map(str, parts)))
+
+
+def get_puzzle_keys_registry_key(puzzle):
+    return get_puzzle_key("pzkeys", puzzle)
+
+
+def register_puzzle_keys(pipe, puzzle, *keys):
+    "Add the keys that were created for the puzzle to the registry."
+    pipe.sadd(get_puzzle_keys_registry_key(puzzle), *keys)
+
+
+def get_puzzle_teardown_key(puzzle):
+    """
+    Set while the piece data for the puzzle is removed.  A piece mutation that
+    only watches the keys of the pieces it changes also watches this key so it
+    doesn't create piece group keys again after they were removed.
+    """
+    return get_puzzle_key("pzteardown", puzzle)
+
+
+def get_puzzle_data_key(puzzle_id):
+    """
+    The pzq hash with the puzzle data that is looked up by the puzzle_id.  It
+    has the puzzle_id as the hash tag since the puzzle is not known yet.
+    """
+    return get_puzzle_key("pzq", puzzle_id)
+
+
+def get_pcupdates_key(puzzle):
+    "The pcupdates shard for the puzzle."
+    return "pcupdates:" + get_puzzle_hash_tag(int(puzzle) % PCUPDATES_SHARDS)
+
+
+def get_pcupdates_keys():
+    return [
+        "pcupdates:" + get_puzzle_hash_tag(shard) for shard in range(PCUPDATES_SHARDS)
+    ]
+
+
+def get_pcupdates(redis_connection, min="-inf", max="+inf", withscores=False):
+    """
+    Get the puzzles from all the pcupdates shards that were updated between
+    min and max ordered by the last update.
+    """
+    with redis_connection.pipeline(transaction=False) as pipe:
+        for key in get_pcupdates_keys():
+            pipe.zrangebyscore(key, min, max, withscores=True)
+        puzzles = sorted(
+            [item for result in pipe.execute() for item in result],
+            key=lambda item: item[1],
+        )
+    if withscores:
+        return puzzles
+    return [puzzle for (puzzle, _) in puzzles]
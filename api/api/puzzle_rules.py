@@ -0,0 +1,343 @@
+"""
+Puzzle rules that are applied when a player moves a piece.
+
+The PUZZLE_RULES config has the names of the rules that are enabled.  See
+PUZZLE_RULES_HELP_TEXT in bin/create_dot_env.sh for what each one does.
+
+The rules and the limits that go with them are compiled into a PuzzlePolicy
+for each kind of puzzle by the PuzzlePolicyEngine.  The policies are cached so
+a piece move doesn't need to check the config again.  The limits can be
+changed for some puzzles with the PUZZLE_POLICY_OVERRIDES config.  Each
+override is a dict with the "settings" to change and what puzzles it is for
+with the optional "min_pieces", "max_pieces", "status", and "permission"
+keys.  For example, a looser piece move rate for small private puzzles:
+
+    PUZZLE_POLICY_OVERRIDES = [
+        {
+            "max_pieces": 200,
+            "permission": 1,
+            "settings": {"piece_translate_max_count": 60},
+        },
+    ]
+"""
+import json
+from bisect import bisect_right
+from collections import namedtuple
+from types import MappingProxyType
+
+from api.redis_scripts import run_script
+from api.puzzle_keys import get_puzzle_key
+from api.player_session import get_player_session_key
+
+HOUR = 3600  # hour in seconds
+
+MOVES_BEFORE_PENALTY = 12
+HOTSPOT_LIMIT = 10
+HOT_PIECE_MOVEMENT_RATE_TIMEOUT = 10
+PIECE_MOVEMENT_RATE_TIMEOUT = 100
+PIECE_MOVEMENT_RATE_LIMIT = 100
+
+# How many pieces a user can move within this many seconds before being banned.
+# Allow 30 pieces to be moved within 13 seconds. Exceeding that rate would
+# probably imply that it is being scripted.
+PIECE_TRANSLATE_RATE_TIMEOUT = 13
+PIECE_TRANSLATE_MAX_COUNT = 30
+PIECE_TRANSLATE_BAN_TIME_INCR = 60 * 5
+
+# Thresholds for stacked pieces and hotspots that are used by the enforcer.
+SINGLE_STACK_THRESHOLD = 1
+GROUP_STACK_THRESHOLD = 1
+STACK_COST_THRESHOLD = 2
+STACK_LIMIT = 4
+HOTSPOT_EXPIRE = 30
+
+# Rules that are evaluated by the piece_move_rules script before a piece is
+# moved.
+PIECE_MOVE_RULES = (
+    "piece_translate_rate",
+    "puzzle_open_rate",
+    "piece_move_rate",
+    "hot_piece",
+    "hot_spot",
+)
+
+# All the rules that can be set in PUZZLE_RULES.
+RULE_NAMES = PIECE_MOVE_RULES + (
+    "valid_token",
+    "max_stack_pieces",
+    "stack_pieces",
+    "karma_stacked",
+    "karma_piece_group_move_max",
+    "too_active",
+    "nginx_piece_publish_limit",
+)
+
+# The settings of a puzzle policy and the default for each.  These can be
+# changed for some puzzles with PUZZLE_POLICY_OVERRIDES.
+POLICY_SETTINGS = {
+    "piece_translate_rate_timeout": PIECE_TRANSLATE_RATE_TIMEOUT,
+    "piece_translate_max_count": PIECE_TRANSLATE_MAX_COUNT,
+    "puzzle_open_rate_timeout": HOUR,
+    "piece_movement_rate_timeout": PIECE_MOVEMENT_RATE_TIMEOUT,
+    "piece_movement_rate_limit": PIECE_MOVEMENT_RATE_LIMIT,
+    "hot_piece_movement_rate_timeout": HOT_PIECE_MOVEMENT_RATE_TIMEOUT,
+    "moves_before_penalty": MOVES_BEFORE_PENALTY,
+    "hotspot_limit": HOTSPOT_LIMIT,
+    "hotspot_expire": HOTSPOT_EXPIRE,
+    "single_stack_threshold": SINGLE_STACK_THRESHOLD,
+    "group_stack_threshold": GROUP_STACK_THRESHOLD,
+    "stack_cost_threshold": STACK_COST_THRESHOLD,
+    "stack_limit": STACK_LIMIT,
+}
+
+# Settings that are passed to the piece_move_rules script.
+PIECE_MOVE_RULES_SETTINGS = (
+    "piece_translate_rate_timeout",
+    "piece_translate_max_count",
+    "puzzle_open_rate_timeout",
+    "piece_movement_rate_timeout",
+    "piece_movement_rate_limit",
+    "hot_piece_movement_rate_timeout",
+    "moves_before_penalty",
+    "hotspot_limit",
+)
+
+
+def is_rule_enabled(puzzle_rules, name):
+    "The rule is enabled if it is in the puzzle rules or 'all' is."
+    return len({"all", name}.intersection(puzzle_rules)) > 0
+
+
+class PuzzlePolicy(
+    namedtuple(
+        "PuzzlePolicy", ("rules", "piece_move_rules_args") + tuple(POLICY_SETTINGS)
+    )
+):
+    """
+    The enabled rules and the settings for a kind of puzzle.  Created by the
+    PuzzlePolicyEngine and should not be changed.
+    """
+
+    __slots__ = ()
+
+    def is_enabled(self, name):
+        return name in self.rules
+
+    @property
+    def piece_translate_exceeded_reason(self):
+        return "Piece moves exceeded {piece_translate_max_count} in {piece_translate_rate_timeout} seconds".format(
+            piece_translate_max_count=self.piece_translate_max_count,
+            piece_translate_rate_timeout=self.piece_translate_rate_timeout,
+        )
+
+
+class PuzzlePolicyEngine:
+    """
+    Compiles the PUZZLE_RULES and PUZZLE_POLICY_OVERRIDES config into a
+    PuzzlePolicy for each kind of puzzle.  Puzzles with the same status,
+    permission, and that match the same overrides for the number of pieces
+    share the same policy.
+    """
+
+    def __init__(self, config):
+        puzzle_rules = config["PUZZLE_RULES"]
+        self.rules = frozenset(
+            filter(lambda name: is_rule_enabled(puzzle_rules, name), RULE_NAMES)
+        )
+        self.overrides = tuple(config.get("PUZZLE_POLICY_OVERRIDES", ()))
+        for override in self.overrides:
+            unknown = set(override.get("settings", {})).difference(POLICY_SETTINGS)
+            if unknown:
+                raise ValueError(
+                    "Unknown settings in PUZZLE_POLICY_OVERRIDES: {}".format(
+                        ", ".join(sorted(unknown))
+                    )
+                )
+        # The number of pieces where the overrides that match a puzzle change.
+        self.piece_count_bounds = sorted(
+            set(
+                [o["min_pieces"] for o in self.overrides if "min_pieces" in o]
+                + [o["max_pieces"] + 1 for o in self.overrides if "max_pieces" in o]
+            )
+        )
+        self.base_piece_move_rules_args = {
+            "rules": dict(
+                map(
+                    lambda name: (name, True),
+                    filter(lambda name: name in self.rules, PIECE_MOVE_RULES),
+                )
+            ),
+            "initial_karma": config["INITIAL_KARMA"],
+            "karma_points_expire": config["KARMA_POINTS_EXPIRE"],
+            "blockedplayer_expire_timeouts": config["BLOCKEDPLAYER_EXPIRE_TIMEOUTS"],
+        }
+        self.policies = {}
+        self.default = self._compile({})
+
+    def _compile(self, settings):
+        settings = dict(POLICY_SETTINGS, **settings)
+        piece_move_rules_args = dict(self.base_piece_move_rules_args)
+        for name in PIECE_MOVE_RULES_SETTINGS:
+            piece_move_rules_args[name] = settings[name]
+        return PuzzlePolicy(
+            rules=self.rules,
+            piece_move_rules_args=MappingProxyType(piece_move_rules_args),
+            **settings,
+        )
+
+    def _matches(self, override, pieces, status, permission):
+        if "min_pieces" in override and (
+            pieces is None or pieces < override["min_pieces"]
+        ):
+            return False
+        if "max_pieces" in override and (
+            pieces is None or pieces > override["max_pieces"]
+        ):
+            return False
+        if "status" in override and status != override["status"]:
+            return False
+        if "permission" in override and permission != override["permission"]:
+            return False
+        return True
+
+    def get(self, pieces=None, status=None, permission=None):
+        "Get the policy for a puzzle with the number of pieces, status, and permission."
+        if not self.overrides:
+            return self.default
+        piece_count_bound = (
+            None if pieces is None else bisect_right(self.piece_count_bounds, pieces)
+        )
+        key = (piece_count_bound, status, permission)
+        policy = self.policies.get(key)
+        if policy is None:
+            settings = {}
+            for override in self.overrides:
+                if self._matches(override, pieces, status, permission):
+                    settings.update(override.get("settings", {}))
+            policy = self._compile(settings)
+            self.policies[key] = policy
+        return policy
+
+    def get_for_puzzle(self, puzzle_data):
+        "Get the policy for the puzzle data with the pieces, status, and permission."
+        return self.get(
+            pieces=puzzle_data.get("pieces"),
+            status=puzzle_data.get("status"),
+            permission=puzzle_data.get("permission"),
+        )
+
+
+def add_blocked_player(redis_connection, timeouts, puzzle, user, ip, now):
+    """
+    Add the player to the blocked players for the puzzle.  The timeout is
+    longer each time a player with the same ip is blocked.  Returns the time
+    the block expires.  Same as what the piece_move_rules script does when it
+    blocks a player.
+    """
+    blocked_count_ip_key = f"blocked:{ip}"
+    with redis_connection.pipeline(transaction=False) as pipe:
+        pipe.incr(blocked_count_ip_key)
+        pipe.expire(blocked_count_ip_key, timeouts[-1])
+        (blocked_count, _) = pipe.execute()
+    expire_index = max(0, blocked_count - 1)
+    timeout = timeouts[min(expire_index, len(timeouts) - 1)]
+    expires = now + timeout
+    blockedplayers_for_puzzle_key = get_puzzle_key("blockedplayers", puzzle)
+    # Add the player to the blocked players list for the puzzle and
+    # extend the expiration of the key.
+    with redis_connection.pipeline(transaction=False) as pipe:
+        pipe.zadd(blockedplayers_for_puzzle_key, {user: expires})
+        pipe.expire(blockedplayers_for_puzzle_key, timeouts[-1])
+        pipe.execute()
+    return expires
+
+
+def _evaluate_piece_move_rules(redis_connection, policy, puzzle, user, ip, moves, now):
+    "Evaluate the piece moves in a single run of the piece_move_rules script."
+    if not moves:
+        return []
+    args = policy.piece_move_rules_args
+    timeout = args["piece_translate_rate_timeout"]
+    keys = [
+        get_puzzle_key("pcfixed", puzzle),
+        get_player_session_key(puzzle, ip),
+        get_puzzle_key("blockedplayers", puzzle),
+        "points:{user}".format(user=user),
+        "ptrate:{user}:{timestamp}".format(
+            user=user, timestamp=int(now) - (int(now) % timeout)
+        ),
+        f"blocked:{ip}",
+    ]
+    script_moves = []
+    for move in moves:
+        keys.append(get_puzzle_key("pc", puzzle, move["piece"]))
+        keys.append(get_puzzle_key("hotspot", puzzle, user, move["piece"]))
+        script_moves.append(
+            {
+                "piece": move["piece"],
+                "origin_x": str(move["origin_x"]),
+                "origin_y": str(move["origin_y"]),
+                "x": str(move["x"]),
+                "y": str(move["y"]),
+            }
+        )
+    result = json.loads(
+        run_script(
+            redis_connection,
+            "piece_move_rules",
+            keys=keys,
+            args=[
+                json.dumps(
+                    dict(args, puzzle=puzzle, user=user, now=now, moves=script_moves)
+                )
+            ],
+        )
+    )
+    return result["results"]
+
+
+def evaluate_piece_move_rules(
+    redis_connection,
+    policy,
+    puzzle,
+    user,
+    ip,
+    piece,
+    origin_x,
+    origin_y,
+    x,
+    y,
+    now,
+):
+    """
+    Evaluate all the enabled puzzle rules for a piece move. Returns a dict
+    with the status which is one of "ok", "bannedusers", "missing",
+    "immovable", or "blockedplayer". The karma, karma_change, recent_points
+    are also set when the status is "ok" or "blockedplayer". The expires is
+    set when the status is "blockedplayer".
+    """
+    (result,) = _evaluate_piece_move_rules(
+        redis_connection,
+        policy,
+        puzzle,
+        user,
+        ip,
+        [{"piece": piece, "origin_x": origin_x, "origin_y": origin_y, "x": x, "y": y}],
+        now,
+    )
+    return result
+
+
+def evaluate_piece_move_rules_batch(
+    redis_connection, policy, puzzle, user, ip, moves, now
+):
+    """
+    Evaluate the puzzle rules for each piece move in a single run of the
+    script.  The moves are a list of dicts with piece, origin_x, origin_y, x,
+    y.  Returns a list of the results in the same order as the moves.  Each
+    piece move is evaluated after the previous one so the rules apply the same
+    as if they were moved one at a time.
+    """
+    return _evaluate_piece_move_rules(
+        redis_connection, policy, puzzle, user, ip, moves, now
+    )
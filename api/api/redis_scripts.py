@@ -0,0 +1,24 @@
+"""
+Redis Lua scripts
+
+The scripts are in the lua directory next to this file and are called by name
+without the .lua extension.  Each script is registered once and is run with
+EVALSHA on the redis connection or pipeline that is passed in.
+"""
+import os
+
+from api.tools import files_loader
+
+_script_sources = files_loader(os.path.join(os.path.dirname(__file__), "lua"))
+_scripts = {}
+
+
+def run_script(redis_connection, name, keys=[], args=[]):
+    "Run the named script and return the result."
+    script = _scripts.get(name)
+    if script is None:
+        script = redis_connection.register_script(
+            _script_sources["{name}.lua".format(name=name)]
+        )
+        _scripts[name] = script
+    return script(keys=keys, args=args, client=redis_connection)
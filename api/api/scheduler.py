@@ -24,6 +24,8 @@ from api.database import rowify, read_query_file, fetch_query_string
 from api.app import redis_connection, db, make_app
 from api.tools import loadConfig
 from api.tools import deletePieceDataFromRedis
+from api.puzzle_keys import get_puzzle_key, get_pcupdates
+from api.presence import sweep_expired_members
 from api.jobs.timeline_archive import archive_and_clear
 from api.constants import (
     ACTIVE,
@@ -264,9 +266,7 @@ class UpdateModifiedDateOnPuzzle(Task):
 
             self.first_run = False
 
-        puzzles = redis_connection.zrangebyscore(
-            "pcupdates", self.last_update, "+inf", withscores=True
-        )
+        puzzles = get_pcupdates(redis_connection, min=self.last_update, withscores=True)
         self.last_update = int(time()) - 2  # allow some overlap
         for (puzzle, modified) in puzzles:
             puzzle = int(puzzle)
@@ -424,7 +424,7 @@ class UpdatePuzzleStats(Task):
         puzzle = redis_connection.spop("batchpuzzle")
         while puzzle:
             last_batch = redis_connection.zrangebyscore(
-                "timeline:{puzzle}".format(puzzle=puzzle),
+                get_puzzle_key("timeline", puzzle),
                 self.last_run,
                 "+inf",
                 withscores=True,
@@ -438,13 +438,13 @@ class UpdatePuzzleStats(Task):
                 user = int(user)
                 points = int(
                     redis_connection.getset(
-                        "batchpoints:{puzzle}:{user}".format(puzzle=puzzle, user=user),
+                        get_puzzle_key("batchpoints", puzzle, user),
                         value=0,
                     )
                     or "0"
                 )
                 redis_connection.expire(
-                    "batchpoints:{puzzle}:{user}".format(puzzle=puzzle, user=user), DAY
+                    get_puzzle_key("batchpoints", puzzle, user), DAY
                 )
                 if points != 0:
                     result = cur.execute(
@@ -515,7 +515,7 @@ class UpdatePuzzleStats(Task):
                             map(lambda x: [x["player"], x["points"]], result)
                         )
                         redis_connection.zadd(
-                            "score:{puzzle}".format(puzzle=puzzle), user_score
+                            get_puzzle_key("score", puzzle), user_score
                         )
                     (result, _) = rowify(
                         cur.execute(
@@ -534,7 +534,7 @@ class UpdatePuzzleStats(Task):
                             map(lambda x: [x["player"], int(x["timestamp"])], result)
                         )
                         redis_connection.zadd(
-                            "timeline:{puzzle}".format(puzzle=puzzle), user_timestamps
+                            get_puzzle_key("timeline", puzzle), user_timestamps
                         )
                 made_change = True
 
@@ -719,6 +719,26 @@ class SendDigestEmailForAdmin(Task):
         cur.close()
 
 
+class SweepExpiredSortedSetMembers(Task):
+    "Remove the expired members from the sorted sets that have timestamp scores"
+    interval = 10 * MINUTE
+
+    def __init__(self, id=None):
+        super().__init__(id, __class__.__name__)
+
+    def do_task(self):
+        super().do_task()
+
+        removed = sweep_expired_members(
+            redis_connection, int(time()), current_app.config["TOKEN_EXPIRE_TIMEOUT"]
+        )
+        if removed:
+            current_app.logger.info(
+                "Removed {0} expired sorted set members".format(removed)
+            )
+            self.log_task()
+
+
 task_registry = [
     AutoRebuildCompletedPuzzle,
     BumpMinimumDotsForPlayers,
@@ -728,6 +748,7 @@ task_registry = [
     UpdatePuzzleQueue,
     AutoApproveUserNames,
     SendDigestEmailForAdmin,
+    SweepExpiredSortedSetMembers,
 ]
 
 
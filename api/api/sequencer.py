@@ -0,0 +1,283 @@
+"""
+Per puzzle piece move sequencer.
+
+Piece moves on a puzzle need to be applied one at a time and in the order they
+were submitted. Each move is appended to the 'pzq_moves:{puzzle}' list. The
+publish worker that holds the 'pzq_worker:{puzzle}' lease is the single writer
+for that puzzle; it applies the queued moves in FIFO order and pushes each
+result to a 'pzq_result:{move_id}' list. The request that submitted the move
+is blocked on that list and is woken as soon as the move has been applied.
+
+The worker is one of the requests that submitted a move. It only applies the
+queued moves until its own move has been applied or its timeout has passed and
+then releases the lease so it can respond. The request of the next queued move
+is woken with a handoff on its result list so it takes over the lease. The
+lease is extended before each move is applied only if it is still held by the
+worker. A worker that lost it stops applying moves.
+
+If the worker holding the lease goes away, the lease expires and one of the
+waiting requests takes it over.
+
+Each queued move has the kind of move it is so the worker applies it with the
+apply function for that kind no matter which request submitted it.  Every
+sequencer for a puzzle needs to have the apply functions for all the kinds of
+moves that can be queued on it.
+
+A move can be submitted with a coalesce key (the player and piece for
+example). The latest move id for each coalesce key is kept in the
+'pzq_pending:{puzzle}' hash. A queued move that has been superseded by a newer
+move with the same coalesce key is skipped instead of being applied.
+
+The time it took to apply the most recent moves is kept in the
+'pzq_service:{puzzle}' list so the queue wait time can be estimated before a
+player is allowed to move a piece.
+"""
+
+import json
+import time
+import logging
+
+import nanoid
+
+from api.puzzle_keys import get_puzzle_key
+from api.redis_scripts import run_script
+
+# Wait for results in slices of this many seconds so a request can take over
+# the lease if the current worker stopped processing moves.
+WAIT_SLICE = 1
+
+# Number of recent service times to keep for each puzzle.
+SERVICE_TIME_SAMPLES = 20
+SERVICE_TIME_EXPIRE = 60
+
+# The kind of move when the sequencer only has one apply function.
+MOVE_KIND = "move"
+
+# Pushed to the result list of the next queued move when the worker releases
+# the lease so the request for it takes over.
+HANDOFF = {"handoff": True}
+
+
+class PuzzleMoveSequencerError(Exception):
+    """
+    Error with applying a piece move in the sequencer.
+    """
+
+
+class PuzzleMoveSequencerTimeout(PuzzleMoveSequencerError):
+    """
+    The piece move was not applied before the timeout.  It has been removed
+    from the queue.
+    """
+
+
+def get_moves_key(puzzle):
+    return get_puzzle_key("pzq_moves", puzzle)
+
+
+def get_worker_key(puzzle):
+    return get_puzzle_key("pzq_worker", puzzle)
+
+
+def get_result_key(move_id):
+    return "pzq_result:{move_id}".format(move_id=move_id)
+
+
+def get_pending_key(puzzle):
+    return get_puzzle_key("pzq_pending", puzzle)
+
+
+def get_service_time_key(puzzle):
+    return get_puzzle_key("pzq_service", puzzle)
+
+
+class PuzzleMoveSequencer:
+    """
+    Submit piece moves for a puzzle and apply them in order with the
+    apply_move function. The apply_move function is given the move dict that
+    was submitted and should return a value that can be JSON encoded.  It can
+    also be a dict of the apply functions for each kind of move.
+    """
+
+    def __init__(self, redis_connection, puzzle, apply_move, timeout=4, logger=None):
+        self.redis_connection = redis_connection
+        self.puzzle = puzzle
+        self.apply_moves = (
+            apply_move if isinstance(apply_move, dict) else {MOVE_KIND: apply_move}
+        )
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.worker_id = nanoid.generate(size=8)
+        self.moves_key = get_moves_key(puzzle)
+        self.worker_key = get_worker_key(puzzle)
+        self.pending_key = get_pending_key(puzzle)
+        # Expire keys a little after the timeout in case nothing is left to
+        # clean them up.
+        self.key_expire = timeout + 2
+
+    def submit(self, move, coalesce_key=None, kind=MOVE_KIND):
+        """
+        Append the move to the puzzle queue and return the result of applying
+        it with the apply function for the kind. Raises
+        PuzzleMoveSequencerTimeout if the move wasn't applied in time. Returns
+        None if the move was superseded by a newer move with the same coalesce
+        key before it was applied.
+        """
+        if kind not in self.apply_moves:
+            raise PuzzleMoveSequencerError(f"No apply function for {kind} moves")
+        move_id = nanoid.generate(size=12)
+        queued = {"id": move_id, "kind": kind, "move": move}
+        if coalesce_key is not None:
+            queued["coalesce_key"] = coalesce_key
+        item = json.dumps(queued)
+        with self.redis_connection.pipeline(transaction=False) as pipe:
+            if coalesce_key is not None:
+                pipe.hset(self.pending_key, coalesce_key, move_id)
+                pipe.expire(self.pending_key, self.key_expire)
+            pipe.rpush(self.moves_key, item)
+            pipe.expire(self.moves_key, self.key_expire)
+            pipe.execute()
+
+        deadline = time.time() + self.timeout
+        result = self._wait_for_result(move_id, deadline)
+        if result is None:
+            removed = self.redis_connection.lrem(self.moves_key, 1, item)
+            if removed:
+                raise PuzzleMoveSequencerTimeout(
+                    f"Move {move_id} on puzzle {self.puzzle} timed out"
+                )
+            # The move is being applied right now; give it a moment to finish.
+            result = self._wait_for_result(move_id, time.time() + WAIT_SLICE)
+            if result is None:
+                raise PuzzleMoveSequencerTimeout(
+                    f"Move {move_id} on puzzle {self.puzzle} timed out while being applied"
+                )
+
+        if "error" in result:
+            raise PuzzleMoveSequencerError(result["error"])
+        return result.get("result")
+
+    def _wait_for_result(self, move_id, deadline):
+        "Become the worker if no other worker is active or block until the result is ready."
+        result_key = get_result_key(move_id)
+        while True:
+            item = self.redis_connection.lpop(result_key)
+            if item is None and self._acquire():
+                self._drain(move_id, deadline)
+                item = self.redis_connection.lpop(result_key)
+            if item is None:
+                if time.time() >= deadline:
+                    return None
+                item = self.redis_connection.blpop(result_key, timeout=WAIT_SLICE)
+                if item is None:
+                    continue
+                (_, item) = item
+            result = json.loads(item)
+            if result != HANDOFF:
+                return result
+
+    def _acquire(self):
+        return bool(
+            self.redis_connection.set(
+                self.worker_key, self.worker_id, nx=True, ex=self.key_expire
+            )
+        )
+
+    def _renew(self):
+        "Extend the worker lease only if it is still held by this worker."
+        return (
+            run_script(
+                self.redis_connection,
+                "renew_pzq_worker",
+                keys=[self.worker_key],
+                args=[self.worker_id, self.key_expire * 1000],
+            )
+            == 1
+        )
+
+    def _release(self):
+        "Remove the worker lease only if it is still held by this worker."
+        with self.redis_connection.pipeline(transaction=True) as pipe:
+            pipe.watch(self.worker_key)
+            if pipe.get(self.worker_key) == self.worker_id:
+                pipe.multi()
+                pipe.delete(self.worker_key)
+                pipe.execute()
+            else:
+                pipe.unwatch()
+
+    def _drain(self, move_id, deadline):
+        """
+        Apply the queued moves for the puzzle in order while holding the
+        worker lease until the move with move_id has been applied or the
+        deadline has passed. Then release the lease and hand off the rest of
+        the queue to the request of the next queued move.
+        """
+        try:
+            while time.time() < deadline and self._renew():
+                item = self.redis_connection.lpop(self.moves_key)
+                if item is None:
+                    break
+                queued = json.loads(item)
+                self._apply(queued)
+                if queued["id"] == move_id:
+                    break
+        finally:
+            self._release()
+
+        item = self.redis_connection.lindex(self.moves_key, 0)
+        if item is not None:
+            result_key = get_result_key(json.loads(item)["id"])
+            with self.redis_connection.pipeline(transaction=False) as pipe:
+                pipe.rpush(result_key, json.dumps(HANDOFF))
+                pipe.expire(result_key, self.key_expire)
+                pipe.execute()
+
+    def _is_superseded(self, queued):
+        "The move is superseded if a newer move with the same coalesce key has been submitted."
+        coalesce_key = queued.get("coalesce_key")
+        if coalesce_key is None:
+            return False
+        latest_move_id = self.redis_connection.hget(self.pending_key, coalesce_key)
+        if latest_move_id is None or latest_move_id == queued["id"]:
+            self.redis_connection.hdel(self.pending_key, coalesce_key)
+            return False
+        return True
+
+    def _apply(self, queued):
+        if self._is_superseded(queued):
+            self.logger.debug(
+                f"Skipping move {queued['id']} on puzzle {self.puzzle} since it has been superseded"
+            )
+            result_key = get_result_key(queued["id"])
+            with self.redis_connection.pipeline(transaction=False) as pipe:
+                pipe.rpush(result_key, json.dumps({"superseded": True}))
+                pipe.expire(result_key, self.key_expire)
+                pipe.execute()
+            return
+
+        start = time.perf_counter()
+        try:
+            # Moves queued before the kind was added are all the default kind.
+            kind = queued.get("kind", MOVE_KIND)
+            apply_move = self.apply_moves.get(kind)
+            if apply_move is None:
+                raise PuzzleMoveSequencerError(f"No apply function for {kind} moves")
+            envelope = {"result": apply_move(queued["move"])}
+        except Exception as err:
+            self.logger.warning(
+                f"Failed to apply move {queued['id']} on puzzle {self.puzzle}: {err}"
+            )
+            envelope = {"error": str(err)}
+        service_time = time.perf_counter() - start
+
+        result_key = get_result_key(queued["id"])
+        service_time_key = get_service_time_key(self.puzzle)
+        with self.redis_connection.pipeline(transaction=False) as pipe:
+            pipe.rpush(result_key, json.dumps(envelope))
+            pipe.expire(result_key, self.key_expire)
+            pipe.lpush(service_time_key, round(service_time, 4))
+            pipe.ltrim(service_time_key, 0, SERVICE_TIME_SAMPLES - 1)
+            pipe.expire(service_time_key, SERVICE_TIME_EXPIRE)
+            pipe.execute()
@@ -5,12 +5,13 @@ import time
 from api.app import db, redis_connection
 from api.user import user_id_from_ip, user_not_banned
 from api.database import fetch_query_string, rowify
+from api.puzzle_keys import get_puzzle_key
+from api.presence import count_active_players
 
 encoder = json.JSONEncoder(indent=2, sort_keys=True)
 
 DAY = 24 * 60 * 60
 ACTIVE_RANGE = 14 * DAY
-ACTIVE_PLAYER_RANGE = 5 * 60
 
 
 class PlayerRanksView(MethodView):
@@ -97,10 +98,10 @@ class PuzzleStatsView(MethodView):
         now = int(time.time())
 
         timeline = redis_connection.zrevrange(
-            "timeline:{puzzle}".format(puzzle=puzzle), 0, -1, withscores=True
+            get_puzzle_key("timeline", puzzle), 0, -1, withscores=True
         )
         score_puzzle = redis_connection.zrange(
-            "score:{puzzle}".format(puzzle=puzzle), 0, -1, withscores=True
+            get_puzzle_key("score", puzzle), 0, -1, withscores=True
         )
         user_score = dict(score_puzzle)
         user_rank = {}
@@ -148,12 +149,7 @@ class PuzzleActiveCountView(MethodView):
         status = result[0].get("status")
         now = int(time.time())
 
-        count = (
-            redis_connection.zcount(
-                "timeline:{puzzle}".format(puzzle=puzzle), now - 5 * 60, "+inf"
-            )
-            or 0
-        )
+        count = count_active_players(redis_connection, now, puzzle=puzzle)
 
         player_active_count = {"now": now, "count": count}
 
@@ -167,8 +163,7 @@ class PlayerStatsView(MethodView):
     def get(self):
         ""
         now = int(time.time())
-        since = now - ACTIVE_PLAYER_RANGE
-        total_active_player_count = redis_connection.zcount("timeline", since, "+inf")
+        total_active_player_count = count_active_players(redis_connection, now)
         return make_response(
             json.jsonify({"totalActivePlayers": total_active_player_count}), 200
         )
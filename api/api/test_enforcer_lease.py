@@ -0,0 +1,73 @@
+import unittest
+
+from api.helper_tests import APITestCase
+from api.app import redis_connection
+from api.enforcer_lease import (
+    heartbeat_instance,
+    remove_instance,
+    get_preferred_instance,
+    acquire_lease,
+    renew_lease,
+    release_lease,
+    get_enforcer_lease_key,
+    INSTANCE_TIMEOUT,
+)
+
+
+class TestEnforcerLease(APITestCase):
+    ""
+
+    def test_one_owner(self):
+        "Only one instance has the lease on a puzzle until it is released"
+        with self.app.app_context():
+            self.assertTrue(acquire_lease(redis_connection, 1, "a"))
+            self.assertTrue(acquire_lease(redis_connection, 1, "a"))
+            self.assertFalse(acquire_lease(redis_connection, 1, "b"))
+            self.assertTrue(renew_lease(redis_connection, 1, "a"))
+            self.assertFalse(renew_lease(redis_connection, 1, "b"))
+
+            release_lease(redis_connection, 1, "b")
+            self.assertEqual("a", redis_connection.get(get_enforcer_lease_key(1)))
+            release_lease(redis_connection, 1, "a")
+            self.assertFalse(renew_lease(redis_connection, 1, "a"))
+            self.assertTrue(acquire_lease(redis_connection, 1, "b"))
+
+    def test_expired_lease(self):
+        "Another instance takes over the puzzle when the lease expires"
+        with self.app.app_context():
+            self.assertTrue(acquire_lease(redis_connection, 1, "a"))
+            redis_connection.delete(get_enforcer_lease_key(1))
+            self.assertTrue(acquire_lease(redis_connection, 1, "b"))
+            self.assertFalse(renew_lease(redis_connection, 1, "a"))
+
+    def test_heartbeat_instance(self):
+        "Instances without a recent heartbeat are removed"
+        with self.app.app_context():
+            now = 10000
+            heartbeat_instance(redis_connection, "a", now - INSTANCE_TIMEOUT - 1)
+            heartbeat_instance(redis_connection, "b", now - 1)
+            self.assertEqual(
+                ["b", "c"], sorted(heartbeat_instance(redis_connection, "c", now))
+            )
+            remove_instance(redis_connection, "b")
+            self.assertEqual(["c"], heartbeat_instance(redis_connection, "c", now))
+
+    def test_preferred_instance(self):
+        "Only the puzzles of an instance that leaves are moved"
+        instances = ["a", "b", "c"]
+        puzzles = range(1, 100)
+        preferred = dict(
+            [(puzzle, get_preferred_instance(puzzle, instances)) for puzzle in puzzles]
+        )
+        self.assertEqual(set(instances), set(preferred.values()))
+        for puzzle in puzzles:
+            instance = get_preferred_instance(puzzle, ["a", "c"])
+            if preferred[puzzle] != "b":
+                self.assertEqual(preferred[puzzle], instance)
+            else:
+                self.assertIn(instance, ("a", "c"))
+        self.assertIsNone(get_preferred_instance(1, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
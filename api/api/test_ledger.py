@@ -0,0 +1,45 @@
+import unittest
+
+from api.helper_tests import APITestCase
+from api.app import redis_connection
+from api.ledger import ScoreLedger
+
+
+class TestScoreLedger(APITestCase):
+    ""
+
+    def test_flush_coalesces_timestamps(self):
+        "Only the latest timestamp for a member is set"
+        with self.app.app_context():
+            score_ledger = ScoreLedger(redis_connection, flush_interval=60)
+            score_ledger.zadd("timeline", 2, 100)
+            score_ledger.zadd("timeline", 2, 103)
+            score_ledger.zadd("timeline", 2, 101)
+            score_ledger.zadd("timeline", 3, 100)
+            self.assertEqual(0, redis_connection.zcard("timeline"))
+            score_ledger.flush()
+            self.assertEqual(
+                [("2", 103.0), ("3", 100.0)],
+                sorted(redis_connection.zrange("timeline", 0, -1, withscores=True)),
+            )
+
+    def test_flush_pfadd(self):
+        "Members are added to the HyperLogLog and the expire is set"
+        with self.app.app_context():
+            score_ledger = ScoreLedger(redis_connection, flush_interval=60)
+            score_ledger.pfadd("presence:{1}:3", 2, expire=360)
+            score_ledger.pfadd("presence:{1}:3", 2, 3, expire=360)
+            score_ledger.flush()
+            self.assertEqual(2, redis_connection.pfcount("presence:{1}:3"))
+            self.assertLess(0, redis_connection.ttl("presence:{1}:3"))
+
+    def test_no_flush_interval(self):
+        "Updates are written right away when the flush interval is 0"
+        with self.app.app_context():
+            score_ledger = ScoreLedger(redis_connection, flush_interval=0)
+            score_ledger.zadd("timeline", 2, 100)
+            self.assertEqual(100, redis_connection.zscore("timeline", 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,509 @@
+import unittest
+
+from redis.exceptions import WatchError
+
+from api.helper_tests import APITestCase
+from api.app import redis_connection
+from api.piece_positions import pack_piece_positions, unpack_piece_positions
+from api.piece_status import get_status_pieces
+from api.puzzle_keys import get_puzzle_key, get_puzzle_teardown_key
+from api.tools import get_redis_connection, deletePieceDataFromRedis
+from api.piece_mutate import (
+    PieceMutateProcess,
+    PieceMutateScript,
+    PieceMutateError,
+    CONCURRENCY_PIECE,
+    GROUP_POSITIONS_RELATIVE,
+    get_piece_group_members,
+    resolve_piece_group_positions,
+)
+
+
+class TestPieceMutateProcessPieceConcurrency(APITestCase):
+    ""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            redis_connection.hmset("pc:{1}:1", {"x": 0, "y": 0, "r": 0, "2": "64,0"})
+            redis_connection.hmset(
+                "pc:{1}:2", {"x": 200, "y": 200, "r": 0, "1": "-64,0", "3": "0,64"}
+            )
+            redis_connection.hmset(
+                "pc:{1}:3", {"x": 800, "y": 800, "r": 0, "2": "0,-64"}
+            )
+
+    def _piece_mutate_process(self, piece, x, y):
+        return PieceMutateProcess(
+            redis_connection,
+            2,
+            1,
+            piece,
+            x,
+            y,
+            0,
+            piece_count=3,
+            concurrency=CONCURRENCY_PIECE,
+        )
+
+    def test_move(self):
+        "Move a piece that isn't near an adjacent piece"
+        with self.app.app_context():
+            (msg, status) = self._piece_mutate_process(1, 500, 10).start()
+            self.assertEqual("moved", status)
+            self.assertEqual("\n:1:500:10:::", msg)
+            self.assertEqual(
+                ["500", "10"], redis_connection.hmget("pc:{1}:1", "x", "y")
+            )
+            self.assertIsNone(redis_connection.get("pzm:{1}"))
+
+    def test_join(self):
+        "Join a piece to the adjacent piece"
+        with self.app.app_context():
+            (msg, status) = self._piece_mutate_process(1, 130, 205).start()
+            self.assertEqual("joined", status)
+            self.assertEqual(
+                ["136", "200", "2"], redis_connection.hmget("pc:{1}:1", "x", "y", "g")
+            )
+            self.assertEqual("2", redis_connection.hget("pc:{1}:2", "g"))
+            self.assertEqual({"1", "2"}, redis_connection.smembers("pcg:{1}:2"))
+
+    def test_join_completes_puzzle(self):
+        "Joining to an immovable piece can complete the puzzle"
+        with self.app.app_context():
+            redis_connection.setbit("pcfixed:{1}", 2, 1)
+            redis_connection.setbit("pcfixed:{1}", 3, 1)
+            (msg, status) = self._piece_mutate_process(1, 130, 205).start()
+            self.assertEqual("completed", status)
+
+    def test_conflict_with_adjacent_piece(self):
+        "A change to an adjacent piece while mutating is a conflict"
+        with self.app.app_context():
+            piece_mutate_process = self._piece_mutate_process(1, 130, 205)
+            set_can_join_adjacent_piece = piece_mutate_process._set_can_join_adjacent_piece
+
+            def move_adjacent_piece():
+                redis_connection.hmset("pc:{1}:2", {"x": 300})
+                set_can_join_adjacent_piece()
+
+            piece_mutate_process._set_can_join_adjacent_piece = move_adjacent_piece
+            with self.assertRaises((PieceMutateError, WatchError)):
+                piece_mutate_process.start()
+            self.assertEqual(["0", "0"], redis_connection.hmget("pc:{1}:1", "x", "y"))
+
+    def test_conflict_with_teardown(self):
+        "Starting to remove the piece data while mutating is a conflict"
+        with self.app.app_context():
+            piece_mutate_process = self._piece_mutate_process(1, 130, 205)
+            set_can_join_adjacent_piece = piece_mutate_process._set_can_join_adjacent_piece
+
+            def start_teardown():
+                # The piece group keys that are registered are read after this
+                # so a piece group created by the join would not be removed.
+                redis_connection.set(get_puzzle_teardown_key(1), 1)
+                set_can_join_adjacent_piece()
+
+            piece_mutate_process._set_can_join_adjacent_piece = start_teardown
+            with self.assertRaises((PieceMutateError, WatchError)):
+                piece_mutate_process.start()
+            self.assertEqual([], redis_connection.keys("pcg*"))
+
+            with self.assertRaises(PieceMutateError):
+                self._piece_mutate_process(1, 130, 205).start()
+            self.assertEqual([], redis_connection.keys("pcg*"))
+
+    def test_no_conflict_with_other_piece(self):
+        "A change to a piece that is not involved is not a conflict"
+        with self.app.app_context():
+            piece_mutate_process = self._piece_mutate_process(1, 500, 10)
+            set_can_join_adjacent_piece = piece_mutate_process._set_can_join_adjacent_piece
+
+            def move_other_piece():
+                redis_connection.hmset("pc:{1}:3", {"x": 300})
+                set_can_join_adjacent_piece()
+
+            piece_mutate_process._set_can_join_adjacent_piece = move_other_piece
+            (msg, status) = piece_mutate_process.start()
+            self.assertEqual("moved", status)
+
+
+class TestPieceMutateScript(APITestCase):
+    "The piece_mutate script should do the same as the PieceMutateProcess"
+
+    def setUp(self):
+        super().setUp()
+        self.publish_messages = []
+
+    def set_pieces(self, pieces=None):
+        redis_connection.flushdb()
+        # Pieces 1 and 2 are grouped. Piece 3 is adjacent to piece 2 and piece
+        # 4 is immovable and adjacent to piece 3.
+        redis_connection.hmset(
+            "pc:{1}:1", {"x": 0, "y": 0, "r": 0, "g": 1, "2": "64,0"}
+        )
+        redis_connection.hmset(
+            "pc:{1}:2", {"x": 64, "y": 0, "r": 0, "g": 1, "1": "-64,0", "3": "0,64"}
+        )
+        redis_connection.hmset(
+            "pc:{1}:3", {"x": 500, "y": 500, "r": 0, "2": "0,-64", "4": "64,0"}
+        )
+        redis_connection.hmset("pc:{1}:4", {"x": 900, "y": 900, "r": 0, "3": "-64,0"})
+        redis_connection.sadd("pcg:{1}:1", 1, 2)
+        redis_connection.setbit("pcfixed:{1}", 4, 1)
+        for (piece, properties) in (pieces or {}).items():
+            redis_connection.hmset(get_puzzle_key("pc", 1, piece), properties)
+        redis_connection.set(
+            "pcpos:{1}",
+            pack_piece_positions(
+                [
+                    dict(
+                        redis_connection.hgetall(get_puzzle_key("pc", 1, piece)),
+                        id=piece,
+                    )
+                    for piece in range(1, 5)
+                ]
+            ),
+        )
+
+    def get_pieces(self):
+        pieces = {}
+        for key in sorted(redis_connection.keys("pc*")):
+            if key == "pcpos:{1}":
+                pieces[key] = unpack_piece_positions(
+                    get_redis_connection(self.app.config, decode_responses=False).get(
+                        key
+                    ),
+                    range(1, 5),
+                )
+            elif redis_connection.type(key) == "hash":
+                pieces[key] = redis_connection.hgetall(key)
+            elif redis_connection.type(key) == "string":
+                pieces[key] = get_status_pieces(redis_connection, key)
+            else:
+                pieces[key] = redis_connection.smembers(key)
+        return pieces
+
+    def assert_same_as_process(self, piece, x, y, pieces=None):
+        results = []
+        for piece_mutate_class in (PieceMutateProcess, PieceMutateScript):
+            self.set_pieces(pieces=pieces)
+            pubsub = redis_connection.pubsub()
+            pubsub.subscribe("enforcer_piece_group_translate:1")
+            pubsub.get_message(timeout=1)
+            piece_mutate_process = piece_mutate_class(
+                redis_connection, 2, 1, piece, x, y, 0, piece_count=4
+            )
+            (msg, status) = piece_mutate_process.start()
+            message = pubsub.get_message(timeout=1)
+            pubsub.close()
+            results.append(
+                (
+                    sorted(msg.split("\n")),
+                    status,
+                    self.get_pieces(),
+                    sorted(message["data"].split("_")) if message else None,
+                    piece_mutate_process.all_other_pieces_in_piece_group,
+                )
+            )
+        self.assertEqual(results[0], results[1])
+        pieces = results[1][2]
+        for piece, packed in zip(range(1, 5), pieces["pcpos:{1}"]):
+            self.assertEqual(
+                [
+                    pieces[get_puzzle_key("pc", 1, piece)].get(x)
+                    for x in ("x", "y", "r", "g")
+                ],
+                [packed[x] for x in ("x", "y", "r", "g")],
+            )
+        return results[1]
+
+    def test_move_group(self):
+        with self.app.app_context():
+            (msg, status, pieces, message, grouped) = self.assert_same_as_process(
+                1, 100, 100
+            )
+            self.assertEqual("moved", status)
+            self.assertEqual({2}, grouped)
+            self.assertEqual(["2:2:164:100"], message)
+
+    def test_move_piece(self):
+        with self.app.app_context():
+            (msg, status, pieces, message, grouped) = self.assert_same_as_process(
+                3, 300, 310
+            )
+            self.assertEqual("moved", status)
+            self.assertIsNone(message)
+
+    def test_join_group(self):
+        with self.app.app_context():
+            (msg, status, pieces, message, grouped) = self.assert_same_as_process(
+                3, 70, 60
+            )
+            self.assertEqual("joined", status)
+            self.assertEqual("1", pieces["pc:{1}:3"]["g"])
+
+    def test_join_group_to_piece(self):
+        with self.app.app_context():
+            (msg, status, pieces, message, grouped) = self.assert_same_as_process(
+                2, 505, 440
+            )
+            self.assertEqual("joined", status)
+            self.assertEqual({"1", "2", "3"}, pieces["pcg:{1}:3"])
+
+    def test_join_immovable(self):
+        with self.app.app_context():
+            (msg, status, pieces, message, grouped) = self.assert_same_as_process(
+                3, 830, 910
+            )
+            self.assertEqual("joined", status)
+            self.assertEqual({3, 4}, pieces["pcfixed:{1}"])
+
+    def test_join_multiple_adjacent(self):
+        "All adjacent pieces within the tolerance are joined in the same move"
+        with self.app.app_context():
+            (msg, status, pieces, message, grouped) = self.assert_same_as_process(
+                3, 66, 62, pieces={4: {"x": 128, "y": 64}}
+            )
+            self.assertEqual("completed", status)
+            self.assertEqual({"1", "2", "3", "4"}, pieces["pcg:{1}:1"])
+            self.assertEqual("1", pieces["pc:{1}:4"]["g"])
+            self.assertEqual({1, 2, 3, 4}, pieces["pcfixed:{1}"])
+
+    def test_join_adjacent_to_other_grouped_piece(self):
+        "Pieces adjacent to the other pieces in the piece group are also joined"
+        with self.app.app_context():
+            (msg, status, pieces, message, grouped) = self.assert_same_as_process(
+                2,
+                505,
+                440,
+                pieces={
+                    1: {"4": "0,64"},
+                    3: {"4": "-64,0"},
+                    4: {"x": 436, "y": 500, "1": "0,-64", "3": "64,0"},
+                },
+            )
+            self.assertEqual("completed", status)
+            self.assertEqual({"1", "2", "3", "4"}, pieces["pcg:{1}:3"])
+            self.assertEqual("3", pieces["pc:{1}:4"]["g"])
+            self.assertEqual({1, 2, 3, 4}, pieces["pcfixed:{1}"])
+
+
+class TestPieceMutateProcessRelativeGroupPositions(APITestCase):
+    ""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            # Pieces 1 and 2 are grouped. Piece 3 is adjacent to piece 2.
+            redis_connection.hmset(
+                "pc:{1}:1", {"x": 0, "y": 0, "r": 0, "g": 1, "2": "64,0"}
+            )
+            redis_connection.hmset(
+                "pc:{1}:2",
+                {"x": 64, "y": 0, "r": 0, "g": 1, "1": "-64,0", "3": "0,64"},
+            )
+            redis_connection.hmset(
+                "pc:{1}:3", {"x": 500, "y": 500, "r": 0, "2": "0,-64"}
+            )
+            redis_connection.sadd("pcg:{1}:1", 1, 2)
+
+    def _piece_mutate_process(self, piece, x, y):
+        return PieceMutateProcess(
+            redis_connection,
+            2,
+            1,
+            piece,
+            x,
+            y,
+            0,
+            piece_count=3,
+            group_positions=GROUP_POSITIONS_RELATIVE,
+        )
+
+    def test_move_group(self):
+        "Moving a piece group only moves the origin of the piece group"
+        with self.app.app_context():
+            pubsub = redis_connection.pubsub()
+            pubsub.subscribe("enforcer_piece_group_move:1")
+            pubsub.get_message(timeout=1)
+            (msg, status) = self._piece_mutate_process(1, 100, 110).start()
+            message = pubsub.get_message(timeout=1)
+            pubsub.close()
+            self.assertEqual("moved", status)
+            self.assertEqual("\n:1:100:110::1::100:110", msg)
+            self.assertEqual("2:1:100:110", message["data"])
+            self.assertEqual(["0", "0"], redis_connection.hmget("pc:{1}:1", "x", "y"))
+            self.assertEqual(["64", "0"], redis_connection.hmget("pc:{1}:2", "x", "y"))
+            self.assertEqual(
+                ["100", "110"], redis_connection.hmget("pcgo:{1}:1", "x", "y")
+            )
+
+            (msg, status) = self._piece_mutate_process(2, 174, 120).start()
+            self.assertEqual("\n:2:174:120::1::10:10", msg)
+            self.assertEqual(
+                ["110", "120"], redis_connection.hmget("pcgo:{1}:1", "x", "y")
+            )
+
+    def test_join(self):
+        "Joining a piece to a piece group stores it relative to the origin"
+        with self.app.app_context():
+            self._piece_mutate_process(1, 100, 110).start()
+            (msg, status) = self._piece_mutate_process(3, 160, 178).start()
+            self.assertEqual("joined", status)
+            self.assertEqual(
+                ["64", "64", "1"], redis_connection.hmget("pc:{1}:3", "x", "y", "g")
+            )
+            self.assertEqual({"1", "2", "3"}, redis_connection.smembers("pcg:{1}:1"))
+            self.assertEqual(
+                [{"x": "164", "y": "174", "g": "1"}],
+                resolve_piece_group_positions(
+                    redis_connection, 1, [{"x": "64", "y": "64", "g": "1"}]
+                ),
+            )
+
+    def test_merge_piece_groups(self):
+        "The smaller piece group is merged into the larger one"
+        with self.app.app_context():
+            for piece in (3, 4, 5):
+                redis_connection.hset(get_puzzle_key("pc", 1, piece), "g", 3)
+            redis_connection.sadd("pcg:{1}:3", 3, 4, 5)
+            (msg, status) = self._piece_mutate_process(2, 505, 440).start()
+            self.assertEqual("joined", status)
+            self.assertEqual(
+                "\n:2:500:436::1::436:436\n:2::::3:::1",
+                msg,
+            )
+            self.assertEqual(
+                {"p": "3", "x": "436", "y": "436"},
+                redis_connection.hgetall("pcgo:{1}:1"),
+            )
+            self.assertEqual(
+                {"x": "0", "y": "0", "n": "5"}, redis_connection.hgetall("pcgo:{1}:3")
+            )
+            self.assertEqual({"1"}, redis_connection.smembers("pcgm:{1}:3"))
+            # The pieces in the merged piece group are not changed
+            self.assertEqual(
+                ["0", "0", "1"], redis_connection.hmget("pc:{1}:1", "x", "y", "g")
+            )
+            self.assertEqual(
+                {1, 2, 3, 4, 5}, get_piece_group_members(redis_connection, 1, 3)
+            )
+            self.assertEqual(
+                [{"x": "436", "y": "436", "g": "3"}],
+                resolve_piece_group_positions(
+                    redis_connection, 1, [{"x": "0", "y": "0", "g": "1"}]
+                ),
+            )
+
+    def test_delete_registered_piece_group_keys(self):
+        "The piece group keys that are created are deleted with the pieces"
+        with self.app.app_context():
+            redis_connection.sadd("pzkeys:{1}", "pcg:{1}:1")
+            for piece in (3, 4, 5):
+                redis_connection.hset(get_puzzle_key("pc", 1, piece), "g", 3)
+            redis_connection.sadd("pcg:{1}:3", 3, 4, 5)
+            self._piece_mutate_process(2, 505, 440).start()
+            self.assertEqual(
+                {"pcg:{1}:1", "pcgo:{1}:1", "pcg:{1}:3", "pcgo:{1}:3", "pcgm:{1}:3"},
+                redis_connection.smembers("pzkeys:{1}"),
+            )
+            deletePieceDataFromRedis(
+                redis_connection, 1, [{"id": piece} for piece in range(1, 6)]
+            )
+            self.assertEqual(["pzm:{1}"], redis_connection.keys("*"))
+
+    def test_merge_multiple_adjacent_piece_groups(self):
+        "All adjacent piece groups within the tolerance are merged"
+        with self.app.app_context():
+            redis_connection.hset("pc:{1}:3", "4", "64,0")
+            redis_connection.hmset(
+                "pc:{1}:4", {"x": 128, "y": 64, "r": 0, "g": 4, "3": "-64,0"}
+            )
+            redis_connection.hmset("pc:{1}:5", {"x": 192, "y": 64, "r": 0, "g": 4})
+            redis_connection.sadd("pcg:{1}:4", 4, 5)
+            (msg, status) = self._piece_mutate_process(3, 66, 62).start()
+            self.assertEqual("joined", status)
+            self.assertEqual(
+                ["64", "64", "1"], redis_connection.hmget("pc:{1}:3", "x", "y", "g")
+            )
+            self.assertEqual({"4"}, redis_connection.smembers("pcgm:{1}:1"))
+            self.assertEqual(
+                {1, 2, 3, 4, 5}, get_piece_group_members(redis_connection, 1, 1)
+            )
+            self.assertEqual(
+                [{"x": "192", "y": "64", "g": "1"}],
+                resolve_piece_group_positions(
+                    redis_connection, 1, [{"x": "192", "y": "64", "g": "4"}]
+                ),
+            )
+
+    def test_merge_piece_group_adjacent_to_other_grouped_piece(self):
+        "Piece groups adjacent to the other pieces in the piece group are merged"
+        with self.app.app_context():
+            redis_connection.hset("pc:{1}:1", "4", "0,64")
+            redis_connection.hmset(
+                "pc:{1}:4", {"x": 436, "y": 500, "r": 0, "g": 4, "1": "0,-64"}
+            )
+            redis_connection.hmset("pc:{1}:5", {"x": 372, "y": 500, "r": 0, "g": 4})
+            redis_connection.sadd("pcg:{1}:4", 4, 5)
+            (msg, status) = self._piece_mutate_process(2, 505, 440).start()
+            self.assertEqual("joined", status)
+            self.assertEqual({"4"}, redis_connection.smembers("pcgm:{1}:1"))
+            self.assertEqual(
+                {1, 2, 3, 4, 5}, get_piece_group_members(redis_connection, 1, 1)
+            )
+            self.assertEqual(
+                [{"x": "372", "y": "500", "g": "1"}],
+                resolve_piece_group_positions(
+                    redis_connection, 1, [{"x": "372", "y": "500", "g": "4"}]
+                ),
+            )
+
+    def test_compress_piece_group_path(self):
+        "The piece group of the piece is set to have the root as the parent"
+        with self.app.app_context():
+            redis_connection.hmset("pcgo:{1}:1", {"x": 100, "y": 100, "n": 3})
+            redis_connection.hmset("pcgo:{1}:6", {"p": 1, "x": 10, "y": 0})
+            redis_connection.hmset("pcgo:{1}:7", {"p": 6, "x": 0, "y": 10})
+            redis_connection.hmset("pc:{1}:3", {"x": 0, "y": 0, "g": 7})
+            piece_mutate_process = self._piece_mutate_process(3, 200, 210)
+            (msg, status) = piece_mutate_process.start()
+            self.assertEqual("moved", status)
+            self.assertEqual(2, piece_mutate_process.count_of_other_pieces_in_piece_group)
+            self.assertEqual(
+                {"p": "1", "x": "10", "y": "10"}, redis_connection.hgetall("pcgo:{1}:7")
+            )
+            self.assertEqual(
+                ["190", "200"], redis_connection.hmget("pcgo:{1}:1", "x", "y")
+            )
+            self.assertEqual(
+                [{"x": "200", "y": "210", "g": "1"}],
+                resolve_piece_group_positions(
+                    redis_connection, 1, [{"x": "0", "y": "0", "g": "7"}]
+                ),
+            )
+
+    def test_resolve_piece_group_positions(self):
+        "Only pieces in a piece group with an origin are changed"
+        with self.app.app_context():
+            redis_connection.hmset("pcgo:{1}:1", {"x": 10, "y": 20})
+            self.assertEqual(
+                [
+                    {"x": 15, "y": 25, "g": "1"},
+                    {"x": 5, "y": 5, "g": "3"},
+                    {"x": 5, "y": 5, "g": None},
+                ],
+                resolve_piece_group_positions(
+                    redis_connection,
+                    1,
+                    [
+                        {"x": 5, "y": 5, "g": "1"},
+                        {"x": 5, "y": 5, "g": "3"},
+                        {"x": 5, "y": 5, "g": None},
+                    ],
+                ),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,11 @@
+import os
 import unittest
 
 from api.helper_tests import PuzzleTestCase
+from api.app import redis_connection
+from api.jobs.convertPiecesToRedis import convert
+from api.piece_geometry import get_piece_geometry_path
+from api.puzzle_keys import get_puzzle_key
 from api.database import fetch_query_string, rowify
 
 
@@ -216,6 +221,38 @@ class TestInternalPiecesView(PuzzleTestCase):
                     {"rowcount": 1, "msg": "Updated", "status_code": 200,}, rv.json,
                 )
 
+    def test_piece_geometry(self):
+        "Immutable piece properties from the piece geometry file are the same as the db"
+        with self.app.app_context():
+            with self.app.test_client() as c:
+                url = "/internal/puzzle/{puzzle_id}/pieces/".format(
+                    puzzle_id=self.puzzle_id
+                )
+                piece_geometry_path = get_piece_geometry_path(
+                    self.app.config, self.puzzle
+                )
+                for piece in self.piece_properties:
+                    piece["adjacent"] = "{}:40,0 {}:0,-40".format(
+                        (piece["id"] + 1) % 16, (piece["id"] + 4) % 16
+                    )
+                rv = c.patch(url, json={"piece_properties": self.piece_properties})
+                self.assertEqual(200, rv.status_code)
+                self.assertTrue(os.path.exists(piece_geometry_path))
+
+                rv = c.get(url)
+                self.assertEqual(200, rv.status_code)
+                self.assertEqual(
+                    {"2": [40, 0], "5": [0, -40]},
+                    rv.json["immutable_piece_properties"]["1"]["adjacent"],
+                )
+                immutable_piece_properties = rv.json["immutable_piece_properties"]
+
+                os.unlink(piece_geometry_path)
+                rv = c.get(url)
+                self.assertEqual(
+                    immutable_piece_properties, rv.json["immutable_piece_properties"]
+                )
+
     def test_delete_puzzle_pieces(self):
         "Delete puzzle piece data with DELETE request"
         with self.app.app_context():
@@ -231,5 +268,48 @@ class TestInternalPiecesView(PuzzleTestCase):
                 )
 
 
+class TestPuzzlePiecesView(PuzzleTestCase):
+    ""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            (self.puzzle_data, self.piece_properties) = self.fabricate_fake_puzzle()
+            self.puzzle = self.puzzle_data.get("id")
+            self.puzzle_id = self.puzzle_data.get("puzzle_id")
+
+    def test_packed_piece_positions(self):
+        "Pieces from the packed piece positions are the same as from each piece"
+        with self.app.app_context():
+            cur = self.db.cursor()
+            cur.execute(
+                "update Piece set adjacent = '1:40,0' where puzzle = :puzzle",
+                {"puzzle": self.puzzle},
+            )
+            self.db.commit()
+            cur.close()
+            convert(self.puzzle)
+            with self.app.test_client() as c:
+                rv = c.get(
+                    "/puzzle-pieces/{puzzle_id}/".format(puzzle_id=self.puzzle_id)
+                )
+                self.assertEqual(200, rv.status_code)
+                self.assertEqual(
+                    1, redis_connection.exists(get_puzzle_key("pcpos", self.puzzle))
+                )
+                packed_positions = rv.json["positions"]
+                self.assertEqual(
+                    [str(piece["x"]) for piece in self.piece_properties],
+                    [piece["x"] for piece in packed_positions],
+                )
+
+                redis_connection.delete(get_puzzle_key("pcpos", self.puzzle))
+                rv = c.get(
+                    "/puzzle-pieces/{puzzle_id}/".format(puzzle_id=self.puzzle_id)
+                )
+                self.assertEqual(200, rv.status_code)
+                self.assertEqual(packed_positions, rv.json["positions"])
+
+
 if __name__ == "__main__":
     unittest.main()
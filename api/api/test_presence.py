@@ -0,0 +1,76 @@
+import unittest
+
+from api.helper_tests import APITestCase
+from api.app import redis_connection
+from api.ledger import ScoreLedger
+from api.presence import (
+    record_presence,
+    count_active_players,
+    sweep_expired_members,
+    TIMELINE_RANGE,
+)
+
+
+class TestPresence(APITestCase):
+    ""
+
+    def test_count_active_players(self):
+        "Players are counted once on the puzzle and the site within the range"
+        with self.app.app_context():
+            score_ledger = ScoreLedger(redis_connection, flush_interval=0)
+            now = 10000
+            record_presence(score_ledger, 2, now - 400, 1)
+            record_presence(score_ledger, 3, now - 200, 1)
+            record_presence(score_ledger, 3, now - 100, 1)
+            record_presence(score_ledger, 4, now, 5)
+            self.assertEqual(1, count_active_players(redis_connection, now, puzzle=1))
+            self.assertEqual(1, count_active_players(redis_connection, now, puzzle=5))
+            self.assertEqual(0, count_active_players(redis_connection, now, puzzle=6))
+            self.assertEqual(2, count_active_players(redis_connection, now))
+            self.assertEqual(
+                3, count_active_players(redis_connection, now, seconds=400)
+            )
+            self.assertIn(redis_connection.ttl("presence:{1}:160"), (5 * 60, 6 * 60))
+
+
+class TestSweepExpiredMembers(APITestCase):
+    ""
+
+    def test_sweep(self):
+        "Only the members that have expired are removed"
+        with self.app.app_context():
+            now = TIMELINE_RANGE + 10000
+            redis_connection.zadd("timeline", {2: now - TIMELINE_RANGE - 1, 3: now})
+            redis_connection.zadd(
+                "timeline:{1}", {2: now - TIMELINE_RANGE - 1, 3: now - 100}
+            )
+            redis_connection.zadd("bannedusers", {2: now - 1, 3: now + 100})
+            redis_connection.zadd("blockedplayers:{1}", {2: now - 1, 3: now + 100})
+            redis_connection.zadd(
+                "pqtoken:{1}:3", {"aaaaaaaaaa": now - 400, "bbbbbbbbbb": now - 2}
+            )
+            redis_connection.sadd("pzkeys:{1}", "pqtoken:{1}:3", "pcg:{1}:3")
+            redis_connection.zadd("pcupdates:{1}", {1: 0})
+            # Puzzles that don't have pieces in redis are not swept.
+            redis_connection.zadd("blockedplayers:{2}", {2: now - 1})
+
+            self.assertEqual(5, sweep_expired_members(redis_connection, now, 300))
+            for key in (
+                "timeline",
+                "timeline:{1}",
+                "bannedusers",
+                "blockedplayers:{1}",
+            ):
+                self.assertEqual(["3"], redis_connection.zrange(key, 0, -1))
+            self.assertEqual(
+                ["bbbbbbbbbb"], redis_connection.zrange("pqtoken:{1}:3", 0, -1)
+            )
+            self.assertEqual(["1"], redis_connection.zrange("pcupdates:{1}", 0, -1))
+            self.assertEqual(
+                ["2"], redis_connection.zrange("blockedplayers:{2}", 0, -1)
+            )
+            self.assertEqual(0, sweep_expired_members(redis_connection, now, 300))
+
+
+if __name__ == "__main__":
+    unittest.main()
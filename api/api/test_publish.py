@@ -1,9 +1,15 @@
 from builtins import range
 import unittest
+from unittest import mock
 from random import randint
-from time import sleep
+from time import sleep, time
+
+import gevent
+from flask import json, make_response
 
 from api.helper_tests import APITestCase
+from api.app import redis_connection
+from api import publish
 from api.database import init_db, fetch_query_string
 from api.constants import COMPLETED
 
@@ -313,5 +319,176 @@ class PuzzlePiecesMovePublishTest(APITestCase):
                 # TODO: 412 for precondition failed. If a piece has moved after the request was sent.
 
 
+class PuzzlePiecesMoveViewTest(APITestCase):
+    "Piece move views of the publish app with the puzzle pieces in redis."
+
+    def setUp(self):
+        super(PuzzlePiecesMoveViewTest, self).setUp()
+        config = dict(self.app.config)
+        cookie_secret = config.pop("cookie_secret")
+        self.publish_app = publish.make_app(cookie_secret=cookie_secret, **config)
+        with self.publish_app.app_context():
+            redis_connection.hmset(
+                "pzq:{abc}",
+                {
+                    "puzzle": 1,
+                    "table_width": 2000,
+                    "table_height": 2000,
+                    "permission": 0,
+                    "pieces": 16,
+                },
+            )
+            for piece in (1, 2, 3):
+                redis_connection.hmset(
+                    "pc:{{1}}:{piece}".format(piece=piece),
+                    {"x": 10 * piece, "y": 20, "r": 0, "w": 40, "h": 40},
+                )
+        self.headers = {
+            "Mark": "abcdefghij",
+            "X-Real-IP": "127.0.0.1",
+            "Idempotency-Key": "move1",
+        }
+
+    def test_retry_waits_for_pending_piece_move(self):
+        "A retry of a piece move that is in progress gets the stored response"
+        response_key = publish.get_piece_move_response_key(
+            "abc", self.headers["Mark"], self.headers["Idempotency-Key"]
+        )
+
+        def store_response():
+            with self.publish_app.app_context():
+                publish.store_piece_move_response(response_key, make_response("", 204))
+
+        with self.publish_app.app_context():
+            with self.publish_app.test_client() as c:
+                redis_connection.set(response_key, json.dumps({"pending": "other"}))
+                gevent.spawn_later(0.2, store_response)
+                rv = c.patch(
+                    "/puzzle/abc/piece/1/move/",
+                    headers=dict(self.headers, Token="1234abcd"),
+                    json={"x": 500, "y": 500},
+                )
+                self.assertEqual(204, rv.status_code)
+                self.assertEqual(
+                    ["10", "20"], redis_connection.hmget("pc:{1}:1", "x", "y")
+                )
+
+    def test_claimed_piece_is_locked_until_moved(self):
+        "A piece claimed without a token can't be moved by another player first"
+        user_cookie = self.publish_app.secure_cookie.create_signed_value("user", "2")
+        with self.publish_app.test_request_context(
+            headers={"Cookie": "user={}".format(user_cookie.decode())}
+        ):
+            now = int(time())
+            (piece_token, err_response) = publish.claim_piece_for_move(
+                1, 1, "abcdefghij", "127.0.0.1", 10, 20, now
+            )
+            self.assertIsNone(err_response)
+
+            (other_token, err_response) = publish.claim_piece_for_move(
+                1, 1, "klmnopqrst", "127.0.0.1", 10, 20, now
+            )
+            self.assertIsNone(other_token)
+            self.assertEqual("piecelock", err_response.get_json()["reason"])
+
+            puzzle_data = publish.get_internal_puzzle_data("abc")
+            publish.apply_piece_move(
+                {
+                    "ip": "127.0.0.1",
+                    "user": piece_token["user"],
+                    "puzzle_data": puzzle_data,
+                    "piece": 1,
+                    "x": 500,
+                    "y": 500,
+                    "r": 0,
+                    "karma_change": 0,
+                    "karma": 1,
+                    "snapshot": None,
+                    "claim": {"token": piece_token["token"], "mark": "abcdefghij"},
+                }
+            )
+            self.assertEqual(
+                ["500", "500"], redis_connection.hmget("pc:{1}:1", "x", "y")
+            )
+            self.assertIsNone(redis_connection.get("pctoken:{1}:1"))
+            self.assertIsNone(redis_connection.get("t:{1}:abcdefghij"))
+
+    def test_batch_publishes_only_applied_moves(self):
+        "Only the piece moves in a batch that were applied are published"
+        attempt_piece_movement = publish.attempt_piece_movement
+
+        def attempt_piece_movement_except_piece_2(ip, user, puzzle_data, piece, *args):
+            if piece == 2:
+                return ({"msg": "piece can't be moved", "type": "immovable"}, 0)
+            return attempt_piece_movement(ip, user, puzzle_data, piece, *args)
+
+        def move_pieces(c, pieces):
+            now = int(time())
+            moves = []
+            for piece in pieces:
+                redis_connection.set(
+                    "pctoken:{{1}}:{piece}".format(piece=piece),
+                    "token{piece}:{mark}".format(
+                        piece=piece, mark=self.headers["Mark"]
+                    ),
+                )
+                moves.append(
+                    {
+                        "piece": piece,
+                        "x": 500 + piece,
+                        "y": 500 + piece,
+                        "r": 0,
+                        "token": publish.pack_token(
+                            self.publish_app.secure_cookie.cookie_secret,
+                            "token{piece}".format(piece=piece),
+                            1,
+                            2,
+                            piece,
+                            {"x": 10 * piece, "y": 20},
+                            self.headers["Mark"],
+                            now + 300,
+                            "0",
+                        ),
+                    }
+                )
+            return c.patch(
+                "/puzzle/abc/pieces/move/",
+                headers=self.headers,
+                json={"moves": moves},
+            )
+
+        with self.publish_app.app_context(), mock.patch.object(
+            publish, "attempt_piece_movement", attempt_piece_movement_except_piece_2
+        ), mock.patch.object(publish.sse, "publish") as sse_publish:
+            with self.publish_app.test_client() as c:
+                rv = move_pieces(c, [1, 2])
+                self.assertEqual(200, rv.status_code)
+                self.assertEqual(
+                    [204, 400], [move["status"] for move in rv.get_json()["moves"]]
+                )
+                # The bit movement is of the last piece that was moved.
+                sse_publish.assert_called_with(
+                    publish.formatBitMovementString(2, 501, 501),
+                    type="move",
+                    channel="puzzle:abc",
+                )
+                self.assertNotIn(
+                    mock.call(
+                        publish.formatBitMovementString(2, 502, 502),
+                        type="move",
+                        channel="puzzle:abc",
+                    ),
+                    sse_publish.call_args_list,
+                )
+
+                sse_publish.reset_mock()
+                rv = move_pieces(c, [2])
+                self.assertEqual(200, rv.status_code)
+                self.assertEqual(
+                    [400], [move["status"] for move in rv.get_json()["moves"]]
+                )
+                sse_publish.assert_not_called()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,226 @@
+import unittest
+
+from api.helper_tests import APITestCase
+from api.app import redis_connection
+from api.constants import ACTIVE, PRIVATE, PUBLIC
+from api.puzzle_rules import (
+    evaluate_piece_move_rules,
+    evaluate_piece_move_rules_batch,
+    PuzzlePolicyEngine,
+    PIECE_TRANSLATE_MAX_COUNT,
+    MOVES_BEFORE_PENALTY,
+    HOTSPOT_LIMIT,
+)
+
+
+class TestEvaluatePieceMoveRules(APITestCase):
+    ""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            redis_connection.hmset("pc:{1}:3", {"x": 10, "y": 20, "r": 0})
+
+    def evaluate(self, piece=3, **config):
+        self.app.config.update(config)
+        return evaluate_piece_move_rules(
+            redis_connection,
+            PuzzlePolicyEngine(self.app.config).default,
+            1,
+            2,
+            "127.0.0.1",
+            piece,
+            10,
+            20,
+            100,
+            200,
+            1000,
+        )
+
+    def test_ok(self):
+        "Initial karma is set for a new player on the puzzle"
+        with self.app.app_context():
+            self.assertEqual(
+                {"status": "ok", "karma": 10, "karma_change": 0, "recent_points": 0},
+                self.evaluate(),
+            )
+            self.assertEqual(
+                ["10", "4600"],
+                redis_connection.hmget("session:{1}:127.0.0.1", "karma", "karma:e"),
+            )
+
+    def test_session_expired_fields(self):
+        "Expired fields in the player session are removed and start over"
+        with self.app.app_context():
+            redis_connection.hmset(
+                "session:{1}:127.0.0.1",
+                {
+                    "karma": 3,
+                    "karma:e": 1000,
+                    "pcrate:2": 50,
+                    "pcrate:2:e": 900,
+                    "hotpc:2:3": 4,
+                    "hotpc:2:3:e": 1005,
+                },
+            )
+            self.assertEqual(10, self.evaluate(PUZZLE_RULES={"all"})["karma"])
+            self.assertEqual(
+                ["10", "1", "5"],
+                redis_connection.hmget(
+                    "session:{1}:127.0.0.1", "karma", "pcrate:2", "hotpc:2:3"
+                ),
+            )
+
+    def test_missing_and_immovable(self):
+        with self.app.app_context():
+            self.assertEqual({"status": "missing"}, self.evaluate(piece=4))
+            redis_connection.setbit("pcfixed:{1}", 3, 1)
+            self.assertEqual({"status": "immovable"}, self.evaluate())
+
+    def test_piece_translate_rate(self):
+        "Moving too many pieces too quickly bans the player"
+        with self.app.app_context():
+            for i in range(PIECE_TRANSLATE_MAX_COUNT - 1):
+                self.assertEqual(
+                    "ok", self.evaluate(PUZZLE_RULES={"piece_translate_rate"})["status"]
+                )
+            self.assertEqual({"status": "bannedusers"}, self.evaluate())
+
+    def test_hot_spot(self):
+        "Karma and recent points are decreased when moving a piece in a hotspot"
+        with self.app.app_context():
+            redis_connection.set("points:2", 3)
+            redis_connection.set("hotspot:{1}:2:3", HOTSPOT_LIMIT + 1)
+            result = self.evaluate(PUZZLE_RULES={"hot_spot"})
+            self.assertEqual(
+                {"status": "ok", "karma": 9, "karma_change": -1, "recent_points": 2},
+                result,
+            )
+
+    def test_hot_piece_only_when_enabled(self):
+        "Rules that are not enabled are skipped"
+        with self.app.app_context():
+            for i in range(MOVES_BEFORE_PENALTY):
+                self.evaluate(PUZZLE_RULES={"hot_piece"})
+            self.assertEqual(
+                0, self.evaluate(PUZZLE_RULES={"hot_spot"})["karma_change"]
+            )
+            self.assertEqual(-1, self.evaluate(PUZZLE_RULES={"hot_piece"})["karma_change"])
+
+    def test_blockedplayer(self):
+        "Player is blocked when karma and recent points are used up"
+        with self.app.app_context():
+            redis_connection.hmset(
+                "session:{1}:127.0.0.1", {"karma": 1, "karma:e": 2000}
+            )
+            redis_connection.set("hotspot:{1}:2:3", HOTSPOT_LIMIT + 1)
+            result = self.evaluate()
+            self.assertEqual("blockedplayer", result["status"])
+            self.assertEqual(0, result["karma"])
+            self.assertEqual(1010, result["expires"])
+            self.assertEqual(1010, redis_connection.zscore("blockedplayers:{1}", 2))
+
+    def test_batch(self):
+        "Each piece move in the batch is evaluated after the previous one"
+        with self.app.app_context():
+            redis_connection.hmset("pc:{1}:4", {"x": 10, "y": 20, "r": 0})
+            self.app.config.update(PUZZLE_RULES={"piece_translate_rate"})
+            moves = list(
+                map(
+                    lambda piece: {
+                        "piece": piece,
+                        "origin_x": 10,
+                        "origin_y": 20,
+                        "x": 100,
+                        "y": 200,
+                    },
+                    [3, 4, 5] + [3] * PIECE_TRANSLATE_MAX_COUNT,
+                )
+            )
+            results = evaluate_piece_move_rules_batch(
+                redis_connection,
+                PuzzlePolicyEngine(self.app.config).default,
+                1,
+                2,
+                "127.0.0.1",
+                moves,
+                1000,
+            )
+            self.assertEqual(len(moves), len(results))
+            self.assertEqual(
+                ["ok", "ok", "missing"], list(map(lambda x: x["status"], results[:3]))
+            )
+            self.assertEqual("bannedusers", results[-1]["status"])
+
+
+class TestPuzzlePolicyEngine(APITestCase):
+    ""
+
+    def test_rules(self):
+        "The rules are all enabled with 'all'"
+        with self.app.app_context():
+            self.app.config.update(PUZZLE_RULES={"all"})
+            policy = PuzzlePolicyEngine(self.app.config).default
+            self.assertTrue(policy.is_enabled("valid_token"))
+            self.assertTrue(policy.is_enabled("hot_spot"))
+            self.app.config.update(PUZZLE_RULES={"hot_spot"})
+            policy = PuzzlePolicyEngine(self.app.config).default
+            self.assertFalse(policy.is_enabled("valid_token"))
+            self.assertEqual({"hot_spot": True}, policy.piece_move_rules_args["rules"])
+
+    def test_overrides(self):
+        "The settings are changed for the puzzles that match the override"
+        with self.app.app_context():
+            self.app.config.update(
+                PUZZLE_POLICY_OVERRIDES=[
+                    {
+                        "max_pieces": 200,
+                        "permission": PRIVATE,
+                        "settings": {"piece_translate_max_count": 60},
+                    },
+                    {"min_pieces": 1000, "settings": {"stack_limit": 8}},
+                ]
+            )
+            puzzle_policies = PuzzlePolicyEngine(self.app.config)
+            small_private = puzzle_policies.get_for_puzzle(
+                {"pieces": 100, "status": ACTIVE, "permission": PRIVATE}
+            )
+            self.assertEqual(60, small_private.piece_translate_max_count)
+            self.assertEqual(
+                60, small_private.piece_move_rules_args["piece_translate_max_count"]
+            )
+            self.assertEqual(4, small_private.stack_limit)
+            self.assertIs(
+                small_private,
+                puzzle_policies.get(pieces=200, status=ACTIVE, permission=PRIVATE),
+            )
+            self.assertEqual(
+                PIECE_TRANSLATE_MAX_COUNT,
+                puzzle_policies.get(
+                    pieces=201, status=ACTIVE, permission=PRIVATE
+                ).piece_translate_max_count,
+            )
+            self.assertEqual(
+                PIECE_TRANSLATE_MAX_COUNT,
+                puzzle_policies.get(
+                    pieces=100, status=ACTIVE, permission=PUBLIC
+                ).piece_translate_max_count,
+            )
+            self.assertEqual(
+                8,
+                puzzle_policies.get(
+                    pieces=1000, status=ACTIVE, permission=PUBLIC
+                ).stack_limit,
+            )
+
+    def test_unknown_override_setting(self):
+        with self.app.app_context():
+            self.app.config.update(
+                PUZZLE_POLICY_OVERRIDES=[{"settings": {"stack_limitt": 8}}]
+            )
+            with self.assertRaises(ValueError):
+                PuzzlePolicyEngine(self.app.config)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+import unittest
+
+from api.helper_tests import APITestCase
+from api.app import redis_connection
+from api.redis_scripts import run_script
+from api.puzzle_keys import get_puzzle_key
+
+
+class TestPieceTokenScript(APITestCase):
+    ""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            redis_connection.hmset(
+                "pc:{1}:1", {"x": 10, "y": 20, "r": 0, "2": "64,0", "3": "0,64"}
+            )
+            redis_connection.hmset(
+                "pc:{1}:2", {"x": 300, "y": 300, "r": 0, "1": "-64,0"}
+            )
+            redis_connection.hmset(
+                "pc:{1}:3", {"x": 600, "y": 600, "r": 0, "1": "0,-64"}
+            )
+
+    def request_token(
+        self,
+        mark="abcdefghij",
+        user=2,
+        piece=1,
+        validate_token=1,
+        queue_wait_budget=0,
+        origin=[],
+    ):
+        return run_script(
+            redis_connection,
+            "piece_token",
+            keys=[get_puzzle_key("pc", 1, piece)],
+            args=[
+                1,
+                piece,
+                user,
+                mark,
+                1000,
+                "token123",
+                validate_token,
+                5,
+                300,
+                queue_wait_budget,
+            ]
+            + origin,
+        )
+
+    def test_grant(self):
+        "Token is granted with the snapshot and the token keys are set"
+        with self.app.app_context():
+            redis_connection.set("pzq_current:{1}", 4)
+            result = self.request_token()
+            self.assertEqual(
+                [
+                    "grant",
+                    "1",
+                    "10",
+                    "20",
+                    "4",
+                    "2_300_300_0_-64,0:3_600_600_0_0,-64",
+                ],
+                result,
+            )
+            self.assertEqual(
+                "token123:abcdefghij", redis_connection.get("pctoken:{1}:1")
+            )
+            self.assertEqual("1:1:2", redis_connection.get("t:{1}:abcdefghij"))
+
+    def test_missing_piece(self):
+        with self.app.app_context():
+            self.assertEqual(["puzzleimmutable"], self.request_token(piece=9))
+
+    def test_immovable(self):
+        with self.app.app_context():
+            redis_connection.setbit("pcfixed:{1}", 1, 1)
+            self.assertEqual(["immovable"], self.request_token())
+
+    def test_blockedplayer(self):
+        with self.app.app_context():
+            redis_connection.zadd("blockedplayers:{1}", {2: 1010})
+            self.assertEqual(["blockedplayer", "1010"], self.request_token())
+
+    def test_concurrent(self):
+        "Player already has a token for another piece"
+        with self.app.app_context():
+            self.assertEqual("grant", self.request_token(piece=2)[0])
+            self.assertEqual(["concurrent"], self.request_token(piece=1))
+
+    def test_piecequeue_and_piecelock(self):
+        "Other players are queued for a piece while it is locked"
+        with self.app.app_context():
+            self.assertEqual("grant", self.request_token(mark="aaaaaaaaaa", user=2)[0])
+            self.assertEqual(["piecelock"], self.request_token(mark="bbbbbbbbbb", user=3))
+            self.assertEqual(
+                ["piecequeue", 1], self.request_token(mark="cccccccccc", user=4)
+            )
+            self.assertTrue(redis_connection.sismember("pzkeys:{1}", "pqtoken:{1}:1"))
+
+    def test_no_token_validation(self):
+        "No token keys are set when not validating tokens"
+        with self.app.app_context():
+            result = self.request_token(validate_token=0)
+            self.assertEqual("grant", result[0])
+            self.assertIsNone(redis_connection.get("pctoken:{1}:1"))
+
+    def test_origin(self):
+        "Piece can be moved without a token when it is free and at the origin"
+        with self.app.app_context():
+            self.assertEqual("grant", self.request_token(origin=[10, 20])[0])
+            # The piece is locked for the player until it is moved.
+            self.assertEqual(
+                "token123:abcdefghij", redis_connection.get("pctoken:{1}:1")
+            )
+            self.assertEqual("1:1:2", redis_connection.get("t:{1}:abcdefghij"))
+            self.assertEqual(
+                ["piecelock"],
+                self.request_token(mark="bbbbbbbbbb", user=3, origin=[10, 20]),
+            )
+            self.assertEqual(["moved"], self.request_token(origin=[11, 20]))
+
+    def test_origin_piece_not_free(self):
+        "Piece can't be moved without a token when another player has it"
+        with self.app.app_context():
+            self.assertEqual("grant", self.request_token(mark="aaaaaaaaaa", user=3)[0])
+            self.assertEqual(["piecelock"], self.request_token(origin=[10, 20]))
+            redis_connection.zadd("pqtoken:{1}:1", {"bbbbbbbbbb": 1000})
+            self.assertEqual(["piecequeue", 1], self.request_token(origin=[10, 20]))
+            self.assertIsNone(redis_connection.zscore("pqtoken:{1}:1", "abcdefghij"))
+
+    def test_busy(self):
+        "Token is not granted when the queued piece moves would take too long"
+        with self.app.app_context():
+            redis_connection.rpush("pzq_moves:{1}", *range(10))
+            redis_connection.lpush("pzq_service:{1}", 0.5, 0.3)
+            self.assertEqual("grant", self.request_token(queue_wait_budget=5)[0])
+            self.assertEqual(
+                ["busy", 2], self.request_token(mark="bbbbbbbbbb", queue_wait_budget=2)
+            )
+            self.assertEqual(
+                ["busy", 2],
+                self.request_token(
+                    mark="bbbbbbbbbb", queue_wait_budget=2, origin=[10, 20]
+                ),
+            )
+
+
+class TestReleasePieceTokenScript(APITestCase):
+    ""
+
+    def release_token(self, token="token123", mark="abcdefghij"):
+        return run_script(
+            redis_connection,
+            "release_piece_token",
+            keys=["pctoken:{1}:1", get_puzzle_key("t", 1, mark)],
+            args=[token, mark],
+        )
+
+    def test_release(self):
+        "Token can only be used once"
+        with self.app.app_context():
+            redis_connection.set("pctoken:{1}:1", "token123:abcdefghij")
+            redis_connection.set("t:{1}:abcdefghij", "1:1:2")
+            self.assertEqual(1, self.release_token())
+            self.assertIsNone(redis_connection.get("pctoken:{1}:1"))
+            self.assertIsNone(redis_connection.get("t:{1}:abcdefghij"))
+            self.assertEqual(0, self.release_token())
+
+    def test_invalid(self):
+        "Token or mark doesn't match the one for the piece"
+        with self.app.app_context():
+            redis_connection.set("pctoken:{1}:1", "token123:abcdefghij")
+            self.assertEqual(-1, self.release_token(token="other123"))
+            self.assertEqual(-1, self.release_token(mark="bbbbbbbbbb"))
+            self.assertEqual(
+                "token123:abcdefghij", redis_connection.get("pctoken:{1}:1")
+            )
+
+
+class TestBitmapPositionsScript(APITestCase):
+    ""
+
+    def test_positions(self):
+        "Positions of the set bits are returned in order"
+        with self.app.app_context():
+            for piece in (3, 0, 60000):
+                redis_connection.setbit("pcfixed:{1}", piece, 1)
+            self.assertEqual(
+                [0, 3, 60000],
+                run_script(redis_connection, "bitmap_positions", keys=["pcfixed:{1}"]),
+            )
+
+    def test_missing(self):
+        "No positions for a missing bitmap"
+        with self.app.app_context():
+            self.assertEqual(
+                [],
+                run_script(redis_connection, "bitmap_positions", keys=["pcfixed:{1}"]),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+import unittest
+import json
+
+from api.helper_tests import APITestCase
+from api.app import redis_connection
+from api.sequencer import (
+    PuzzleMoveSequencer,
+    PuzzleMoveSequencerError,
+    PuzzleMoveSequencerTimeout,
+    get_moves_key,
+    get_worker_key,
+    get_service_time_key,
+    get_pending_key,
+    MOVE_KIND,
+)
+
+
+class TestPuzzleMoveSequencer(APITestCase):
+    ""
+
+    def test_submit_returns_result(self):
+        "The submitted move is applied and the result returned"
+        applied = []
+
+        def apply_move(move):
+            applied.append(move)
+            return [move["piece"], "moved"]
+
+        with self.app.app_context():
+            sequencer = PuzzleMoveSequencer(redis_connection, 1, apply_move, timeout=2)
+            result = sequencer.submit({"piece": 3})
+            self.assertEqual([3, "moved"], result)
+            self.assertEqual([{"piece": 3}], applied)
+            # The lease is released after the queue has been drained
+            self.assertIsNone(redis_connection.get(get_worker_key(1)))
+            self.assertEqual(0, redis_connection.llen(get_moves_key(1)))
+            # The time it took to apply the move is recorded
+            self.assertEqual(1, redis_connection.llen(get_service_time_key(1)))
+
+    def test_queued_moves_applied_in_order(self):
+        "Moves queued before the submit are applied first and in order"
+        applied = []
+
+        def apply_move(move):
+            applied.append(move["piece"])
+            return move["piece"]
+
+        with self.app.app_context():
+            for piece in (1, 2):
+                redis_connection.rpush(
+                    get_moves_key(1),
+                    json.dumps({"id": f"queued{piece}", "move": {"piece": piece}}),
+                )
+            sequencer = PuzzleMoveSequencer(redis_connection, 1, apply_move, timeout=2)
+            result = sequencer.submit({"piece": 3})
+            self.assertEqual(3, result)
+            self.assertEqual([1, 2, 3], applied)
+            self.assertEqual(
+                {"result": 1}, json.loads(redis_connection.lpop("pzq_result:queued1"))
+            )
+
+    def test_superseded_move_is_skipped(self):
+        "A queued move is skipped when a newer move with the same coalesce key is submitted"
+        applied = []
+
+        def apply_move(move):
+            applied.append(move["piece"])
+            return move["x"]
+
+        with self.app.app_context():
+            redis_connection.rpush(
+                get_moves_key(1),
+                json.dumps(
+                    {
+                        "id": "queued1",
+                        "move": {"piece": 3, "x": 10},
+                        "coalesce_key": "2:3",
+                    }
+                ),
+            )
+            redis_connection.hset(get_pending_key(1), "2:3", "queued1")
+            sequencer = PuzzleMoveSequencer(redis_connection, 1, apply_move, timeout=2)
+            result = sequencer.submit({"piece": 3, "x": 20}, coalesce_key="2:3")
+            self.assertEqual(20, result)
+            self.assertEqual([3], applied)
+            self.assertEqual(
+                {"superseded": True},
+                json.loads(redis_connection.lpop("pzq_result:queued1")),
+            )
+            self.assertFalse(redis_connection.hexists(get_pending_key(1), "2:3"))
+
+    def test_apply_move_error(self):
+        "Errors when applying a move are raised in the submitter"
+
+        def apply_move(move):
+            raise Exception("broken")
+
+        with self.app.app_context():
+            sequencer = PuzzleMoveSequencer(redis_connection, 1, apply_move, timeout=2)
+            with self.assertRaises(PuzzleMoveSequencerError):
+                sequencer.submit({"piece": 3})
+            self.assertIsNone(redis_connection.get(get_worker_key(1)))
+
+    def test_timeout_when_other_worker_holds_lease(self):
+        "The move is removed from the queue if not applied before the timeout"
+
+        def apply_move(move):
+            return "moved"
+
+        with self.app.app_context():
+            redis_connection.set(get_worker_key(1), "other", ex=10)
+            sequencer = PuzzleMoveSequencer(redis_connection, 1, apply_move, timeout=1)
+            with self.assertRaises(PuzzleMoveSequencerTimeout):
+                sequencer.submit({"piece": 3})
+            self.assertEqual(0, redis_connection.llen(get_moves_key(1)))
+            self.assertEqual("other", redis_connection.get(get_worker_key(1)))
+
+    def test_queued_moves_of_each_kind(self):
+        "Queued moves are applied with the apply function for their kind"
+        applied = []
+
+        def apply_move(move):
+            applied.append(move["piece"])
+            return move["piece"]
+
+        def apply_batch(batch):
+            applied.append([move["piece"] for move in batch["moves"]])
+            return len(batch["moves"])
+
+        apply_moves = {MOVE_KIND: apply_move, "batch": apply_batch}
+        with self.app.app_context():
+            redis_connection.rpush(
+                get_moves_key(1),
+                json.dumps(
+                    {
+                        "id": "queued1",
+                        "kind": "batch",
+                        "move": {"moves": [{"piece": 1}, {"piece": 2}]},
+                    }
+                ),
+                json.dumps({"id": "queued2", "kind": MOVE_KIND, "move": {"piece": 3}}),
+            )
+            sequencer = PuzzleMoveSequencer(redis_connection, 1, apply_moves, timeout=2)
+            result = sequencer.submit({"moves": [{"piece": 4}]}, kind="batch")
+            self.assertEqual(1, result)
+            self.assertEqual([[1, 2], 3, [4]], applied)
+            self.assertEqual(
+                {"result": 2}, json.loads(redis_connection.lpop("pzq_result:queued1"))
+            )
+            self.assertEqual(
+                {"result": 3}, json.loads(redis_connection.lpop("pzq_result:queued2"))
+            )
+
+            # A sequencer without the apply function for a kind of move that
+            # was queued sets an error for that move instead of stopping.
+            redis_connection.rpush(
+                get_moves_key(1),
+                json.dumps({"id": "queued3", "kind": "batch", "move": {"moves": []}}),
+            )
+            sequencer = PuzzleMoveSequencer(redis_connection, 1, apply_move, timeout=2)
+            self.assertEqual(5, sequencer.submit({"piece": 5}))
+            self.assertIn(
+                "error", json.loads(redis_connection.lpop("pzq_result:queued3"))
+            )
+            with self.assertRaises(PuzzleMoveSequencerError):
+                sequencer.submit({"moves": []}, kind="batch")
+
+    def test_worker_stops_after_own_move(self):
+        "The worker hands off the moves queued after its own move"
+        queued = json.dumps({"id": "queued1", "move": {"piece": 4}})
+        applied = []
+
+        def apply_move(move):
+            applied.append(move["piece"])
+            # Another request submits a move while this one is applied.
+            redis_connection.rpush(get_moves_key(1), queued)
+            return move["piece"]
+
+        with self.app.app_context():
+            sequencer = PuzzleMoveSequencer(redis_connection, 1, apply_move, timeout=2)
+            self.assertEqual(3, sequencer.submit({"piece": 3}))
+            self.assertEqual([3], applied)
+            self.assertEqual([queued], redis_connection.lrange(get_moves_key(1), 0, -1))
+            self.assertIsNone(redis_connection.get(get_worker_key(1)))
+            self.assertEqual(
+                {"handoff": True},
+                json.loads(redis_connection.lpop("pzq_result:queued1")),
+            )
+
+    def test_worker_stops_when_lease_is_lost(self):
+        "The worker stops applying moves when another worker has the lease"
+        applied = []
+
+        def apply_move(move):
+            applied.append(move["piece"])
+            # The lease expired while the move was applied.
+            redis_connection.set(get_worker_key(1), "other", ex=10)
+            return move["piece"]
+
+        with self.app.app_context():
+            redis_connection.rpush(
+                get_moves_key(1),
+                json.dumps({"id": "queued1", "move": {"piece": 1}}),
+            )
+            sequencer = PuzzleMoveSequencer(redis_connection, 1, apply_move, timeout=1)
+            with self.assertRaises(PuzzleMoveSequencerTimeout):
+                sequencer.submit({"piece": 3})
+            self.assertEqual([1], applied)
+            self.assertEqual("other", redis_connection.get(get_worker_key(1)))
+            self.assertEqual(0, redis_connection.llen(get_moves_key(1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -38,8 +38,10 @@ from docopt import docopt
 from flask import current_app
 
 from api.app import db, redis_connection, make_app
-from api.tools import loadConfig, init_karma_key
+from api.tools import loadConfig
 from api.user import generate_user_login
+from api.puzzle_keys import get_puzzle_key
+from api.player_session import init_player_session
 from api.constants import (
     ACTIVE,
     CLASSIC,
@@ -529,10 +531,10 @@ class PuzzlePieces:
         self.puzzle_id = puzzle_id
 
         for user_session in self.user_sessions:
-            karma_key = init_karma_key(
+            session_key = init_player_session(
                 redis_connection, self.puzzle, user_session.ip, current_app.config
             )
-            redis_connection.delete(karma_key)
+            redis_connection.delete(session_key)
 
         self.puzzle_pieces = self.user_sessions[0].get_data(
             "/puzzle-pieces/{0}/".format(self.puzzle_id), "api"
@@ -569,15 +571,15 @@ class PuzzlePieces:
             )
         except Exception as err:
             # ("resetting karma for {ip}".format(ip=user_session.ip))
-            karma_key = init_karma_key(
+            session_key = init_player_session(
                 redis_connection, self.puzzle, user_session.ip, current_app.config
             )
-            redis_connection.delete(karma_key)
+            redis_connection.delete(session_key)
             redis_connection.zrem("bannedusers", user_session.shareduser)
             # current_app.logger.debug(f"get token error: {err}")
             if str(err) == "blockedplayer":
-                blockedplayers_for_puzzle_key = "blockedplayers:{puzzle}".format(
-                    puzzle=self.puzzle
+                blockedplayers_for_puzzle_key = get_puzzle_key(
+                    "blockedplayers", self.puzzle
                 )
                 # current_app.logger.debug("clear out {}".format(blockedplayers_for_puzzle_key))
                 redis_connection.delete(blockedplayers_for_puzzle_key)
@@ -601,28 +603,28 @@ class PuzzlePieces:
                 else:
                     # current_app.logger.debug('move exception {}'.format(err))
                     # current_app.logger.debug("resetting karma for {ip}".format(ip=user_session.ip))
-                    karma_key = init_karma_key(
+                    session_key = init_player_session(
                         redis_connection,
                         self.puzzle,
                         user_session.ip,
                         current_app.config,
                     )
-                    redis_connection.delete(karma_key)
+                    redis_connection.delete(session_key)
                     redis_connection.zrem("bannedusers", user_session.shareduser)
                 return
             if puzzle_pieces_move:
                 if puzzle_pieces_move.get("msg") == "boing":
                     raise Exception("boing")
-                # Reset karma:puzzle:ip redis key when it gets low
+                # Reset the player session when the karma gets low
                 if puzzle_pieces_move["karma"] < 2:
                     # print("resetting karma for {ip}".format(ip=user_session.ip))
-                    karma_key = init_karma_key(
+                    session_key = init_player_session(
                         redis_connection,
                         self.puzzle,
                         user_session.ip,
                         current_app.config,
                     )
-                    redis_connection.delete(karma_key)
+                    redis_connection.delete(session_key)
             else:
                 # empty response (204) means success
                 end = time.perf_counter()
@@ -9,6 +9,7 @@ from flask.views import MethodView
 
 from api.app import redis_connection, db
 from api.database import rowify, fetch_query_string
+from api.puzzle_keys import get_puzzle_key
 
 
 def add_to_timeline(puzzle_id, player, points=0, timestamp=None, message=""):
@@ -88,8 +89,8 @@ def delete_puzzle_timeline(puzzle_id):
     cur.close()
     db.commit()
 
-    redis_connection.delete("timeline:{puzzle}".format(puzzle=puzzle))
-    redis_connection.delete("score:{puzzle}".format(puzzle=puzzle))
+    redis_connection.delete(get_puzzle_key("timeline", puzzle))
+    redis_connection.delete(get_puzzle_key("score", puzzle))
 
     msg = {"rowcount": result.rowcount, "msg": "Deleted", "status_code": 200}
     return msg
@@ -7,8 +7,20 @@ import sqlite3
 from flask import Config
 import redis
 
+from api.puzzle_keys import (
+    get_puzzle_key,
+    get_pcupdates_key,
+    get_puzzle_keys_registry_key,
+    get_puzzle_teardown_key,
+)
+
 INITIAL_KARMA = 10
 HOUR = 3600  # hour in seconds
+# Count of keys to remove with each UNLINK when deleting the piece data.
+UNLINK_BATCH_SIZE = 500
+# Seconds that the piece mutations are stopped for if the teardown of the piece
+# data doesn't finish.
+TEARDOWN_TIMEOUT = 60
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -68,53 +80,60 @@ def formatPieceMovementString(piece_id, x="", y="", r="", g="", s="", **args):
     return u":{piece_id}:{x}:{y}:{r}:{g}:{s}".format(**locals())
 
 
+def formatPieceGroupMovementString(piece_id, x, y, g, offset_x, offset_y):
+    "The piece moved to x, y and the other pieces in the piece group g moved by the offset."
+    return u":{piece_id}:{x}:{y}::{g}::{offset_x}:{offset_y}".format(**locals())
+
+
+def formatPieceGroupMergeString(piece_id, g, merged_g):
+    "The pieces in the piece group merged_g are now in the piece group g."
+    return u":{piece_id}::::{g}:::{merged_g}".format(**locals())
+
+
 def formatBitMovementString(user_id, x="", y=""):
     return u":{user_id}:{x}:{y}".format(**locals())
 
 
-def init_karma_key(redis_connection, puzzle, ip, app_config):
+def deletePieceDataFromRedis(redis_connection, puzzle, all_pieces):
     """
-    Initialize the karma value and expiration if not set.
+    Remove the piece data for the puzzle from redis.  The pc key of each piece
+    and the piece group keys in the registry (pzkeys) are removed with UNLINK in
+    batches so a large puzzle doesn't block redis while it is freed.  The
+    teardown key is set until then so the piece mutations that don't watch
+    the pzm id also fail.
     """
-    karma_key = "karma:{puzzle}:{ip}".format(puzzle=puzzle, ip=ip)
-    if redis_connection.setnx(karma_key, app_config["INITIAL_KARMA"]):
-        redis_connection.expire(karma_key, app_config["KARMA_POINTS_EXPIRE"])
-    return karma_key
-
-
-def deletePieceDataFromRedis(redis_connection, puzzle, all_pieces):
-    groups = set()
-    pzm_puzzle_key = "pzm:{puzzle}".format(puzzle=puzzle)
+    pzm_puzzle_key = get_puzzle_key("pzm", puzzle)
     # Bump the pzm id when preparing to mutate the puzzle.
     puzzle_mutation_id = redis_connection.incr(pzm_puzzle_key)
+    teardown_key = get_puzzle_teardown_key(puzzle)
+    redis_connection.set(teardown_key, puzzle_mutation_id, ex=TEARDOWN_TIMEOUT)
 
     redis_connection.publish(f"enforcer_stop:{puzzle}", "")
 
-    with redis_connection.pipeline(transaction=True) as pipe:
-        # Delete all piece data
-        for piece in all_pieces:
-            pipe.delete("pc:{puzzle}:{id}".format(puzzle=puzzle, id=piece["id"]))
-            # Blind delete all groups (ignore if group id doesn't exist)
-            pipe.delete("pcg:{puzzle}:{g}".format(puzzle=puzzle, g=piece["id"]))
-
-        # Delete Piece Fixed
-        pipe.delete("pcfixed:{puzzle}".format(puzzle=puzzle))
-
-        # Delete Piece Stacked
-        pipe.delete("pcstacked:{puzzle}".format(puzzle=puzzle))
-
-        # pcx is deprecated, but should still delete it if it is there.
-        # Delete Piece X
-        pipe.delete("pcx:{puzzle}".format(puzzle=puzzle))
-
-        # pcy is deprecated, but should still delete it if it is there.
-        # Delete Piece Y
-        pipe.delete("pcy:{puzzle}".format(puzzle=puzzle))
-
-        # Remove from the pcupdates sorted set
-        pipe.zrem("pcupdates", puzzle)
-
+    registry_key = get_puzzle_keys_registry_key(puzzle)
+    keys = [get_puzzle_key("pc", puzzle, piece["id"]) for piece in all_pieces]
+    keys.extend(redis_connection.sscan_iter(registry_key, count=UNLINK_BATCH_SIZE))
+    keys.extend(
+        [
+            registry_key,
+            get_puzzle_key("pcfixed", puzzle),
+            get_puzzle_key("pcstacked", puzzle),
+            get_puzzle_key("pcpos", puzzle),
+            # pcx and pcy are deprecated, but should still delete them if they
+            # are there.
+            get_puzzle_key("pcx", puzzle),
+            get_puzzle_key("pcy", puzzle),
+        ]
+    )
+    with redis_connection.pipeline(transaction=False) as pipe:
+        for index in range(0, len(keys), UNLINK_BATCH_SIZE):
+            pipe.unlink(*keys[index : index + UNLINK_BATCH_SIZE])
         pipe.execute()
+    redis_connection.delete(teardown_key)
+
+    # Remove from the pcupdates sorted set. It is not in the same hash slot as
+    # the keys for the puzzle.
+    redis_connection.zrem(get_pcupdates_key(puzzle), puzzle)
 
 
 def check_bg_color(bg_color):
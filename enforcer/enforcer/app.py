@@ -1,17 +1,54 @@
+import os
 import signal
+import socket
 import sys
-from time import sleep
+import time
 import logging
 
 from api.tools import loadConfig, get_redis_connection
+from api.puzzle_rules import PuzzlePolicyEngine
+from api.enforcer_lease import (
+    heartbeat_instance,
+    remove_instance,
+    get_preferred_instance,
+    acquire_lease,
+    renew_lease,
+    release_lease,
+    HEARTBEAT_INTERVAL,
+)
 import enforcer.process
 
 
 logger = logging.getLogger(__name__)
 
+# All the enforcer channels are for a puzzle ({name}:{puzzle}) and are received
+# on the one pubsub connection.
+CHANNEL_PATTERNS = (
+    "enforcer_token_request:*",
+    "enforcer_piece_translate:*",
+    "enforcer_piece_group_translate:*",
+    "enforcer_piece_group_move:*",
+    "enforcer_stop:*",
+)
+
+# Longest time in seconds to wait for a message before checking for puzzles
+# that are no longer active.
+MAX_WAIT = 1.0
+
 
 class EnforcerApp:
-    "Enforcer App"
+    """
+    Enforcer App
+
+    Dispatches the messages from a single pattern subscription to the process
+    for each active puzzle.  The app waits on the pubsub socket and the process
+    for a puzzle is only switched to when it has messages in its queue.
+
+    More than one enforcer app can run.  A process is only started for a puzzle
+    when this instance is the preferred instance for it and has the lease on
+    it (see api/enforcer_lease.py).  The leases are renewed on each heartbeat
+    and the puzzles that are preferred by a different instance are released.
+    """
 
     def __init__(self, config_file, **kw):
         config = loadConfig(config_file)
@@ -19,64 +56,117 @@ class EnforcerApp:
         logger.setLevel(logging.DEBUG if config["DEBUG"] else logging.INFO)
         self.halt = False
         self.config = config
-        self.greenlet_list = []
-        self.pubsub = get_redis_connection(self.config, decode_responses=False).pubsub(
-            ignore_subscribe_messages=False
+        # The processes share the connection since only one runs at a time.
+        self.redis_connection = get_redis_connection(
+            self.config, decode_responses=False
         )
-        self.active_puzzles = set()
+        self.pubsub = self.redis_connection.pubsub(ignore_subscribe_messages=True)
+        # Process for each active puzzle
+        self.processes = {}
+        self.puzzle_policies = PuzzlePolicyEngine(self.config)
+        self.next_cleanup = time.time() + MAX_WAIT
+        self.instance = f"{socket.gethostname()}:{os.getpid()}"
+        # Live enforcer instances from the last heartbeat
+        self.instances = []
+        self.next_heartbeat = 0
 
         signal.signal(signal.SIGINT, self.cleanup)
 
-    def handle_active_puzzle(self, message):
-        "message = '{user}:{piece}:{x}:{y}'"
+    def start_process(self, puzzle):
+        "Start the process for a puzzle that has a new token request."
+        if get_preferred_instance(puzzle, self.instances) != self.instance:
+            return None
+        if not acquire_lease(self.redis_connection, puzzle, self.instance):
+            # The previous owner has not released it yet.
+            return None
+        logger.info(f"new active puzzle {puzzle}")
+        try:
+            process = enforcer.process.Process(
+                self.config,
+                puzzle,
+                puzzle_policies=self.puzzle_policies,
+                redis_connection=self.redis_connection,
+            )
+        except Exception as err:
+            release_lease(self.redis_connection, puzzle, self.instance)
+            logger.error(err)
+            return None
+        self.processes[puzzle] = process
+        return process
+
+    def switch_to_process(self, process):
+        "Let the process handle its queued messages or finish if inactive."
+        process.switch()
+        if process.dead:
+            logger.info(f"remove inactive puzzle {process.puzzle}")
+            del self.processes[process.puzzle]
+            release_lease(self.redis_connection, process.puzzle, self.instance)
+
+    def dispatch(self, message):
+        "Queue the message from channel '{name}:{puzzle}' for the puzzle process."
         channel = message.get("channel", b"").decode()
-        puzzle = int(channel.split(":")[1])
-        if puzzle not in self.active_puzzles:
-            logger.info(f"new active puzzle {puzzle}")
-            self.active_puzzles.add(puzzle)
-
-            try:
-                process = enforcer.process.Process(self.config, puzzle)
-            except Exception as err:
-                self.active_puzzles.remove(puzzle)
-                logger.error(err)
+        (name, puzzle) = channel.split(":", 1)
+        puzzle = int(puzzle)
+        process = self.processes.get(puzzle)
+        if process is None:
+            # Only a token request makes a puzzle active.
+            if name != "enforcer_token_request":
+                return
+            process = self.start_process(puzzle)
+            if process is None:
+                return
+        process.messages.append(message)
+        self.switch_to_process(process)
+
+    def remove_inactive_processes(self):
+        now = time.time()
+        for process in list(self.processes.values()):
+            if process.end <= now:
+                self.switch_to_process(process)
+
+    def heartbeat(self):
+        "Renew the leases and stop the processes for the puzzles to hand off."
+        now = time.time()
+        self.instances = heartbeat_instance(self.redis_connection, self.instance, now)
+        for process in list(self.processes.values()):
+            puzzle = process.puzzle
+            if get_preferred_instance(puzzle, self.instances) != self.instance:
+                logger.info(f"hand off puzzle {puzzle}")
+            elif not renew_lease(self.redis_connection, puzzle, self.instance):
+                logger.info(f"lost the lease on puzzle {puzzle}")
             else:
-                self.greenlet_list.append(process)
+                continue
+            process.halt = True
+            self.switch_to_process(process)
+        self.next_heartbeat = now + HEARTBEAT_INTERVAL
 
     def start(self):
-        logger.info("Starting Enforcer App")
-        self.pubsub.psubscribe(
-            **{"enforcer_token_request:*": self.handle_active_puzzle}
-        )
+        logger.info(f"Starting Enforcer App {self.instance}")
+        self.heartbeat()
+        self.pubsub.psubscribe(*CHANNEL_PATTERNS)
 
         while not self.halt:
-            pmessage = self.pubsub.get_message()
+            pmessage = self.pubsub.get_message(timeout=MAX_WAIT)
             if pmessage:
                 logger.debug(f"enforcer app got message {pmessage}")
+                self.dispatch(pmessage)
+
+            if time.time() >= self.next_cleanup:
+                self.remove_inactive_processes()
+                self.next_cleanup = time.time() + MAX_WAIT
 
-            clean_up_list = False
-            for process_glet in self.greenlet_list:
-                result = process_glet.switch()
-                if result == "DONE":
-                    clean_up_list = True
-            if clean_up_list:
-                new_list = []
-                for process_glet in self.greenlet_list:
-                    if process_glet.dead:
-                        logger.info(f"remove inactive puzzle {process_glet.puzzle}")
-                        self.active_puzzles.remove(process_glet.puzzle)
-                    else:
-                        new_list.append(process_glet)
-                self.greenlet_list = new_list
-
-            sleep(0.001)
+            if time.time() >= self.next_heartbeat:
+                self.heartbeat()
         self.close()
 
     def close(self):
         logger.info("Closing Enforcer App")
         self.halt = True
-        self.pubsub.punsubscribe("enforcer_token_request:*")
+        self.pubsub.punsubscribe(*CHANNEL_PATTERNS)
         self.pubsub.close()
+        for puzzle in self.processes:
+            release_lease(self.redis_connection, puzzle, self.instance)
+        remove_instance(self.redis_connection, self.instance)
         sys.exit(0)
 
     def cleanup(self, signal, frame):
@@ -1,17 +1,20 @@
 import time
 import logging
 
+from api.puzzle_keys import get_puzzle_key
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-HOTSPOT_EXPIRE = 30
-
 
 class HotSpot:
     ""
 
-    def __init__(self, redis_connection, hotspot_idx, piece_properties, config):
+    def __init__(
+        self, redis_connection, hotspot_idx, piece_properties, config, policy
+    ):
         self.config = config
+        self.policy = policy
         logger.setLevel(logging.DEBUG if config["DEBUG"] else logging.INFO)
         self.redis_connection = redis_connection
         self.hotspot_idx = hotspot_idx
@@ -27,7 +30,7 @@ class HotSpot:
         ]
         # The hotspot_id is time based so it can be removed when it gets old.
         hotspot_id = int((time.time() - self.hotspot_init_time) * 1000)
-        hotspot_expire_id = hotspot_id - (HOTSPOT_EXPIRE * 1000)
+        hotspot_expire_id = hotspot_id - (self.policy.hotspot_expire * 1000)
 
         overlapping_pieces = []
         for item in self.hotspot_idx.intersection(piece_bbox, objects=True):
@@ -41,8 +44,10 @@ class HotSpot:
         # TODO: Handle hotspot by overlaying the actual piece mask with each
         # found overlapping piece.
 
-        hotspot_piece_key = f"hotspot:{puzzle}:{user}:{piece}"
+        hotspot_piece_key = get_puzzle_key("hotspot", puzzle, user, piece)
         hotspot_count = len(overlapping_pieces) + 1
-        self.redis_connection.set(hotspot_piece_key, hotspot_count, ex=HOTSPOT_EXPIRE)
+        self.redis_connection.set(
+            hotspot_piece_key, hotspot_count, ex=self.policy.hotspot_expire
+        )
         self.hotspot_idx.insert(hotspot_id, piece_bbox, [user, piece])
         logger.debug(f"hotspot recorded {hotspot_piece_key} {hotspot_count}")
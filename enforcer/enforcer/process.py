@@ -1,6 +1,6 @@
 import time
 import logging
-import atexit
+from collections import deque
 
 from greenlet import getcurrent, greenlet, GreenletExit
 import requests
@@ -8,6 +8,10 @@ from rtree import index
 
 from api.constants import ACTIVE, BUGGY_UNLISTED
 from api.tools import get_redis_connection
+from api.puzzle_rules import PuzzlePolicyEngine
+from api.piece_mutate import get_piece_group_members
+from api.piece_geometry import load_piece_geometry
+from api.puzzle_keys import get_puzzle_key
 import enforcer.hotspot
 import enforcer.proximity
 
@@ -21,53 +25,39 @@ MAX_TTL = TTL * 5
 HOTSPOT_GRID_SIZE = 40
 
 
-def start(config, puzzle):
-    """
-    Triggered when a puzzle first becomes active from the enforcer_token_request
-    channel. This will start a subscription on the specific channels for the
-    puzzle to monitor piece movements and update the stacked piece status, piece
-    proximity, and hotspots.
-    The process will end after 5 minutes of inactivity. This frees up resources
-    if the puzzle isn't active anymore.
-    """
-
-    logger.setLevel(logging.DEBUG if config["DEBUG"] else logging.INFO)
-    process = Process(config, puzzle)
-    process.start()
-    logger.debug("process start is done")
-    process.close()
-
-    return puzzle
-
-
 class Process(greenlet):
     ""
 
-    def __init__(self, config, puzzle):
+    def __init__(self, config, puzzle, puzzle_policies=None, redis_connection=None):
         super().__init__()
+        logger.setLevel(logging.DEBUG if config["DEBUG"] else logging.INFO)
         self.halt = False
         self.config = config
         self.puzzle = puzzle
-        self.pubsub = get_redis_connection(self.config, decode_responses=False).pubsub(
-            ignore_subscribe_messages=False
-        )
-        self.redis_connection = get_redis_connection(
-            self.config, decode_responses=False
-        )
+        if puzzle_policies is None:
+            puzzle_policies = PuzzlePolicyEngine(config)
+        if redis_connection is None:
+            redis_connection = get_redis_connection(self.config, decode_responses=False)
+        self.redis_connection = redis_connection
+        # Messages for the puzzle that are added by the enforcer app
+        self.messages = deque()
+        self.message_handlers = {
+            "enforcer_piece_group_translate": self.handle_piece_group_translate_message,
+            "enforcer_piece_group_move": self.handle_piece_group_move_message,
+            "enforcer_piece_translate": self.handle_piece_translate_message,
+            "enforcer_token_request": self.update_active_puzzle,
+            "enforcer_stop": self.handle_stop,
+        }
         self.now = time.time()
         self.end = self.now + TTL
         self.limit = self.now + MAX_TTL
 
         self.enable_proximity = bool(
-            len(
-                {"all", "stack_pieces", "max_stack_pieces"}.intersection(
-                    self.config["PUZZLE_RULES"]
-                )
-            )
+            {"stack_pieces", "max_stack_pieces"}.intersection(puzzle_policies.rules)
         )
 
         if not self.enable_proximity:
-            self.redis_connection.delete(f"pcstacked:{puzzle}")
+            self.redis_connection.delete(get_puzzle_key("pcstacked", puzzle))
 
         logger.info(f"Puzzle {puzzle} init now: {self.now}")
         # setup puzzle bbox index
@@ -75,11 +65,13 @@ class Process(greenlet):
         (puzzle_data, piece_properties, hotspot_idx, proximity_idx, origin_bboxes) = create_index(
             self.config, self.redis_connection, puzzle
         )
+        self.policy = puzzle_policies.get_for_puzzle(puzzle_data)
         self.hotspot = enforcer.hotspot.HotSpot(
             self.redis_connection,
             hotspot_idx,
             piece_properties,
             self.config,
+            self.policy,
         )
         if self.enable_proximity:
             self.proximity = enforcer.proximity.Proximity(
@@ -89,6 +81,7 @@ class Process(greenlet):
                 puzzle_data,
                 piece_properties,
                 self.config,
+                self.policy,
             )
 
     def update_active_puzzle(self, message):
@@ -101,7 +94,7 @@ class Process(greenlet):
     def handle_piece_translate_message(self, message):
         "enforcer_piece_translate:{puzzle} {user}:{piece}:{origin_x}:{origin_y}:{x}:{y}"
         logger.debug("handle_piece_translate_message")
-        if message.get("type") != "message":
+        if message.get("type") != "pmessage":
             return
         channel = message.get("channel", b"").decode()
         data = message.get("data", b"").decode()
@@ -121,7 +114,7 @@ class Process(greenlet):
         if not self.enable_proximity:
             # At this time only the proximity process uses this information
             return
-        if message.get("type") != "message":
+        if message.get("type") != "pmessage":
             return
         channel = message.get("channel", b"").decode()
         data = message.get("data", b"").decode()
@@ -133,30 +126,65 @@ class Process(greenlet):
         pieces = list(map(lambda x: list(map(int, x.split(":"))), data.split("_")))
         self.proximity.batch_process(puzzle, pieces)
 
+    def handle_piece_group_move_message(self, message):
+        "enforcer_piece_group_move:{puzzle} {user}:{piece_group}:{offset_x}:{offset_y}"
+        logger.debug("handle_piece_group_move_message")
+        if not self.enable_proximity:
+            # At this time only the proximity process uses this information
+            return
+        if message.get("type") != "pmessage":
+            return
+        channel = message.get("channel", b"").decode()
+        data = message.get("data", b"").decode()
+        if not data:
+            logger.debug("piece group move no data?")
+            return
+
+        puzzle = int(channel.split(":")[1])
+        (user, piece_group, offset_x, offset_y) = map(int, data.split(":"))
+        # Only the piece group origin was moved so the new positions are from
+        # the tracked bboxes of the pieces in the group.
+        origin_bboxes = self.proximity.internal_origin_bboxes
+        pieces = []
+        for piece in get_piece_group_members(
+            self.redis_connection, puzzle, piece_group
+        ):
+            bbox = origin_bboxes.get(piece)
+            if bbox is None:
+                continue
+            pieces.append([user, piece, bbox[0] + offset_x, bbox[1] + offset_y])
+        if pieces:
+            self.proximity.batch_process(puzzle, pieces)
+
     def handle_stop(self, message):
         ""
-        if message.get("type") != "message":
+        if message.get("type") != "pmessage":
             return
         logger.info(f"Stopping enforcer process for puzzle {self.puzzle}")
         self.halt = True
 
+    def handle_message(self, message):
+        "Handle the message for the channel '{name}:{puzzle}'"
+        name = message.get("channel", b"").decode().split(":")[0]
+        handler = self.message_handlers.get(name)
+        if handler is not None:
+            handler(message)
+
     def run(self):
-        ""
+        """
+        Handle the queued messages and then switch back to the enforcer app
+        until there are more.  Finishes when the puzzle has been inactive for
+        the TTL.
+        """
 
         logger.debug(f"Puzzle {self.puzzle} run")
-        self.pubsub.subscribe(
-            **{
-                f"enforcer_piece_group_translate:{self.puzzle}": self.handle_piece_group_translate_message,
-                f"enforcer_piece_translate:{self.puzzle}": self.handle_piece_translate_message,
-                f"enforcer_token_request:{self.puzzle}": self.update_active_puzzle,
-                f"enforcer_stop:{self.puzzle}": self.handle_stop,
-            }
-        )
-        atexit.register(self.halt_process)
         try:
-            while not self.halt and self.now < self.end:
+            while True:
+                while self.messages and not self.halt:
+                    self.handle_message(self.messages.popleft())
                 self.now = time.time()
-                self.pubsub.get_message()
+                if self.halt or self.now >= self.end:
+                    break
                 getcurrent().parent.switch()
         except GreenletExit:
             logger.info(f"{self.puzzle}: Got GreenletExit; quitting")
@@ -166,24 +194,15 @@ class Process(greenlet):
 
     def close(self):
         ""
-        self.pubsub.unsubscribe(f"enforcer_piece_group_translate:{self.puzzle}")
-        self.pubsub.unsubscribe(f"enforcer_piece_translate:{self.puzzle}")
-        self.pubsub.unsubscribe(f"enforcer_token_request:{self.puzzle}")
-        self.pubsub.unsubscribe(f"enforcer_stop:{self.puzzle}")
-        self.pubsub.close()
+        self.messages.clear()
         logger.info(f"Finish process on puzzle {self.puzzle}")
 
-    def halt_process(self):
-        self.halt = True
-        logger.debug("halt process")
-        self.close()
-
 
 def piece_positions_from_line(line):
     d = {}
     for item in line.split(","):
         values = item.split(":")
-        if len(values) != 7:
+        if len(values) not in (7, 9):
             continue
         pc_id = int(values[1])
         pc = d.get(pc_id, {})
@@ -199,6 +218,29 @@ def piece_positions_from_line(line):
     return d
 
 
+def piece_group_updates_from_line(line):
+    """
+    List of piece group moves as (piece_group, piece, offset_x, offset_y) and
+    piece group merges as (piece_group, merged_piece_group) in the order they
+    are in the line.
+    """
+    updates = []
+    for item in line.split(","):
+        values = item.split(":")
+        if len(values) == 9:
+            updates.append(
+                (int(values[5]), int(values[1]), int(values[7]), int(values[8]))
+            )
+        elif len(values) == 10:
+            updates.append((int(values[5]), int(values[9])))
+    return updates
+
+
+def in_piece_group(piece, piece_group):
+    g = piece.get("g")
+    return g not in (None, "") and int(g) == piece_group
+
+
 def create_index(config, redis_connection, puzzle):
     ""
     # TODO: create a hotspot index which will have a grid of bboxes
@@ -221,23 +263,28 @@ def create_index(config, redis_connection, puzzle):
 
     puzzle_id = puzzle_data["puzzle_id"]
 
-    req = requests.get(
-        f"http://{HOSTAPI}:{PORTAPI}/internal/puzzle/{puzzle_id}/pieces/"
-    )
-    if req.status_code >= 400:
-        logger.error(f"puzzle {puzzle_id} not available")
-        raise Exception(puzzle)
-    try:
-        result = req.json()
-    except ValueError as err:
-        logger.error(f"internal api error {err}")
-        raise Exception(puzzle)
     adjacent_pieces = {}
-    for piece_id, piece_prop in result["immutable_piece_properties"].items():
-        adjacent = {}
-        for adjacent_piece_id, adjacent_offset in piece_prop["adjacent"].items():
-            adjacent[int(adjacent_piece_id)] = adjacent_offset
-        adjacent_pieces[int(piece_id)] = adjacent
+    piece_geometry = load_piece_geometry(config, puzzle)
+    if piece_geometry is not None:
+        for piece_id, piece_prop in piece_geometry.items():
+            adjacent_pieces[piece_id] = piece_prop["adjacent"]
+    else:
+        req = requests.get(
+            f"http://{HOSTAPI}:{PORTAPI}/internal/puzzle/{puzzle_id}/pieces/"
+        )
+        if req.status_code >= 400:
+            logger.error(f"puzzle {puzzle_id} not available")
+            raise Exception(puzzle)
+        try:
+            result = req.json()
+        except ValueError as err:
+            logger.error(f"internal api error {err}")
+            raise Exception(puzzle)
+        for piece_id, piece_prop in result["immutable_piece_properties"].items():
+            adjacent = {}
+            for adjacent_piece_id, adjacent_offset in piece_prop["adjacent"].items():
+                adjacent[int(adjacent_piece_id)] = adjacent_offset
+            adjacent_pieces[int(piece_id)] = adjacent
 
     req = requests.get(
         f"http://external-puzzle-massive/newapi/puzzle-pieces/{puzzle_id}/"
@@ -256,17 +303,33 @@ def create_index(config, redis_connection, puzzle):
     stamp = piece_data["timestamp"]
     # pcu:{stamp} is also used in api pieces.py
     pcu_key = f"pcu:{stamp}"
-    piece_updates = {}
+    pieces = dict(
+        [(int(piece["id"]), piece) for piece in piece_data.get("positions", [])]
+    )
     for line in redis_connection.lrange(pcu_key, 0, -1):
         line = line.decode()
-        piece_updates.update(piece_positions_from_line(line))
-    has_updates = bool(len(piece_updates))
+        for (pc_id, piece_update) in piece_positions_from_line(line).items():
+            if pc_id in pieces:
+                pieces[pc_id].update(piece_update)
+        # The other pieces in a piece group that was moved by the group
+        # origin are only in the line as the offset. The pieces in a piece
+        # group that was merged are only in the line as the merged piece group.
+        for update in piece_group_updates_from_line(line):
+            if len(update) == 2:
+                (piece_group, merged_piece_group) = update
+                for piece in pieces.values():
+                    if in_piece_group(piece, merged_piece_group):
+                        piece["g"] = piece_group
+                continue
+            (piece_group, moved_piece, offset_x, offset_y) = update
+            for (pc_id, piece) in pieces.items():
+                if pc_id != moved_piece and in_piece_group(piece, piece_group):
+                    piece["x"] = int(piece["x"]) + offset_x
+                    piece["y"] = int(piece["y"]) + offset_y
     piece_properties = {}
 
-    for piece in piece_data.get("positions", []):
+    for piece in pieces.values():
         pc_id = int(piece["id"])
-        if has_updates:
-            piece.update(piece_updates.get(pc_id, {}))
         for k in ("id", "x", "y", "r", "w", "h", "b", "rotate"):
             # Not tracking "g" and "s" for group and status since they are
             # updated in a different process.
@@ -4,15 +4,12 @@ import logging
 import requests
 
 from api.tools import formatPieceMovementString
+from api.piece_status import get_status_pieces, set_status_pieces
+from api.puzzle_keys import get_puzzle_key
 
 logger = logging.getLogger(__name__)
 
-# TODO: make these configurable in the site.cfg, they could also be configurable
-# per puzzle.
-SINGLE_STACK_THRESHOLD = 1
-GROUP_STACK_THRESHOLD = 1
-STACK_COST_THRESHOLD = 2
-STACK_LIMIT = 4
+# The stack thresholds are set in the puzzle policy.
 OVERLAP_THRESHOLD = 0.5
 
 
@@ -28,9 +25,17 @@ class Proximity:
     """
 
     def __init__(
-        self, redis_connection, proximity_idx, origin_bboxes, puzzle_data, piece_properties, config
+        self,
+        redis_connection,
+        proximity_idx,
+        origin_bboxes,
+        puzzle_data,
+        piece_properties,
+        config,
+        policy,
     ):
         self.config = config
+        self.policy = policy
         logger.setLevel(logging.DEBUG if config["DEBUG"] else logging.INFO)
         self.redis_connection = redis_connection
         self.proximity_idx = proximity_idx
@@ -61,8 +66,8 @@ class Proximity:
             x + w,
             y + h,
         )
-        pcfixed = set(
-            map(int, self.redis_connection.smembers(f"pcfixed:{puzzle}"))
+        pcfixed = get_status_pieces(
+            self.redis_connection, get_puzzle_key("pcfixed", puzzle)
         )
 
         # Reassess stacked pieces that were intersecting with the piece origin
@@ -72,7 +77,7 @@ class Proximity:
         for piece_id, stack_count in origin_stack_counts.items():
             if piece_id == piece:
                 reset_stacked_ids.add(piece_id)
-            elif stack_count <= SINGLE_STACK_THRESHOLD:
+            elif stack_count <= self.policy.single_stack_threshold:
                 reset_stacked_ids.add(piece_id)
 
         def reject_piece_move():
@@ -109,14 +114,14 @@ class Proximity:
         past_stack_cost_threshold = False
         target_stack_counts = self.get_stack_counts(piece_bbox, pcfixed=pcfixed)
         for piece_id, stack_count in target_stack_counts.items():
-            if stack_count > STACK_LIMIT:
+            if stack_count > self.policy.stack_limit:
                 piece_move_rejected = reject_piece_move()
                 break
             if piece_id in pcfixed:
                 continue
-            if stack_count > SINGLE_STACK_THRESHOLD:
+            if stack_count > self.policy.single_stack_threshold:
                 stacked_piece_ids.add(piece_id)
-            if stack_count > STACK_COST_THRESHOLD:
+            if stack_count > self.policy.stack_cost_threshold:
                 past_stack_cost_threshold = True
 
         if not piece_move_rejected and past_stack_cost_threshold:
@@ -134,16 +139,14 @@ class Proximity:
     def update_stack_status(self, puzzle, piece_ids, stacked=True):
         if len(piece_ids) == 0:
             return
-        if stacked:
-            self.redis_connection.sadd(
-                "pcstacked:{puzzle}".format(puzzle=puzzle),
-                *piece_ids,
-            )
-        else:
-            self.redis_connection.srem(
-                "pcstacked:{puzzle}".format(puzzle=puzzle),
-                *piece_ids,
+        with self.redis_connection.pipeline(transaction=False) as pipe:
+            set_status_pieces(
+                pipe,
+                get_puzzle_key("pcstacked", puzzle),
+                piece_ids,
+                value=1 if stacked else 0,
             )
+            pipe.execute()
 
     def publish_piece_status_update(self, reset_stacked_ids, stacked_piece_ids):
         """
@@ -174,8 +177,8 @@ class Proximity:
         "Update the piece bboxes for all pieces that moved in a group"
         stacked_piece_ids = set()
         reset_stacked_ids = set()
-        pcfixed = set(
-            map(int, self.redis_connection.smembers(f"pcfixed:{puzzle}"))
+        pcfixed = get_status_pieces(
+            self.redis_connection, get_puzzle_key("pcfixed", puzzle)
         )
         for pc in pieces:
             (user, piece, x, y) = pc
@@ -197,17 +200,16 @@ class Proximity:
             for piece_id, stack_count in origin_stack_counts.items():
                 if piece_id == piece:
                     reset_stacked_ids.add(piece_id)
-                elif stack_count <= GROUP_STACK_THRESHOLD:
+                elif stack_count <= self.policy.group_stack_threshold:
                     reset_stacked_ids.add(piece_id)
 
-
             # Reassess stacked pieces that are now intersecting with the piece after
             # it moved.
             target_stack_counts = self.get_stack_counts(piece_bbox, pcfixed=pcfixed)
             for piece_id, stack_count in target_stack_counts.items():
                 if piece_id in pcfixed:
                     continue
-                if stack_count > GROUP_STACK_THRESHOLD:
+                if stack_count > self.policy.group_stack_threshold:
                     stacked_piece_ids.add(piece_id)
 
         reset_stacked_ids.difference_update(stacked_piece_ids)
@@ -280,12 +282,12 @@ class Proximity:
 
         # Not updating karma points and publishing since don't have ip here and
         # would need to send a request to the api in order to publish on sse.
-        # karma_key = f"karma:{puzzle}:{ip}"
+        # session_key = get_puzzle_key("session", puzzle, ip)
         # # Extend the karma points expiration since it has changed
-        # self.redis_connection.expire(
-        #     karma_key, self.config["KARMA_POINTS_EXPIRE"]
+        # self.redis_connection.hset(
+        #     session_key, "karma:e", now + self.config["KARMA_POINTS_EXPIRE"]
         # )
-        # karma = self.redis_connection.decr(karma_key)
+        # karma = self.redis_connection.hincrby(session_key, "karma", -1)
         # karma_change = -1
 
         # if karma_change and user != ANONYMOUS_USER_ID:
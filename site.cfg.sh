@@ -91,6 +91,12 @@ PUZZLE_ARCHIVE = "${ARCHIVEDIR}"
 # accessible via web.  Used for storing uploaded puzzles.
 PUZZLE_RESOURCES = "${SRVDIR}resources"
 
+# Directory for the piece geometry files (piece sizes and adjacent piece
+# offsets) of each puzzle. These are memory mapped by the api and the enforcer
+# so it needs to be on the same server as them. Comment out to always read
+# these from the database.
+PUZZLE_GEOMETRY = "${DATABASEDIR}geometry"
+
 # If using the ROOT_FOLDER then you will need to set the PUBLIC_URL_PREFIX to
 # something other than '/'.
 #PUBLIC_URL_PREFIX = "/"
@@ -284,6 +290,27 @@ PLAYER_BIT_RECENT_ACTIVITY_TIMEOUT = 10
 # Set at 100 pixels for players with a touch device since the accuracy is around
 # 50 pixels. 50 to the left + 50 to the right for example.
 PIECE_JOIN_TOLERANCE = 100
+# Concurrency mode when mutating pieces on a puzzle. Set to "puzzle" to
+# apply piece moves one at a time for each puzzle. Set to "piece" to allow piece
+# moves that don't touch the same pieces or piece groups to be applied at the
+# same time. Conflicting piece moves are retried and then applied in order.
+PIECE_MUTATE_CONCURRENCY = "piece"
+# Engine to use when mutating pieces. The "process" engine reads and writes the
+# pieces with redis transactions. The "script" engine does it all in a single
+# redis Lua script.
+PIECE_MUTATE_ENGINE = "process"
+# Store the positions of the pieces in a piece group relative to the origin of
+# the piece group so moving a piece group only updates the origin. Piece groups
+# are also merged without changing the pieces in them. Needs the "process"
+# PIECE_MUTATE_ENGINE.
+#PIECE_GROUP_POSITIONS = "relative"
+# Allow players to move a piece without getting a token first when the piece is
+# still at the origin and no other player is moving it.
+PIECE_MOVE_FAST_PATH = False
+# Don't give out piece tokens on a puzzle when the piece moves that are already
+# waiting to be applied would take longer than this many seconds. Defaults to
+# the PIECE_MOVE_TIMEOUT.
+#PIECE_MOVE_QUEUE_WAIT_BUDGET = 4
 
 AUTO_APPROVE_PUZZLES=True if "${AUTO_APPROVE_PUZZLES}".lower() == "y" else False
 
@@ -296,6 +323,12 @@ PUZZLE_RESOURCES_BUCKET_OBJECT_CACHE_CONTROL = "${PUZZLE_RESOURCES_BUCKET_OBJECT
 
 # See PUZZLE_RULES_HELP_TEXT in bin/create_dot_env.sh
 PUZZLE_RULES = set("${PUZZLE_RULES}".split())
+# Change the limits of the puzzle rules for some puzzles. See the
+# api/api/puzzle_rules.py for the settings that can be changed. For example,
+# allow more piece moves on small private puzzles:
+#PUZZLE_POLICY_OVERRIDES = [
+#    {"max_pieces": 200, "permission": 1, "settings": {"piece_translate_max_count": 60}},
+#]
 
 # Enable puzzle features. Run python api/api/update_enabled_puzzle_features.py
 # if this changes.
@@ -13,6 +13,10 @@ export interface PieceMovementData {
   x?: number;
   y?: number;
   r?: number;
+  // The other pieces in the piece group (parent) moved by this offset.
+  groupOffset?: { x: number; y: number };
+  // The pieces in this piece group are now in the piece group (parent).
+  mergedGroup?: number;
   karma?: number; // from PuzzleService piece/move/rejected
 }
 
@@ -175,8 +179,13 @@ class DivulgerService {
       let items = line.split(",");
       items.forEach((item) => {
         let values = item.split(":");
-        if (values.length === 7) {
-          // puzzle_id, piece_id, x, y, r, parent, status
+        if (
+          values.length === 7 ||
+          values.length === 9 ||
+          values.length === 10
+        ) {
+          // puzzle_id, piece_id, x, y, r, parent, status, offset_x, offset_y,
+          // merged_parent
           const pieceData: PieceMovementData = {
             id: Number(values[1]),
           };
@@ -193,6 +202,15 @@ class DivulgerService {
           if (values[3] !== "") {
             pieceData.y = Number(values[3]);
           }
+          if (values.length >= 9 && values[7] !== "") {
+            pieceData.groupOffset = {
+              x: Number(values[7]),
+              y: Number(values[8]),
+            };
+          }
+          if (values.length === 10) {
+            pieceData.mergedGroup = Number(values[9]);
+          }
           // TODO: Add pieceData.r from values[4] when rotate of pieces is enabled
           this._broadcast(pieceUpdate, pieceData);
         } else if (values.length === 4) {
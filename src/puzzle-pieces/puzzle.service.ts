@@ -11,7 +11,6 @@ interface PieceMovement {
   piece: number;
   inProcess: boolean;
   token?: string;
-  snap?: string;
   tokenRequest?: Function;
   moveRequest?: Function;
   fail?: boolean;
@@ -91,7 +90,6 @@ interface TokenData {
   token: string;
   lock: number;
   expires: number;
-  snap?: string;
 }
 enum TokenRequestErrorTypes {
   puzzlereload = "puzzlereload",
@@ -334,7 +332,6 @@ class PuzzleService {
         .get<TokenData>()
         .then((tokenData) => {
           pieceMovement.token = tokenData.token;
-          pieceMovement.snap = tokenData.snap;
         })
         .catch((responseObj: TokenRequestError) => {
           //let responseObj;
@@ -447,7 +444,6 @@ class PuzzleService {
       return movePuzzlePieceService
         .patchNoContent(data, {
           Token: pieceMovement.token,
-          Snap: pieceMovement.snap,
           Mark: self.mark,
         })
         .catch((patchError) => {
@@ -660,8 +656,31 @@ class PuzzleService {
 
   private onPieceUpdate(data: Array<PieceMovementData>) {
     // TODO: rename
+    let groupMovements: Array<PieceData> = [];
     let pieceMovements = data.map((pieceMovementData) => {
       let piece = this.pieces[pieceMovementData.id];
+      const { groupOffset, mergedGroup, ...movementData } = pieceMovementData;
+      if (groupOffset && movementData.parent !== undefined) {
+        // Only the offset is sent for the other pieces in the piece group.
+        Object.values(this.pieces).forEach((groupPiece) => {
+          if (
+            groupPiece.parent === movementData.parent &&
+            groupPiece.id !== movementData.id
+          ) {
+            groupPiece.x = groupPiece.x + groupOffset.x;
+            groupPiece.y = groupPiece.y + groupOffset.y;
+            groupMovements.push(groupPiece);
+          }
+        });
+      }
+      if (mergedGroup !== undefined && movementData.parent !== undefined) {
+        Object.values(this.pieces).forEach((groupPiece) => {
+          if (groupPiece.parent === mergedGroup) {
+            groupPiece.parent = movementData.parent;
+            groupMovements.push(groupPiece);
+          }
+        });
+      }
       if (piece.pending) {
         this.unSelectPiece(pieceMovementData.id);
       }
@@ -671,10 +690,11 @@ class PuzzleService {
           this.isWaitingOnMoveRequest = false;
         }, 1);
       }
-      piece = Object.assign(piece, pieceMovementData);
+      piece = Object.assign(piece, movementData);
       piece.pending = false;
       return piece;
     });
+    pieceMovements = pieceMovements.concat(groupMovements);
     this._broadcast(piecesMutate, pieceMovements);
     if (this.piecesPaused) {
       this._broadcast(piecesShadowMutate, pieceMovements);